@@ -0,0 +1,483 @@
+"""BENCHMARKS
+
+Times the workloads of the checkers on reproducible fixtures: a synthetic
+kernel-sized formula over the BOOL and TRISTATE options of an alloptions csv
+(examples/alloptions-x86.4.14.152.csv by default) and a corpus of .config
+files drawn from it, half of them valid and half of them invalid.
+
+Every phase runs in a fresh process, so that its peak RSS is its own, and is
+repeated; the best time is kept. The DIMACS cache (see :mod:`dimacsio`) is
+warm, except for the parse phase which does not use it. The startup phase
+times ``main.py --help``, which must stay within a budget and must not import
+the checkers.
+Results can be saved as a baseline and later runs compared against it.
+The reference baseline, :data:`BASELINE`, holds the default fixtures on the
+machine it was recorded on, which the JSON records with the parameters of
+the fixtures; a run on another machine is compared with it but does not
+fail on a regression. A baseline of your own machine is recorded with::
+
+    python benchmark.py --save my-baseline.json
+    python benchmark.py --baseline my-baseline.json
+"""
+
+from multiprocessing import get_context
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pysat.solvers import Solver
+import config_check
+import dimacsio
+import file
+import sampler
+import sanity
+import utils
+
+ALLOPTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "examples", "alloptions-x86.4.14.152.csv")
+RANDCONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "examples", "randconfig")
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# reference baseline, compared with by default
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "examples", "benchmark-baseline.json")
+
+# phases, in the order they run
+PHASES = ("startup", "parse", "index", "file_index", "read_config", "sanity",
+          "config_check", "batch")
+
+# invocations of ``main.py --help`` timed by the startup phase, and the
+# seconds one of them may take
+STARTUP_RUNS = 10
+STARTUP_BUDGET = 0.15
+
+# modules main.py must not import before a checker is selected
+HEAVY_MODULES = ("numpy", "pandas", "pysat.solvers")
+
+# relative slowdown (or memory increase) reported as a regression
+THRESHOLD = 0.10
+
+# machine description (see machine) under which timings are comparable
+SAME_MACHINE = ("processor", "cpus", "python")
+
+
+def _options(alloptions_file, scale):
+    """BOOL and TRISTATE options of an alloptions csv, MODULES first"""
+    alloptions = utils.Alloptions(alloptions_file)
+    options = [(option, alloptions.get_kconfig_type(option))
+               for option in sorted(alloptions.get_options())
+               if alloptions.get_kconfig_type(option) in ("BOOL",
+                                                         "TRISTATE")]
+    options = options[:max(1, int(len(options) * scale))]
+    return [("MODULES", "BOOL")] + [o for o in options if o[0] != "MODULES"]
+
+
+def synthetic_formula(alloptions_file, path, scale=1.0, seed=0):
+    """Writes a kernel-like formula over the options of an alloptions csv
+
+    As in the formulas of kconfigreader, a TRISTATE option has a
+    ``_MODULE`` variable, modules need MODULES, options depend on earlier
+    ones (conjunctions, disjunctions and module dependencies), select later
+    ones, a few are dead and choices are encoded with ``CHOICE_`` variables.
+    Every clause has a negative literal, so the formula is satisfiable.
+
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param path: DIMACS file to write
+    :type path: str
+    :param scale: share of the options to keep
+    :type scale: float
+    :param seed: random seed
+    :type seed: int
+    :return: number of variables and clauses
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    names, clauses = [], []
+
+    def new(name):
+        names.append(name)
+        return len(names)
+
+    symbols = []
+    for option, kconfig_type in _options(alloptions_file, scale):
+        k = new(option)
+        kmodule = new(option + "_MODULE") if kconfig_type == "TRISTATE" \
+            else None
+        symbols.append((k, kmodule))
+    modules = symbols[0][0]
+    bools = [k for k, kmodule in symbols if kmodule is None]
+    for i, (k, kmodule) in enumerate(symbols):
+        if kmodule is not None:
+            clauses.append([-k, -kmodule])
+            clauses.append([-kmodule, modules])
+        if i < 2:
+            continue
+        r = rng.random()
+        if r < 0.7:
+            deps = rng.sample(symbols[1:i], min(i - 1, rng.randint(1, 3)))
+            for d, dmodule in deps:
+                clauses.append([-k, d] if dmodule is None else
+                               [-k, d, dmodule])
+                if kmodule is not None:
+                    clauses.append([-kmodule, d] if dmodule is None else
+                                   [-kmodule, d, dmodule])
+        elif r < 0.9:
+            (d1, _), (d2, _) = rng.sample(symbols[1:i], 2) if i > 2 else \
+                (symbols[1], symbols[1])
+            clauses.append([-k, d1, d2])
+        elif r < 0.905:
+            clauses.append([-k])
+        if rng.random() < 0.1:
+            clauses.append([-k, rng.choice(bools)])
+    for _ in range(len(bools) // 50):
+        choice = new("CHOICE_{}".format(len(names)))
+        group = rng.sample(bools, rng.randint(2, 6))
+        clauses.append([-choice] + group)
+        for j, a in enumerate(group):
+            clauses.append([-a, choice])
+            clauses.extend([-a, -b] for b in group[j + 1:])
+
+    with open(path, 'w') as stream:
+        for var, name in enumerate(names, 1):
+            stream.write("c {} {}\n".format(var, name))
+        stream.write("p cnf {} {}\n".format(len(names), len(clauses)))
+        for clause in clauses:
+            stream.write(" ".join(map(str, clause)) + " 0\n")
+    return len(names), len(clauses)
+
+
+def synthetic_configs(dimacs, alloptions_file, nb, output, seed=0):
+    """Writes .config files of a formula, half of them valid
+
+    Valid configurations are models of the formula found with random
+    phases; invalid ones are valid ones with a few values changed.
+
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param nb: number of configurations
+    :type nb: int
+    :param output: directory of the .config files
+    :type output: str
+    :param seed: random seed
+    :type seed: int
+    """
+    rng = random.Random(seed)
+    fla = utils.DimacsFla(dimacs, cache_dir=None)
+    symbols = utils.symbol_types(fla, utils.Alloptions(alloptions_file))
+    os.makedirs(output, exist_ok=True)
+    with Solver(bootstrap_with=fla.get_formula().clauses) as solver:
+        for i in range(nb):
+            solver.set_phases(literals=[
+                k if rng.random() < 0.3 else -k for k, _, _, _ in symbols])
+            solver.solve()
+            lines = sampler.config_lines(solver.get_model(), symbols)
+            if i % 2:
+                for j in rng.sample(range(len(lines)), 3):
+                    v = symbols[j][1]
+                    lines[j] = "CONFIG_{}=y".format(v) \
+                        if lines[j].startswith('#') \
+                        else "# CONFIG_{} is not set".format(v)
+            with open(os.path.join(output, "config_{}".format(i)),
+                      'w') as stream:
+                stream.write("#\n# Benchmark configuration {}\n#\n".format(i))
+                stream.write("\n".join(lines) + "\n")
+
+
+def fixtures(directory, alloptions_file=ALLOPTIONS, scale=1.0, nb_configs=200,
+             seed=0):
+    """Builds the fixtures once; they are rebuilt if the parameters change
+
+    :return: {"dimacs", "cache", "alloptions", "configs", "randconfig"}
+             paths
+    :rtype: dict
+    """
+    params = {"alloptions": os.path.abspath(alloptions_file),
+              "alloptions_hash": dimacsio.file_hash(alloptions_file),
+              "scale": scale, "nb_configs": nb_configs, "seed": seed}
+    meta = os.path.join(directory, "fixtures.json")
+    paths = {"dimacs": os.path.join(directory, "formula.dimacs"),
+             "cache": os.path.join(directory, "cache"),
+             "alloptions": os.path.abspath(alloptions_file),
+             "configs": os.path.join(directory, "configs"),
+             "randconfig": RANDCONFIG}
+    if os.path.exists(meta):
+        with open(meta, 'r') as stream:
+            if json.load(stream).get("params") == params:
+                return paths
+    os.makedirs(directory, exist_ok=True)
+    shutil.rmtree(paths["configs"], ignore_errors=True)
+    nb_vars, nb_clauses = synthetic_formula(alloptions_file, paths["dimacs"],
+                                            scale, seed)
+    synthetic_configs(paths["dimacs"], alloptions_file, nb_configs,
+                      paths["configs"], seed)
+    with open(meta, 'w') as stream:
+        json.dump({"params": params, "variables": nb_vars,
+                   "clauses": nb_clauses}, stream, indent=1)
+    return paths
+
+
+def _peak_rss():
+    """Peak resident set size of the process, in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _configs(paths):
+    return sorted(os.path.join(paths["configs"], name)
+                  for name in os.listdir(paths["configs"]))
+
+
+def _run_phase(phase, paths):
+    """Runs a phase in a worker process
+
+    :return: (seconds, number of items, unit of the items, peak RSS)
+    :rtype: tuple
+    """
+    # the DIMACS cache of the fixtures (see run) is warm, except when parsing
+    dimacsio.load(paths["dimacs"])
+    if phase == "startup":
+        loaded = subprocess.run(
+            [sys.executable, "-c", "import sys; sys.path.insert(0, {!r}); "
+             "import main; print(' '.join(sorted(set({!r}) & "
+             "set(sys.modules))))".format(os.path.dirname(MAIN),
+                                          HEAVY_MODULES)],
+            check=True, capture_output=True, text=True).stdout.split()
+        if loaded:
+            raise RuntimeError("main.py imports {}".format(", ".join(loaded)))
+        start = time.perf_counter()
+        for _ in range(STARTUP_RUNS):
+            subprocess.run([sys.executable, MAIN, "--help"], check=True,
+                           stdout=subprocess.DEVNULL)
+        nb = STARTUP_RUNS
+        unit = "runs"
+    elif phase == "parse":
+        start = time.perf_counter()
+        nb = dimacsio.parse(paths["dimacs"]).get_nb_clauses()
+        unit = "clauses"
+    elif phase == "index":
+        start = time.perf_counter()
+        dimacs = utils.DimacsFla(paths["dimacs"])
+        nb = len(utils.symbol_types(dimacs,
+                                    utils.Alloptions(paths["alloptions"])))
+        unit = "symbols"
+    elif phase == "file_index":
+        start = time.perf_counter()
+        dimacs = file.DimacsFile(paths["dimacs"])
+        nb = len(dimacs.getNameVariationDict())
+        unit = "symbols"
+    elif phase == "read_config":
+        configs = _configs(paths)
+        start = time.perf_counter()
+        for path in configs:
+            utils.read_config(path)
+        nb = len(configs)
+        unit = "configs"
+    elif phase == "sanity":
+        nb = len(utils.symbol_types(utils.DimacsFla(paths["dimacs"]),
+                                    utils.Alloptions(paths["alloptions"])))
+        start = time.perf_counter()
+        sanity.sanity_check_optionsvalues(paths["dimacs"],
+                                          paths["alloptions"])
+        unit = "symbols"
+    elif phase == "config_check":
+        start = time.perf_counter()
+        config_check.config_check(paths["randconfig"], paths["dimacs"],
+                                  paths["alloptions"])
+        nb = 1
+        unit = "configs"
+    elif phase == "batch":
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            nb = config_check.batch_check(
+                [paths["configs"]], paths["dimacs"], paths["alloptions"],
+                os.path.join(tmp, "batch.csv"))
+        unit = "configs"
+    else:
+        raise ValueError("unknown phase {}".format(phase))
+    seconds = time.perf_counter() - start
+    return seconds, nb, unit, _peak_rss()
+
+
+def machine():
+    """Describes the machine, to tell whether timings are comparable
+
+    :return: {"platform", "processor", "cpus", "memory", "python"}
+    :rtype: dict
+    """
+    processor = platform.processor()
+    try:
+        with open("/proc/cpuinfo", 'r') as stream:
+            processor = next((line.split(':', 1)[1].strip()
+                              for line in stream
+                              if line.startswith("model name")), processor)
+    except OSError:
+        pass
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    return {"platform": platform.platform(),
+            "processor": processor or platform.machine(),
+            "cpus": os.cpu_count(), "memory": memory,
+            "python": sys.version.split()[0]}
+
+
+def run(paths, phases=PHASES, repeat=3, verbose=False):
+    """Runs phases, each in fresh processes
+
+    :param paths: fixtures, as given by :func:`fixtures`
+    :type paths: dict
+    :param phases: phases to run
+    :type phases: list
+    :param repeat: runs of each phase; the best time is kept
+    :type repeat: int
+    :return: {phase: {"seconds", "items", "unit", "throughput", "rss"}}
+    :rtype: dict
+    """
+    # the worker processes import dimacsio with the cache of the fixtures
+    os.environ["DIMACS_CACHE"] = paths["cache"]
+    ctx = get_context("spawn")
+    res = dict()
+    for phase in phases:
+        runs = []
+        for _ in range(repeat):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(_run_phase, (phase, paths)))
+        seconds = min(r[0] for r in runs)
+        _, nb, unit, _ = runs[0]
+        res[phase] = {"seconds": seconds, "items": nb, "unit": unit,
+                      "throughput": nb / seconds if seconds else None,
+                      "rss": max(r[3] for r in runs)}
+        if verbose:
+            print("* {}: {:.3f}s".format(phase, seconds), flush=True)
+    return res
+
+
+def compare(res, baseline, threshold=THRESHOLD):
+    """Compares results with a baseline
+
+    :return: (phase, time ratio, RSS ratio, regression) for the phases of
+             both
+    :rtype: list
+    """
+    rows = []
+    for phase, current in res.items():
+        if phase not in baseline:
+            continue
+        time_ratio = current["seconds"] / baseline[phase]["seconds"]
+        rss_ratio = current["rss"] / baseline[phase]["rss"]
+        rows.append((phase, time_ratio, rss_ratio,
+                     time_ratio > 1 + threshold or
+                     rss_ratio > 1 + threshold))
+    return rows
+
+
+def report(res, baseline=None, threshold=THRESHOLD):
+    """Formats results, and their comparison with a baseline
+
+    :return: lines
+    :rtype: list
+    """
+    ratios = {row[0]: row[1:] for row in
+              compare(res, baseline or dict(), threshold)}
+    lines = ["{:<14} {:>10} {:>22} {:>10}{}".format(
+        "phase", "seconds", "throughput", "RSS (MiB)",
+        "   vs baseline (time, RSS)" if baseline else "")]
+    for phase, r in res.items():
+        line = "{:<14} {:>10.3f} {:>14.1f} {:<7} {:>10.1f}".format(
+            phase, r["seconds"], r["throughput"] or 0, r["unit"] + "/s",
+            r["rss"] / 2**20)
+        if phase in ratios:
+            time_ratio, rss_ratio, regression = ratios[phase]
+            line += "   {:+6.1%} {:+6.1%}{}".format(
+                time_ratio - 1, rss_ratio - 1,
+                "  REGRESSION" if regression else "")
+        lines.append(line)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", type=str, default="bench-fixtures",
+                        help="directory of the generated fixtures")
+    parser.add_argument("--alloptions", type=str, default=ALLOPTIONS,
+                        help="alloptions-csv file of the synthetic formula")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="share of the options in the synthetic formula")
+    parser.add_argument("--configs", type=int, default=200,
+                        help="number of .config files of the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--phases", type=str, nargs='+', default=PHASES,
+                        choices=PHASES, help="phases to run")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of each phase")
+    parser.add_argument("--baseline", type=str, default=BASELINE,
+                        help="JSON results to compare with (default: the "\
+                        "reference baseline)")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="does not compare with any baseline")
+    parser.add_argument("--save", type=str,
+                        help="writes the results as JSON (a new baseline)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--startup-budget", type=float,
+                        default=STARTUP_BUDGET, metavar="SECONDS",
+                        help="time a main.py invocation may take to start")
+    args = parser.parse_args()
+
+    paths = fixtures(args.fixtures, args.alloptions, args.scale, args.configs,
+                     args.seed)
+    res = run(paths, args.phases, args.repeat, True)
+    with open(os.path.join(args.fixtures, "fixtures.json"), 'r') as stream:
+        params = json.load(stream)
+    # the alloptions file is recorded by content, not by path
+    params["params"].pop("alloptions")
+    baseline = None
+    comparable = True
+    if args.baseline and not args.no_baseline and \
+            os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as stream:
+            saved = json.load(stream)
+        if saved.get("fixtures") != params:
+            print("The fixtures of {} differ: no comparison".format(
+                args.baseline))
+        else:
+            baseline = saved["phases"]
+            current = machine()
+            comparable = all(saved.get("machine", {}).get(key) ==
+                             current[key] for key in SAME_MACHINE)
+            if not comparable:
+                print("{} was recorded on another machine: regressions "
+                      "do not fail".format(args.baseline))
+    print()
+    for line in report(res, baseline, args.threshold):
+        print(line)
+    if args.save:
+        with open(args.save, 'w') as stream:
+            json.dump({"machine": machine(), "fixtures": params,
+                       "repeat": args.repeat, "phases": res}, stream,
+                      indent=1)
+    over_budget = "startup" in res and res["startup"]["seconds"] / \
+        res["startup"]["items"] > args.startup_budget
+    if over_budget:
+        print("Startup over budget: {:.3f}s per run, {:.3f}s allowed".format(
+            res["startup"]["seconds"] / res["startup"]["items"],
+            args.startup_budget))
+    if over_budget or baseline and comparable and \
+            any(row[3] for row in compare(res, baseline, args.threshold)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,138 +2,802 @@
 
 from pysat.formula import CNF
 from pysat.solvers import *
+from collections import deque
+from itertools import islice
+import csv
+import glob
+import os
+import sys
+import numpy as np
+import explain
+import preprocess
+import profiling
+import results
+import solving
 import utils
 import argparse
 
+# literal values in an assignment matrix
+TRUE, FALSE, FREE = 1, -1, 0
 
-def config_check(config, dimacs, alloptions_file, verbose=False):
+# upper bound on the number of (config, literal) cells evaluated at once
+EVAL_CHUNK = 1 << 26
+
+# models and cores kept by a SolveCache
+CACHED_MODELS = 64
+CACHED_CORES = 4096
+
+
+def _literals(kconfig_type, k, kmodule, value):
+    """Literals encoding the value of a symbol
+
+    :param value: value of the symbol in the .config, None or 'n' if it is
+                  not set
+    :type value: str
+    """
+    if value == 'n':
+        value = None
+    if kconfig_type == "TRISTATE":
+        if value is None:
+            return [-k, -kmodule]
+        elif value == 'y':
+            return [k, -kmodule]
+        elif value == 'm':
+            return [-k, kmodule]
+        return []
+    # BOOL
+    return [-k] if value is None else [k]
+
+
+def config_literals(dconfig, dimacs, alloptions, symbols=None):
+    """Translates a configuration into the literals to assume
+
+    Symbols of the .config come first, then the symbols that are not set, in
+    formula order.
+
+    :param dconfig: configuration as given by :func:`utils.read_config`
+    :type dconfig: dict
+    :param dimacs: formula
+    :type dimacs: utils.DimacsFla
+    :param alloptions: all options
+    :type alloptions: utils.Alloptions
+    :param symbols: symbols as given by :func:`utils.symbol_types`, to
+                    reuse them
+    :type symbols: list
+    :return: list of (id, symbol, kconfig type, literals, in .config)
+    :rtype: list
+    """
+    if symbols is None:
+        symbols = utils.symbol_types(dimacs, alloptions)
+    steps = []
+    for k, v, kconfig_type, kmodule in symbols:
+        if v in dconfig:
+            steps.append((k, v, kconfig_type,
+                          _literals(kconfig_type, k, kmodule, dconfig[v]),
+                          True))
+    for k, v, kconfig_type, kmodule in symbols:
+        if v not in dconfig:
+            steps.append((k, v, kconfig_type,
+                          _literals(kconfig_type, k, kmodule, None), False))
+    return steps
+
+
+def assignment_matrix(dconfigs, dimacs, alloptions, symbols=None):
+    """Builds the assignments of several configurations
+
+    Row ``i`` holds the value (TRUE, FALSE or FREE) of every variable of the
+    formula, indexed by DIMACS ID, under the ``i``-th configuration. Only the
+    helper variables (and options of other types) are left FREE.
+
+    :param dconfigs: configurations as given by :func:`utils.read_config`
+    :type dconfigs: list
+    :param symbols: symbols as given by :func:`utils.symbol_types`, to
+                    reuse them
+    :type symbols: list
+    :return: matrix of shape (configurations, variables + 1)
+    :rtype: numpy.ndarray
+    """
+    return matrix_assignments(utils.config_matrix(dconfigs, dimacs), dimacs,
+                              alloptions, symbols)
+
+
+def matrix_assignments(matrix, dimacs, alloptions, symbols=None):
+    """Builds the assignments of the configurations of a matrix
+
+    :param matrix: configurations as given by :func:`utils.config_matrix`
+    :type matrix: numpy.ndarray
+    :param symbols: symbols as given by :func:`utils.symbol_types`, to
+                    reuse them
+    :type symbols: list
+    :return: matrix as given by :func:`assignment_matrix`
+    :rtype: numpy.ndarray
+    """
+    if symbols is None:
+        symbols = utils.symbol_types(dimacs, alloptions)
+    ids = np.array([k for k, _, _, _ in symbols], dtype=np.int64)
+    kmodules = np.array([kmodule or 0 for _, _, _, kmodule in symbols],
+                        dtype=np.int64)
+    tristate = np.array([kconfig_type == "TRISTATE"
+                         for _, _, kconfig_type, _ in symbols], dtype=bool)
+    assignments = np.zeros((matrix.shape[1], matrix.shape[0]),
+                           dtype=np.int8)
+    # BOOL: set whatever the value, unless not set
+    values = matrix[ids[~tristate]].T
+    assignments[:, ids[~tristate]] = np.where(
+        (values == utils.CONFIG_ABSENT) | (values == utils.CONFIG_NOT_SET),
+        FALSE, TRUE)
+    # TRISTATE: y, m, not set, or unknown
+    values = matrix[ids[tristate]].T
+    unknown = values == utils.CONFIG_OTHER
+    assignments[:, ids[tristate]] = np.where(
+        values == utils.CONFIG_Y, TRUE, np.where(unknown, FREE, FALSE))
+    assignments[:, kmodules[tristate]] = np.where(
+        values == utils.CONFIG_M, TRUE, np.where(unknown, FREE, FALSE))
+    return assignments
+
+
+def _assumptions(row):
+    """Literals of the assigned variables of an assignment matrix row"""
+    ids = np.flatnonzero(row)
+    return (ids * row[ids]).tolist()
+
+
+def evaluate_assignments(dimacs, assignments):
+    """Evaluates assignments against every clause without any solver
+
+    :param dimacs: formula
+    :type dimacs: utils.DimacsFla
+    :param assignments: matrix as given by :func:`assignment_matrix`
+    :type assignments: numpy.ndarray
+    :return: for each assignment, TRUE if it satisfies every clause, FALSE if
+             it falsifies one, FREE if it depends on free variables
+    :rtype: numpy.ndarray
+    """
+    literals, offsets = dimacs.get_clause_array()
+    status = np.full(len(assignments), TRUE, dtype=np.int8)
+    empty = offsets[1:] == offsets[:-1]
+    if empty.any():
+        status[:] = FALSE   # the formula itself is UNSAT
+        return status
+    if len(literals) == 0:
+        return status
+    ids = np.abs(literals)
+    signs = np.sign(literals).astype(np.int8)
+    chunk = max(1, EVAL_CHUNK // len(literals))
+    for i in range(0, len(assignments), chunk):
+        values = assignments[i:i + chunk, ids] * signs
+        clauses = np.maximum.reduceat(values, offsets[:-1], axis=1)
+        status[i:i + chunk] = np.where(
+            (clauses == FALSE).any(axis=1), FALSE,
+            np.where((clauses == TRUE).all(axis=1), TRUE, FREE))
+    return status
+
+
+class SolveCache:
+    """SolveCache answers solve calls from the models and cores of earlier
+    calls: a model satisfying the assumptions proves them satisfiable and a
+    core included in them proves them unsatisfiable, without solving.
+
+    It has the solve, get_model and get_core methods of the solver, the
+    answers being the cached model or core when the call is not solved.
+
+    :param solver: solver bootstrapped with the formula
+    :type solver: preprocess.SimplifiedSolver
+    """
+
+    def __init__(self, solver):
+        """Constructor"""
+        self.__solver = solver
+        self.__models = deque(maxlen=CACHED_MODELS)
+        self.__cores = deque(maxlen=CACHED_CORES)
+        self.__model = None
+        self.__core = None
+        self.__hits = 0
+
+    def get_hits(self):
+        """Gives the number of calls answered without solving
+
+        :return: calls
+        :rtype: int
+        """
+        return self.__hits
+
+    def add_assignment(self, assignment):
+        """Adds an assignment satisfying every clause, as a model
+
+        :param assignment: row of an assignment matrix whose evaluation is
+                           TRUE (see :func:`evaluate_assignments`)
+        :type assignment: numpy.ndarray
+        """
+        self.__models.appendleft((_assumptions(assignment), assignment))
+
+    def get_model(self):
+        """Gives the model of the last satisfiable call"""
+        return self.__model
+
+    def get_core(self):
+        """Gives the core of the last unsatisfiable call"""
+        return self.__core
+
+    def solve(self, assumptions=[]):
+        """Solves, unless an earlier model or core answers
+
+        :param assumptions: assumptions
+        :type assumptions: list
+        :return: satisfiability of the assumptions
+        :rtype: bool
+        """
+        literals = np.array(assumptions, dtype=np.int64)
+        variables, signs = np.abs(literals), np.where(literals > 0, TRUE,
+                                                      FALSE)
+        for n, (model, values) in enumerate(self.__models):
+            if len(values) > variables.max(initial=0) and \
+                    (values[variables] == signs).all():
+                self.__hits += 1
+                self.__model = model
+                del self.__models[n]
+                self.__models.appendleft((model, values))
+                return True
+        if self.__cores:
+            given = set(assumptions)
+            for core in self.__cores:
+                if core <= given:
+                    self.__hits += 1
+                    self.__core = list(core)
+                    return False
+        if self.__solver.solve(assumptions=assumptions):
+            self.__model = self.__solver.get_model()
+            model = np.array(self.__model, dtype=np.int64)
+            values = np.zeros(np.abs(model).max(initial=0) + 1,
+                              dtype=np.int8)
+            values[np.abs(model)] = np.where(model > 0, TRUE, FALSE)
+            self.__models.appendleft((self.__model, values))
+            return True
+        self.__core = self.__solver.get_core()
+        self.__cores.append(frozenset(self.__core))
+        return False
+
+
+def shared_prefix_solve(solver, assignments, rows):
+    """Solves assignments along the prefix trie of their literals
+
+    The literals of each assignment are sorted by decreasing frequency in
+    the batch, so that the literals most assignments share come first, and
+    the assignments are sorted: this is the prefix trie of the literals,
+    flattened in depth-first order. The assignments are solved in this order
+    with one incremental solver. A model decides every assignment it
+    satisfies; a core made of the first ``d`` literals of a path decides the
+    subtree of the node at depth ``d``, i.e. the following assignments that
+    share those literals.
+
+    :param solver: solver bootstrapped with the formula, or its
+                   :class:`SolveCache`
+    :type solver: preprocess.SimplifiedSolver
+    :param assignments: matrix as given by :func:`assignment_matrix`
+    :type assignments: numpy.ndarray
+    :param rows: rows to solve
+    :type rows: list
+    :return: {row: None if SAT, unsatisfiable core otherwise}
+    :rtype: dict
+    """
+    res = dict()
+    if not len(rows):
+        return res
+    sub = assignments[rows]
+    nb_vars = sub.shape[1]
+    variables = np.arange(nb_vars, dtype=np.int64)
+    # literals of the batch, ranked by decreasing frequency
+    positive, negative = (sub == TRUE).sum(axis=0), (sub == FALSE).sum(axis=0)
+    literals = np.concatenate((variables[positive > 0],
+                               -variables[negative > 0]))
+    counts = np.concatenate((positive[positive > 0], negative[negative > 0]))
+    by_rank = literals[np.lexsort((literals, -counts))]
+    none = len(by_rank)
+    ranks = np.full((2, nb_vars), none, dtype=np.int32)
+    ranks[(by_rank < 0).astype(np.int64), np.abs(by_rank)] = \
+        np.arange(none)
+    paths = np.sort(np.where(sub == TRUE, ranks[0],
+                             np.where(sub == FALSE, ranks[1], none)), axis=1)
+    order = sorted(range(len(rows)),
+                   key=lambda j: paths[j].astype('>u4').tobytes())
+    # length of the prefix shared by consecutive paths
+    differ = paths[order[1:]] != paths[order[:-1]]
+    shared = np.where(differ.any(axis=1), differ.argmax(axis=1), nb_vars)
+
+    undecided = np.ones(len(rows), dtype=bool)
+    for n, j in enumerate(order):
+        if not undecided[j]:
+            continue
+        path = paths[j][paths[j] < none]
+        if solver.solve(assumptions=by_rank[path].tolist()):
+            model = np.array(solver.get_model(), dtype=np.int64)
+            model = model[np.abs(model) < nb_vars]
+            values = np.zeros(nb_vars, dtype=np.int8)
+            values[np.abs(model)] = np.where(model > 0, TRUE, FALSE)
+            candidates = np.flatnonzero(undecided)
+            satisfied = candidates[((sub[candidates] == FREE) |
+                                    (sub[candidates] == values)).all(axis=1)]
+            undecided[satisfied] = False
+            for k in satisfied:
+                res[rows[k]] = None
+            continue
+        core = solver.get_core()
+        core_ranks = [ranks[int(lit < 0), abs(lit)] for lit in core]
+        depth = int(np.searchsorted(path, max(core_ranks))) if core else -1
+        undecided[j] = False
+        res[rows[j]] = core
+        while n < len(order) - 1 and shared[n] > depth:
+            n += 1
+            if undecided[order[n]]:
+                undecided[order[n]] = False
+                res[rows[order[n]]] = core
+    return res
+
+
+def validate_configs(dconfigs, dimacs, alloptions):
+    """Tells which configurations are valid
+
+    The assignments are evaluated in bulk; the solver is only called for the
+    configurations that depend on helper variables (_MODULE, CHOICE_), with
+    every other variable assumed.
+
+    :param dconfigs: configurations as given by :func:`utils.read_config`
+    :type dconfigs: list
+    :param dimacs: formula
+    :type dimacs: utils.DimacsFla
+    :param alloptions: all options
+    :type alloptions: utils.Alloptions
+    :return: validity of each configuration
+    :rtype: list
+    """
+    assignments = assignment_matrix(dconfigs, dimacs, alloptions)
+    status = evaluate_assignments(dimacs, assignments)
+    res = [bool(st == TRUE) for st in status]
+    undecided = np.flatnonzero(status == FREE)
+    if len(undecided):
+        with Solver(bootstrap_with=dimacs.get_formula().clauses) as l:
+            for i in undecided:
+                res[i] = l.solve(assumptions=_assumptions(assignments[i]))
+    return res
+
+
+class ConfigChecker:
+    """ConfigChecker checks configurations against one formula.
+
+    The formula, alloptions and their indexes are loaded once and a single
+    solver is kept warm (with its learnt clauses) for every configuration.
+
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param simplification: preprocessed formula, to reuse it; computed if
+                           None
+    :type simplification: preprocess.Simplification
+    :param profiler: records the solver calls and lookups
+    :type profiler: profiling.Profiler
+    :param minimize: minimises the cores of the invalid configurations and
+                     caches them (see :mod:`explain`)
+    :type minimize: bool
+    """
+
+    def __init__(self, dimacs, alloptions_file, simplification=None,
+                 profiler=None, minimize=False):
+        """Constructor"""
+        self.__dimacs = utils.DimacsFla(dimacs)
+        self.__alloptions = utils.Alloptions(alloptions_file)
+        if profiler is not None:
+            profiler.set_variables(self.__dimacs.get_variables())
+            profiler.instrument(self.__dimacs, profiling.DIMACS_LOOKUPS)
+            profiler.instrument(self.__alloptions,
+                                profiling.ALLOPTIONS_LOOKUPS)
+        self.__symbols = utils.symbol_types(self.__dimacs,
+                                            self.__alloptions)
+        self.__by_name = {v: (k, kconfig_type, kmodule)
+                          for k, v, kconfig_type, kmodule in self.__symbols}
+        if simplification is None:
+            simplification = preprocess.Simplification(
+                self.__dimacs.get_formula().clauses,
+                utils.symbol_variables(self.__symbols))
+        self.__solver = preprocess.SimplifiedSolver(simplification)
+        if profiler is not None:
+            self.__solver = profiler.solver(self.__solver)
+        self.__explainer = explain.Explainer(self.__solver) if minimize \
+            else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Frees the solver"""
+        self.__solver.delete()
+
+    def get_dimacs(self):
+        """Gives the formula
+
+        :return: formula
+        :rtype: utils.DimacsFla
+        """
+        return self.__dimacs
+
+    def get_alloptions(self):
+        """Gives the options
+
+        :return: all options
+        :rtype: utils.Alloptions
+        """
+        return self.__alloptions
+
+    def get_symbols(self):
+        """Gives the BOOL and TRISTATE symbols of the formula
+
+        :return: symbols as given by :func:`utils.symbol_types`
+        :rtype: list
+        """
+        return self.__symbols
+
+    def get_explainer(self):
+        """Gives the explainer of the invalid configurations
+
+        :return: explainer, None if the cores are not minimised
+        :rtype: explain.Explainer
+        """
+        return self.__explainer
+
+    def get_solver(self):
+        """Gives the warm solver
+
+        :return: solver bootstrapped with the preprocessed formula
+        :rtype: preprocess.SimplifiedSolver
+        """
+        return self.__solver
+
+    def check_all(self, dconfigs, verbose=False):
+        """Checks several configurations
+
+        :param dconfigs: configurations as given by :func:`utils.read_config`
+        :type dconfigs: list
+        :return: for each configuration (SAT, failing step, core), where the
+                 step is as given by :func:`config_literals`
+        :rtype: list
+        """
+        assignments = assignment_matrix(dconfigs, self.__dimacs,
+                                        self.__alloptions, self.__symbols)
+        status = evaluate_assignments(self.__dimacs, assignments)
+        return [self.__check(dconfig, st, row, verbose)
+                for dconfig, st, row in zip(dconfigs, status, assignments)]
+
+    def check_shared(self, dconfigs):
+        """Checks several configurations along the prefix trie of their
+        literals (see :func:`shared_prefix_solve`)
+
+        The verdicts and failing steps are the ones of :meth:`check_all`,
+        with fewer solve calls when the configurations are alike: the calls
+        of the whole batch, including the search of the failing steps, go
+        through one :class:`SolveCache`.
+
+        :param dconfigs: configurations as given by :func:`utils.read_config`
+        :type dconfigs: list
+        :return: as given by :meth:`check_all`
+        :rtype: list
+        """
+        assignments = assignment_matrix(dconfigs, self.__dimacs,
+                                        self.__alloptions, self.__symbols)
+        status = evaluate_assignments(self.__dimacs, assignments)
+        cache = SolveCache(self.__solver)
+        for i in np.flatnonzero(status == TRUE)[:CACHED_MODELS]:
+            cache.add_assignment(assignments[i])
+        cores = shared_prefix_solve(cache, assignments,
+                                    np.flatnonzero(status != TRUE))
+        return [self.__check(dconfig, FALSE if cores.get(i) is not None
+                             else TRUE, row, False, cores.get(i), cache)
+                for i, (dconfig, row) in enumerate(zip(dconfigs,
+                                                       assignments))]
+
+    def check(self, dconfig, verbose=False):
+        """Checks a configuration
+
+        :param dconfig: configuration as given by :func:`utils.read_config`
+        :type dconfig: dict
+        :return: SAT, LAST CLAUSE, UNSATISFIABILITY CORE
+        :rtype: tuple
+        """
+        sat, step, core = self.check_all([dconfig], verbose)[0]
+        if sat:
+            return True, None, None
+        _, _, kconfig_type, literals, _ = step
+        return False, (literals if kconfig_type == "TRISTATE"
+                       else literals[0]), core
+
+    def check_values(self, dvalues):
+        """Checks whether some symbols can take values together
+
+        Only the given symbols are assumed, the others are left free.
+
+        :param dvalues: {symbol: 'y', 'm' or 'n'}
+        :type dvalues: dict
+        :return: SAT, UNSATISFIABILITY CORE
+        :rtype: tuple
+        """
+        assumptions = []
+        for v, value in dvalues.items():
+            if v not in self.__by_name:
+                raise ValueError("unknown symbol {}".format(v))
+            k, kconfig_type, kmodule = self.__by_name[v]
+            if value not in ('y', 'm', 'n') or \
+                    (value == 'm' and kconfig_type != "TRISTATE"):
+                raise ValueError("invalid value {} for {} {}"
+                                 .format(value, kconfig_type, v))
+            assumptions.extend(_literals(kconfig_type, k, kmodule,
+                                         None if value == 'n' else value))
+        if self.__solver.solve(assumptions=assumptions):
+            return True, None
+        return False, self.__solver.get_core()
+
+    def __check(self, dconfig, status, assignment, verbose, core=None,
+                solver=None):
+        """Checks a configuration whose assignment was evaluated, or solved
+        with the given core"""
+        l = self.__solver if solver is None else solver
+        variables = self.__dimacs.get_variables()
+        if status != TRUE and core is None and \
+                self.__explainer is not None:
+            # a known core spares the solving
+            core = self.__explainer.match(_assumptions(assignment))
+            if core is not None:
+                status = FALSE
+        if status == FREE:
+            if l.solve(assumptions=_assumptions(assignment)):
+                status = TRUE
+            else:
+                # its core spares first_unsat_step a solve
+                status, core = FALSE, l.get_core()
+        if status == FALSE:
+            # find the last clause: the first step whose literals make the
+            # assumptions UNSAT
+            steps = [step for step in config_literals(
+                dconfig, self.__dimacs, self.__alloptions, self.__symbols)
+                     if step[3]]
+            i, core = solving.first_unsat_step(
+                l, [literals for _, _, _, literals, _ in steps], core=core)
+            if i is not None:
+                if self.__explainer is not None:
+                    core = self.__explainer.explain(core)
+                if verbose:
+                    for k, v, kconfig_type, literals, _ in steps[:i + 1]:
+                        if kconfig_type == "TRISTATE":
+                            print("[T] {}:{} ^ {}:{}_MODULE"\
+                                  .format(literals[0], v, literals[1], v))
+                        else:
+                            print("[B] {}:{}".format(literals[0], v))
+                    vcore = " ^ ".join(list(map(
+                        (lambda x : '~' + variables[abs(x)] if (x < 0)
+                         else variables[x]), core)))
+                    print("---")
+                    print("/!\\ UNSATISFIABLE")
+                    print("Unsatisfiable core:", vcore)
+                return False, steps[i], core
+        if verbose:
+            print("---")
+            print("[DONE] SAT")
+        return True, None, None
+
+
+def config_check(config, dimacs, alloptions_file, verbose=False,
+                 profiler=None, minimize=False):
     """Checks configuration's integrity
 
+    Valid configurations are recognized without solving (or with a single
+    solve); the last clause of an invalid configuration is then located with
+    a few more solves (see :func:`solving.first_unsat_step`).
+
     :param config: .config file
     :type config: str
     :param dimacs: DIMACS file
     :type dimacs: str
     :param alloptions: alloptions csv file
     :type alloptions: str
+    :param profiler: records the solver calls and lookups
+    :type profiler: profiling.Profiler
+    :param minimize: minimises the unsatisfiability core
+    :type minimize: bool
     :return: SAT, LAST CLAUSE, UNSATISFIABILITY CORE
     :rtype: tuple
     """
     dconfig = utils.read_config(config)
-    
-    dimacs = utils.DimacsFla(dimacs)
-    fla = dimacs.get_formula()
-    variables = dimacs.get_variables()
+    with ConfigChecker(dimacs, alloptions_file, profiler=profiler,
+                       minimize=minimize) as checker:
+        if verbose:
+            print("* Preprocessing:", preprocess.report(
+                checker.get_solver().get_simplification()))
+            print("* At the beginning, fla is",
+                  checker.get_solver().solve(assumptions=[]))
+        res = checker.check(dconfig, verbose)
+        if verbose and checker.get_explainer() is not None:
+            print("* Explanations:", explain.report(checker.get_explainer()))
+        return res
 
-    alloptions = utils.Alloptions(alloptions_file)
 
-    assumptions = []
+def core_names(core, variables):
+    """Names the literals of an unsatisfiability core
+
+    :param core: literals
+    :type core: list
+    :param variables: {id: variable}, see :meth:`utils.DimacsFla.get_variables`
+    :type variables: dict
+    :return: variables, prefixed with '~' when negated
+    :rtype: list
+    """
+    return [('~' if lit < 0 else '') + variables[abs(lit)] for lit in core]
 
-    with Solver(bootstrap_with=fla.clauses) as l:
-        if verbose:
-            print("* At the beginning, fla is", l.solve(assumptions=assumptions))
-        for k, v in variables.items():
-            if (v.endswith("_MODULE") or "CHOICE_" in v):
-                continue    # ignore
-
-            # SYMBOLS \IN .CONFIG
-            if v in dconfig:
-                kconfig_type = alloptions.get_kconfig_type(v)
-                vprint = ""
-                if kconfig_type == "TRISTATE":
-                    kmodule = dimacs.get_kmodule(v)
-                    if dconfig[v] == 'y':
-                        vprint = "[T] {}:{} ^ {}:{}_MODULE"\
-                                                .format(k, v, -kmodule, v)
-                        assumptions.extend([k, -kmodule])
-                    elif dconfig[v] == 'm':
-                        vprint = "[T] {}:{} ^ {}:{}_MODULE"\
-                                                .format(-k, v, kmodule, v)
-                        assumptions.extend([-k, kmodule])
-                    if verbose:
-                        print(vprint)
-                    # SOLVE
-                    if not l.solve(assumptions=assumptions):
-                        if verbose:
-                            vcore = " ^ ".join(list(map(
-                                (lambda x : '~' + variables[abs(x)] if (x < 0)
-                                 else variables[x]), l.get_core())))
-                            print("---")
-                            print("/!\ UNSATISFIABLE")
-                            print("Unsatisfiable core:", vcore)
-                        return False, assumptions[-2:], l.get_core()
-                if kconfig_type == "BOOL":
-                    vprint = "[B] {}:{}".format(k, v)
-                    if verbose:
-                        print(vprint)
-                    assumptions.append(k)
-                    # SOLVE
-                    if not l.solve(assumptions=assumptions):
-                        if verbose:
-                            vcore = " ^ ".join(list(map(
-                                (lambda x : '~' + variables[abs(x)] if (x < 0)
-                                 else variables[x]), l.get_core())))
-                            print("---")
-                            print("/!\ UNSATISFIABLE")
-                            print("Unsatisfiable core:", vcore)
-                        return False, assumptions[-1], l.get_core()
-        # NOT IN .CONFIG
-        for k, v in variables.items():
-            if (v.endswith("_MODULE") or "CHOICE_" in v):
-                continue    # ignore
-            
-            if (v in alloptions.get_options()) and (v not in dconfig):
-                kconfig_type = alloptions.get_kconfig_type(v)
-
-                if kconfig_type == "TRISTATE":
-                    kmodule = dimacs.get_kmodule(v)
-                    vprint = "[T] {}:{} ^ {}:{}_MODULE"\
-                        .format(-k, v, -kmodule, v)
-                    if verbose:
-                        print(vprint)
-                    assumptions.extend([-k, -kmodule])
-                    # SOLVE
-                    if not l.solve(assumptions=assumptions):
-                        if verbose:
-                            vcore = " ^ ".join(list(map(
-                                (lambda x : '~' + variables[abs(x)] if (x < 0)
-                                 else variables[x]), l.get_core())))
-                            print("---")
-                            print("/!\ UNSATISFIABLE")
-                            print("Unsatisfiable core:", vcore)
-                        return False, assumptions[-2:], l.get_core()
-                elif kconfig_type == "BOOL":
-                    vprint = "[B] {}:{}".format(-k, v)
-                    if verbose:
-                        print(vprint)
-                    assumptions.append(-k)
-                    # SOLVE
-                    if not l.solve(assumptions=assumptions):
-                        if verbose:
-                            vcore = " ^ ".join(list(map(
-                                (lambda x : '~' + variables[abs(x)] if (x < 0)
-                                 else variables[x]), l.get_core())))
-                            print("---")
-                            print("/!\ UNSATISFIABLE")
-                            print("Unsatisfiable core:", vcore)
-                        return False, assumptions[-1], l.get_core()
-    if verbose:
-        print("---")
-        print("[DONE] SAT")
-    return True, None, None
+
+def unmatched_sources(sources):
+    """Finds the sources that give no .config file, to report them before
+    any checking
+
+    :param sources: as given to :func:`config_paths`
+    :type sources: list
+    :return: the sources other than '-' that are neither directories nor
+             files, and that match no file as glob patterns
+    :rtype: list
+    """
+    return [source for source in sources
+            if source != '-' and not os.path.isdir(source)
+            and not os.path.isfile(source)
+            and not any(os.path.isfile(path) for path in glob.iglob(source))]
+
+
+def config_paths(sources):
+    """Lists the .config files of several sources
+
+    A source that matches no file (see :func:`unmatched_sources`) is skipped
+    with a warning.
+
+    :param sources: directories (every file in them), glob patterns, paths,
+                    or '-' to read paths from the standard input, one per line
+    :type sources: list
+    :return: paths of the .config files
+    :rtype: generator
+    """
+    for source in sources:
+        if source == '-':
+            for line in sys.stdin:
+                if line.strip():
+                    yield line.strip()
+        elif os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                path = os.path.join(source, name)
+                if os.path.isfile(path):
+                    yield path
+        elif os.path.isfile(source):
+            yield source
+        else:
+            paths = sorted(path for path in glob.glob(source)
+                           if os.path.isfile(path))
+            if not paths:
+                print("Warning: no .config file matches {}, skipped"\
+                      .format(source), file=sys.stderr)
+            yield from paths
+
+
+# header of the batch check results, as in examples/extractor_out.csv
+BATCH_HEADER = ["name", "sat", "nb_yes", "nb_mod", "last_clause", "in", "core"]
+
+# configurations read and checked at once in batch mode
+BATCH_SIZE = 256
+
+
+def batch_check(sources, dimacs, alloptions_file, output, profiler=None,
+                shared=False, minimize=False, table=None, verbose=False):
+    """Checks many .config files against the same formula
+
+    The formula is loaded once and the configurations are checked with one
+    warm solver. One row per configuration is written in the
+    examples/extractor_out.csv format, and in a table if any.
+
+    :param sources: .config sources (see :func:`config_paths`)
+    :type sources: list
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param output: CSV file of the results
+    :type output: str
+    :param profiler: records the solver calls and lookups
+    :type profiler: profiling.Profiler
+    :param shared: checks each chunk of configurations along the prefix trie
+                   of their literals (see :meth:`ConfigChecker.check_shared`)
+    :type shared: bool
+    :param minimize: minimises the unsatisfiability cores; configurations
+                     containing an earlier core are explained by it
+    :type minimize: bool
+    :param table: table of the results (see :data:`results.CHECK_COLUMNS`
+                  and :func:`results.write_table`)
+    :type table: str
+    :param verbose: sums up the explanations of the minimised cores
+    :type verbose: bool
+    :return: number of checked configurations
+    :rtype: int
+    """
+    paths = config_paths(sources)
+    columns = {name: [] for name in results.CHECK_COLUMNS}
+    read_config = utils.read_config if profiler is None else \
+        profiler.helper("utils.read_config", utils.read_config)
+    nb = 0
+    with ConfigChecker(dimacs, alloptions_file, profiler=profiler,
+                       minimize=minimize) as checker, \
+         open(output, 'w', newline='') as stream:
+        variables = checker.get_dimacs().get_variables()
+        writer = csv.writer(stream)
+        writer.writerow(BATCH_HEADER)
+        while True:
+            chunk = list(islice(paths, BATCH_SIZE))
+            if not chunk:
+                break
+            dconfigs = [read_config(path) for path in chunk]
+            checks = checker.check_shared(dconfigs) if shared else \
+                checker.check_all(dconfigs)
+            for path, dconfig, (sat, step, core) in \
+                    zip(chunk, dconfigs, checks):
+                values = list(dconfig.values())
+                row = [os.path.basename(path), sat,
+                       values.count('y'), values.count('m')]
+                k, v, _, _, given = step if step else (None,) * 5
+                writer.writerow(row + [v, given,
+                                       core_names(core, variables)
+                                       if core is not None else None])
+                if table is not None:
+                    for name, value in zip(columns,
+                                           row + [k, v, given, core]):
+                        columns[name].append(value)
+            nb += len(chunk)
+        if verbose and checker.get_explainer() is not None:
+            print("* Explanations:", explain.report(checker.get_explainer()))
+    if table is not None:
+        results.write_table(table, results.CHECK_COLUMNS, columns,
+                            results.table_metadata("check", dimacs,
+                                                   alloptions_file))
+    return nb
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--config", type=str, help=".config file",
-                        required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--config", type=str, help=".config file")
+    group.add_argument("--batch", type=str, nargs='+', metavar="SOURCE",
+                       help="directories, globs or .config files to check "\
+                       "('-' reads paths from stdin)")
     parser.add_argument("--dimacs", type=str, help="dimacs file",
                         required=True)
     parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
                         required=True)
-    
+    parser.add_argument("--output", type=str, default="extractor_out.csv",
+                        help="results of the batch check")
+    parser.add_argument("--shared", action="store_true",
+                        help="batch check along the prefix trie of the "\
+                        "literals of the configurations")
+    parser.add_argument("--minimize", action="store_true",
+                        help="minimises the unsatisfiability cores")
+    parser.add_argument("--results", type=results.table_argument,
+                        metavar="TABLE",
+                        help="table of the batch check results (.parquet, "\
+                        ".arrow, .feather, .sqlite or .db)")
+
     # parser.add_argument("--verbose", "-v", action="store_true")
     args = parser.parse_args()
-    config_check(args.config, args.dimacs, args.alloptions, True)
+    missing = unmatched_sources(args.batch or [])
+    if missing:
+        parser.error("no .config file matches {}".format(", ".join(missing)))
+    if args.batch:
+        batch_check(args.batch, args.dimacs, args.alloptions, args.output,
+                    shared=args.shared, minimize=args.minimize,
+                    table=args.results, verbose=True)
+    else:
+        config_check(args.config, args.dimacs, args.alloptions, True,
+                     minimize=args.minimize)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,693 @@
+"""MODEL COUNTING BY KNOWLEDGE COMPILATION
+
+A formula is compiled once to a decision-DNNF, projected on the variables
+configurations are defined on, and cached on disk next to the parsed
+formula (see :mod:`dimacsio`). Counting, marginals and uniform sampling are
+then linear in the size of the compiled formula, without any SAT search.
+"""
+
+from pysat.solvers import Solver
+import argparse
+import hashlib
+import heapq
+import os
+import resource
+import shutil
+import sys
+import time
+import numpy as np
+import dimacsio
+import utils
+
+# kinds of nodes
+FALSE, TRUE, DECISION, BRANCH = 0, 1, 2, 3
+
+# arrays of a compiled formula, one .npy file each
+COMPILED_ARRAYS = ("projection", "kinds", "variables", "implied",
+                   "implied_offsets", "free", "free_offsets", "children",
+                   "children_offsets", "stats")
+
+# bump when the layout of a compiled formula changes
+COMPILED_VERSION = 1
+
+# branches and components compiled between two checks of the limits
+LIMIT_STEPS = 256
+
+# seconds between two progress reports of a compilation
+PROGRESS_SECONDS = 10.0
+
+
+def _split(values, offsets):
+    """Python lists of a CSR pair of arrays, for fast traversals"""
+    return np.asarray(values).tolist(), np.asarray(offsets).tolist()
+
+
+class Compiled:
+    """Compiled represents the configurations of a formula as a decision-DNNF
+    with counts.
+
+    Nodes are numbered so that children come before their parents, the root
+    being the last node. A DECISION node splits a component of the formula on
+    ``variables[i]``: its two children are BRANCH nodes. A BRANCH node holds
+    the literals implied by the decision, the projection variables left free
+    and, as children, the independent components of the residual formula. A
+    TRUE node is a satisfiable component without projection variables; the
+    FALSE node an unsatisfiable branch. The literals implied by node ``i``
+    are ``implied[implied_offsets[i]:implied_offsets[i + 1]]``, and likewise
+    for free variables and children.
+
+    :param projection: variables the configurations are defined on
+    :type projection: numpy.ndarray
+    :param kinds: kind of every node
+    :type kinds: numpy.ndarray
+    :param variables: decision variable of every node (0 if none)
+    :type variables: numpy.ndarray
+    :param stats: (compilation time in seconds, peak memory in bytes)
+    :type stats: numpy.ndarray
+    """
+
+    def __init__(self, projection, kinds, variables, implied,
+                 implied_offsets, free, free_offsets, children,
+                 children_offsets, stats):
+        """Constructor"""
+        self.projection = projection
+        self.kinds = kinds
+        self.variables = variables
+        self.implied = implied
+        self.implied_offsets = implied_offsets
+        self.free = free
+        self.free_offsets = free_offsets
+        self.children = children
+        self.children_offsets = children_offsets
+        self.stats = stats
+        self.__kinds = np.asarray(kinds).tolist()
+        self.__implied = _split(implied, implied_offsets)
+        self.__free = _split(free, free_offsets)
+        self.__children = _split(children, children_offsets)
+        self.__counts = self.__count()
+
+    def __node(self, csr, i):
+        values, offsets = csr
+        return values[offsets[i]:offsets[i + 1]]
+
+    def __count(self):
+        """Counts of every node, children first"""
+        counts = []
+        for i, kind in enumerate(self.__kinds):
+            if kind == BRANCH:
+                count = 1 << len(self.__node(self.__free, i))
+                for child in self.__node(self.__children, i):
+                    count *= counts[child]
+            elif kind == DECISION:
+                count = sum(counts[child]
+                            for child in self.__node(self.__children, i))
+            else:
+                count = kind    # TRUE: 1, FALSE: 0
+            counts.append(count)
+        return counts
+
+    def get_nb_nodes(self):
+        return len(self.__kinds)
+
+    def get_nb_edges(self):
+        return len(self.__children[0])
+
+    def get_compile_time(self):
+        """Gives the compilation time, in seconds"""
+        return float(self.stats[0])
+
+    def get_compile_memory(self):
+        """Gives the peak memory of the compiling process, in bytes"""
+        return int(self.stats[1])
+
+    def count(self):
+        """Number of configurations
+
+        :return: number of assignments of the projection variables that
+                 extend to models of the formula
+        :rtype: int
+        """
+        return self.__counts[-1]
+
+    def marginals(self):
+        """Number of configurations setting each variable to true
+
+        Every configuration assigns a variable at a single node of its path:
+        the configurations through a node are its count times the number of
+        completions outside of it, computed from the root down.
+
+        :return: {variable: number of configurations where it is true}, for
+                 the projection variables
+        :rtype: dict
+        """
+        marginals = dict.fromkeys(np.asarray(self.projection).tolist(), 0)
+        outer = [0] * len(self.__kinds)
+        outer[-1] = 1
+        for i in range(len(self.__kinds) - 1, -1, -1):
+            if not outer[i] or not self.__counts[i]:
+                continue
+            children = self.__node(self.__children, i)
+            if self.__kinds[i] == DECISION:
+                for child in children:
+                    outer[child] += outer[i]
+            elif self.__kinds[i] == BRANCH:
+                total = outer[i] * self.__counts[i]
+                for child in children:
+                    outer[child] += total // self.__counts[child]
+                for lit in self.__node(self.__implied, i):
+                    if lit > 0:
+                        marginals[lit] += total
+                for v in self.__node(self.__free, i):
+                    marginals[v] += total // 2
+        return marginals
+
+    def sample(self, rng):
+        """Draws a configuration uniformly
+
+        :param rng: random generator
+        :type rng: random.Random
+        :return: literals over the projection variables; None if the formula
+                 is unsatisfiable
+        :rtype: list
+        """
+        if not self.count():
+            return None
+        literals = []
+        stack = [len(self.__kinds) - 1]
+        while stack:
+            i = stack.pop()
+            children = self.__node(self.__children, i)
+            if self.__kinds[i] == DECISION:
+                hi, lo = children
+                count = self.__counts[hi]
+                stack.append(hi if rng.randrange(count + self.__counts[lo])
+                             < count else lo)
+            elif self.__kinds[i] == BRANCH:
+                literals.extend(self.__node(self.__implied, i))
+                literals.extend(v if rng.random() < 0.5 else -v
+                                for v in self.__node(self.__free, i))
+                stack.extend(children)
+        return literals
+
+
+def _components(clauses, variables):
+    """Splits clauses into groups sharing no variable
+
+    :param clauses: clauses of the residual formula
+    :type clauses: list
+    :param variables: projection variables of the residual formula; those
+                      occurring in no clause are returned apart
+    :type variables: iterable
+    :return: (list of (clauses, projection variables), free variables)
+    :rtype: tuple
+    """
+    parent = dict()
+
+    def find(v):
+        root = v
+        while parent[root] != root:
+            root = parent[root]
+        while parent[v] != root:
+            parent[v], v = root, parent[v]
+        return root
+
+    for clause in clauses:
+        first = find(parent.setdefault(abs(clause[0]), abs(clause[0])))
+        for lit in clause[1:]:
+            other = find(parent.setdefault(abs(lit), abs(lit)))
+            if other != first:
+                parent[other] = first
+    groups = dict()
+    for clause in clauses:
+        groups.setdefault(find(abs(clause[0])), ([], []))[0].append(clause)
+    free = []
+    for v in variables:
+        if v in parent:
+            groups[find(v)][1].append(v)
+        else:
+            free.append(v)
+    return list(groups.values()), free
+
+
+def elimination_order(clauses, check=None):
+    """Orders the variables by min-degree elimination
+
+    Variables eliminated last separate the primal graph (variables sharing a
+    clause are adjacent) into parts eliminated earlier: deciding them first
+    splits the formula into independent components early, and bounds the
+    size of the compiled formula by the width of the elimination.
+
+    :param clauses: clauses of the formula
+    :type clauses: list
+    :param check: called after every eliminated variable, to give the
+                  elimination up by raising: the fill-in of a wide formula
+                  takes long
+    :type check: function
+    :return: variables, in elimination order
+    :rtype: list
+    """
+    neighbours = dict()
+    for clause in clauses:
+        variables = {abs(lit) for lit in clause}
+        for v in variables:
+            neighbours.setdefault(v, set()).update(variables)
+    for v, adjacent in neighbours.items():
+        adjacent.discard(v)
+    heap = [(len(adjacent), v) for v, adjacent in neighbours.items()]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        degree, v = heapq.heappop(heap)
+        if v not in neighbours or degree != len(neighbours[v]):
+            continue
+        adjacent = neighbours.pop(v)
+        order.append(v)
+        for u in adjacent:
+            neighbours[u].discard(v)
+            neighbours[u].update(w for w in adjacent if w != u)
+            heapq.heappush(heap, (len(neighbours[u]), u))
+        if check is not None:
+            check()
+    return order
+
+
+def _peak_memory():
+    """Peak resident memory of the process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else 1024 * peak
+
+
+def _memory():
+    """Resident memory of the process, in bytes; its peak where the current
+    one cannot be read"""
+    try:
+        with open("/proc/self/statm", 'r') as stream:
+            return int(stream.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return _peak_memory()
+
+
+class CompilationLimit(RuntimeError):
+    """CompilationLimit is raised when a compilation runs out of time or
+    memory.
+
+    :param message: which limit was reached
+    :type message: str
+    :param progress: progress of the compilation (see
+                     :meth:`Compiler.get_progress`)
+    :type progress: dict
+    """
+
+    def __init__(self, message, progress):
+        """Constructor"""
+        super().__init__(message)
+        self.progress = progress
+
+
+class Compiler:
+    """Compiler builds the decision-DNNF of a formula.
+
+    A component of the residual formula is split on its projection variable
+    eliminated last; unit propagation then gives the implied literals of each
+    branch, and the residual formula is split again into independent
+    components, compiled once and shared through a cache.
+
+    The compilation runs on an explicit stack of branches and components,
+    whatever the depth of the decisions, and is given up with a
+    :class:`CompilationLimit` once it takes too long or too much memory.
+
+    :param clauses: clauses of the formula
+    :type clauses: list
+    :param projection: variables the configurations are defined on
+    :type projection: list
+    :param max_seconds: compilation time limit; None for no limit
+    :type max_seconds: float
+    :param max_memory: resident memory limit of the process, in bytes; None
+                       for no limit
+    :type max_memory: int
+    :param progress: called with the progress (see :meth:`get_progress`)
+                     every :data:`PROGRESS_SECONDS`
+    :type progress: function
+    """
+
+    def __init__(self, clauses, projection, max_seconds=None,
+                 max_memory=None, progress=None):
+        """Constructor"""
+        self.__clauses = [tuple(clause) for clause in clauses]
+        self.__projection = list(projection)
+        self.__max_seconds = max_seconds
+        self.__max_memory = max_memory
+        self.__progress = progress
+        self.__start = self.__last = time.perf_counter()
+        self.__depth = 0
+        self.__cache = dict()
+        self.__kinds = []
+        self.__variables = []
+        self.__counts = []
+        self.__arrays = {name: ([], [0]) for name in ("implied", "free",
+                                                     "children")}
+        self.__node(FALSE, 0)
+        self.__node(TRUE, 1)
+        # decisions in reverse elimination order; the limits hold from here
+        self.__rank = {v: i for i, v in enumerate(
+            elimination_order(self.__clauses, self.__check_elimination))}
+
+    def __node(self, kind, count, var=0, implied=(), free=(), children=()):
+        """Adds a node, after its children"""
+        self.__kinds.append(kind)
+        self.__variables.append(var)
+        self.__counts.append(count)
+        for name, values in (("implied", implied), ("free", free),
+                             ("children", children)):
+            flat, offsets = self.__arrays[name]
+            flat.extend(values)
+            offsets.append(len(flat))
+        return len(self.__kinds) - 1
+
+    def get_progress(self):
+        """Gives the progress of the compilation
+
+        :return: {"nodes", "cache": cached components, "depth": open
+                 branches and components, "seconds", "memory": resident
+                 memory in bytes}
+        :rtype: dict
+        """
+        return {"nodes": len(self.__kinds), "cache": len(self.__cache),
+                "depth": self.__depth,
+                "seconds": time.perf_counter() - self.__start,
+                "memory": _memory()}
+
+    def compile(self):
+        """Compiles the formula
+
+        :return: compiled formula
+        :rtype: Compiled
+        :raises CompilationLimit: the time or memory limit was reached
+        """
+        start = self.__start
+        root = self.__run(self.__branch(self.__clauses, self.__projection,
+                                        ()))
+        if root != len(self.__kinds) - 1:
+            # unsatisfiable formula: the root comes last
+            root = self.__node(BRANCH, 0, children=[root])
+        arrays = dict()
+        for name, (flat, offsets) in self.__arrays.items():
+            arrays[name] = np.array(flat, dtype=np.int32)
+            arrays[name + "_offsets"] = np.array(offsets, dtype=np.int64)
+        stats = np.array([time.perf_counter() - start, _peak_memory()],
+                         dtype=np.float64)
+        return Compiled(np.array(self.__projection, dtype=np.int32),
+                        np.array(self.__kinds, dtype=np.int8),
+                        np.array(self.__variables, dtype=np.int32),
+                        stats=stats, **arrays)
+
+    def __run(self, task):
+        """Runs a branch or component and the ones it needs, on a stack
+
+        Branches and components are generators that yield the branches and
+        components they need, and are sent their nodes back.
+
+        :return: node of the task
+        :rtype: int
+        """
+        stack = [task]
+        node = None
+        steps = 0
+        last = self.__last
+        while stack:
+            try:
+                needed = stack[-1].send(node)
+            except StopIteration as done:
+                stack.pop()
+                node = done.value
+                continue
+            stack.append(needed)
+            node = None
+            steps += 1
+            if steps % LIMIT_STEPS == 0:
+                self.__depth = len(stack)
+                last = self.__check(last)
+        return node
+
+    def __check_elimination(self):
+        self.__last = self.__check(self.__last)
+
+    def __check(self, last):
+        """Checks the limits and reports the progress; gives the time of
+        the last report"""
+        progress = self.get_progress()
+        if self.__max_seconds is not None and \
+                progress["seconds"] > self.__max_seconds:
+            raise CompilationLimit("compilation time limit of {:g}s reached"
+                                   .format(self.__max_seconds), progress)
+        if self.__max_memory is not None and \
+                progress["memory"] > self.__max_memory:
+            raise CompilationLimit("memory limit of {:.1f} MiB reached"
+                                   .format(self.__max_memory / 2**20),
+                                   progress)
+        now = time.perf_counter()
+        if self.__progress is not None and now - last > PROGRESS_SECONDS:
+            self.__progress(progress)
+            return now
+        return last
+
+    def __branch(self, clauses, variables, assumptions):
+        """Compiles clauses once the assumptions are set and propagated"""
+        implied = set(assumptions)
+        while True:
+            residual = []
+            units = set()
+            for clause in clauses:
+                if any(lit in implied for lit in clause):
+                    continue
+                rest = tuple(lit for lit in clause if -lit not in implied)
+                if not rest:
+                    return FALSE
+                if len(rest) == 1:
+                    units.add(rest[0])
+                residual.append(rest)
+            if not units:
+                break
+            if any(-lit in units for lit in units):
+                return FALSE
+            implied.update(units)
+            clauses = residual
+        implied = list(assumptions) + [
+            v if v in implied else -v for v in variables
+            if v in implied or -v in implied]
+        assigned = {abs(lit) for lit in implied}
+        groups, free = _components(residual, [v for v in variables
+                                              if v not in assigned])
+        count = 1 << len(free)
+        children = []
+        for group in groups:
+            child = yield self.__component(*group)
+            count *= self.__counts[child]
+            if not count:
+                return FALSE
+            if child != TRUE:
+                children.append(child)
+        return self.__node(BRANCH, count, implied=implied, free=free,
+                           children=children)
+
+    def __component(self, clauses, variables):
+        """Compiles a component, i.e. clauses sharing variables"""
+        key = frozenset(clauses)
+        if key in self.__cache:
+            return self.__cache[key]
+        if not variables:
+            # only hidden variables: one configuration if satisfiable
+            with Solver(bootstrap_with=clauses) as solver:
+                node = TRUE if solver.solve() else FALSE
+        else:
+            var = max(variables, key=self.__rank.get)
+            others = [v for v in variables if v != var]
+            hi = yield self.__branch(clauses, others, (var,))
+            lo = yield self.__branch(clauses, others, (-var,))
+            count = self.__counts[hi] + self.__counts[lo]
+            node = self.__node(DECISION, count, var, children=(hi, lo)) \
+                if count else FALSE
+        self.__cache[key] = node
+        return node
+
+
+def _compiled_entry(path, projection, cache_dir):
+    digest = hashlib.sha1(np.asarray(projection, dtype=np.int32).tobytes())
+    return os.path.join(cache_dir, "ddnnf-v{}-{}-{}".format(
+        COMPILED_VERSION, dimacsio.file_hash(path), digest.hexdigest()))
+
+
+def load(path, projection, cache_dir=dimacsio.CACHE_DIR, clauses=None,
+         max_seconds=None, max_memory=None, progress=None):
+    """Loads the compiled formula of a DIMACS file, compiling it on first use
+
+    :param path: DIMACS file
+    :type path: str
+    :param projection: variables the configurations are defined on
+    :type projection: list
+    :param cache_dir: cache directory; None to always compile the formula
+    :type cache_dir: str
+    :param clauses: clauses of the formula, if already loaded
+    :type clauses: list
+    :param max_seconds: compilation time limit; None for no limit
+    :type max_seconds: float
+    :param max_memory: resident memory limit of the compilation, in bytes;
+                       None for no limit
+    :type max_memory: int
+    :param progress: called with the progress of the compilation (see
+                     :meth:`Compiler.get_progress`)
+    :type progress: function
+    :return: compiled formula
+    :rtype: Compiled
+    :raises CompilationLimit: the time or memory limit was reached
+    """
+    entry = None
+    if cache_dir is not None:
+        entry = _compiled_entry(path, projection, cache_dir)
+        if os.path.isdir(entry):
+            try:
+                return Compiled(*[np.load(os.path.join(entry, name + ".npy"))
+                                  for name in COMPILED_ARRAYS])
+            except (OSError, ValueError):
+                # corrupted entry: compile again
+                shutil.rmtree(entry, ignore_errors=True)
+    if clauses is None:
+        clauses = dimacsio.load(path, cache_dir).get_clauses()
+    compiled = Compiler(clauses, projection, max_seconds, max_memory,
+                        progress).compile()
+    if entry is not None:
+        try:
+            dimacsio.save_arrays(compiled, entry, COMPILED_ARRAYS)
+        except OSError:
+            pass
+    return compiled
+
+
+def projection(symbols, nb_vars):
+    """Variables a configuration is defined on
+
+    :param symbols: symbols as given by :func:`utils.symbol_types`
+    :type symbols: list
+    :param nb_vars: number of variables of the formula
+    :type nb_vars: int
+    :return: symbol variables and their _MODULE variables
+    :rtype: list
+    """
+    return [v for v in utils.symbol_variables(symbols) if v <= nb_vars]
+
+
+def load_configurations(dimacs, alloptions, path,
+                        cache_dir=dimacsio.CACHE_DIR, symbols=None,
+                        max_seconds=None, max_memory=None, progress=None):
+    """Loads the compiled configurations of a kernel formula
+
+    :param dimacs: formula
+    :type dimacs: utils.DimacsFla
+    :param alloptions: all options
+    :type alloptions: utils.Alloptions
+    :param path: DIMACS file of the formula, keying the cache
+    :type path: str
+    :param cache_dir: cache directory; None to always compile the formula
+    :type cache_dir: str
+    :param symbols: symbols as given by :func:`utils.symbol_types`, to reuse
+                    them
+    :type symbols: list
+    :param max_seconds: compilation time limit; None for no limit
+    :type max_seconds: float
+    :param max_memory: resident memory limit of the compilation, in bytes;
+                       None for no limit
+    :type max_memory: int
+    :param progress: called with the progress of the compilation
+    :type progress: function
+    :return: compiled formula, projected on the symbol variables
+    :rtype: Compiled
+    :raises CompilationLimit: the time or memory limit was reached
+    """
+    if symbols is None:
+        symbols = utils.symbol_types(dimacs, alloptions)
+    # the symbols in no clause are free in every configuration
+    return load(path, projection(symbols, dimacs.get_nb_declared()),
+                cache_dir, dimacs.get_formula().clauses, max_seconds,
+                max_memory, progress)
+
+
+def symbol_marginals(compiled, symbols):
+    """Share of the configurations giving each value to each symbol
+
+    :param compiled: compiled configurations
+    :type compiled: Compiled
+    :param symbols: symbols as given by :func:`utils.symbol_types`
+    :type symbols: list
+    :return: list of (symbol, kconfig type, y share, m share, n share)
+    :rtype: list
+    """
+    total = compiled.count()
+    marginals = compiled.marginals()
+    res = []
+    for k, v, kconfig_type, kmodule in symbols:
+        y = marginals.get(k, 0)
+        m = marginals.get(kmodule, 0) if kmodule is not None else 0
+        res.append((v, kconfig_type, y / total, m / total,
+                    (total - y - m) / total))
+    return res
+
+
+def progress_line(progress):
+    """Formats the progress of a compilation
+
+    :param progress: progress, as given by :meth:`Compiler.get_progress`
+    :type progress: dict
+    :rtype: str
+    """
+    return "{:.1f}s: {} nodes, {} cached components, depth {}, " \
+        "{:.1f} MiB".format(progress["seconds"], progress["nodes"],
+                            progress["cache"], progress["depth"],
+                            progress["memory"] / 2**20)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
+                        required=True)
+    parser.add_argument("--dimacs", type=str, help="dimacs file name",
+                        required=True)
+    parser.add_argument("--marginals", type=str,
+                        help="csv file of the share of y/m/n per symbol")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="compile even if a compiled formula is cached")
+    parser.add_argument("--max-seconds", type=float,
+                        help="gives the compilation up after this time")
+    parser.add_argument("--max-memory", type=float, metavar="MIB",
+                        help="gives the compilation up once the process "\
+                        "takes this much memory")
+    args = parser.parse_args()
+    dimacs = utils.DimacsFla(args.dimacs)
+    alloptions = utils.Alloptions(args.alloptions)
+    symbols = utils.symbol_types(dimacs, alloptions)
+    try:
+        compiled = load_configurations(
+            dimacs, alloptions, args.dimacs,
+            None if args.no_cache else dimacsio.CACHE_DIR, symbols,
+            args.max_seconds,
+            None if args.max_memory is None else int(args.max_memory * 2**20),
+            lambda progress: print("* " + progress_line(progress),
+                                   flush=True))
+    except CompilationLimit as e:
+        print("Compilation given up: {}".format(e))
+        print(progress_line(e.progress))
+        sys.exit(1)
+    print("Compiled in {:.2f}s, peak memory {:.1f} MiB".format(
+        compiled.get_compile_time(), compiled.get_compile_memory() / 2**20))
+    print("{} nodes, {} edges".format(compiled.get_nb_nodes(),
+                                      compiled.get_nb_edges()))
+    print("{} configurations".format(compiled.count()))
+    if args.marginals and compiled.count():
+        with open(args.marginals, 'w') as stream:
+            stream.write("option,type,y,m,n\n")
+            for row in symbol_marginals(compiled, symbols):
+                stream.write("{},{},{:.6g},{:.6g},{:.6g}\n".format(*row))
+
+
+if __name__ == "__main__":
+    main()
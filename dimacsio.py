@@ -0,0 +1,264 @@
+"""DIMACS FORMULAS
+
+Parsed formulas are kept as flat arrays (clause literals, clause offsets,
+symbol table) and cached on disk in a binary form keyed by the hash of the
+DIMACS file. Later loads memory-map the arrays: they start in milliseconds
+and processes loading the same formula share the same pages.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+
+CACHE_DIR = os.environ.get(
+    "DIMACS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "linux-sampling",
+                 "dimacs"))
+
+# arrays of a cache entry, one .npy file each
+CACHE_ARRAYS = ("header", "ids", "names", "literals", "offsets", "coverage")
+
+# bump when the layout of a cache entry or the parsing changes
+CACHE_VERSION = 3
+
+
+class Formula:
+    """Formula class represents a parsed DIMACS formula as flat arrays.
+
+    The literals of clause ``i`` are ``literals[offsets[i]:offsets[i + 1]]``
+    and the comment ``c ids[j] names[j]`` declares the symbol of a variable.
+
+    :param header: (number of variables, number of clauses) of the p line
+    :type header: numpy.ndarray
+    :param ids: DIMACS IDs of the symbols
+    :type ids: numpy.ndarray
+    :param names: names of the symbols (bytes)
+    :type names: numpy.ndarray
+    :param literals: literals of every clause
+    :type literals: numpy.ndarray
+    :param offsets: start of every clause in literals, and the end
+    :type offsets: numpy.ndarray
+    :param coverage: coverage[v] tells whether variable v is declared by a
+                     comment or appears in a clause
+    :type coverage: numpy.ndarray
+    """
+
+    def __init__(self, header, ids, names, literals, offsets, coverage):
+        """Constructor"""
+        self.header = header
+        self.ids = ids
+        self.names = names
+        self.literals = literals
+        self.offsets = offsets
+        self.coverage = coverage
+
+    def get_nb_variables(self):
+        """Gives the number of variables declared by the p line"""
+        return int(self.header[0])
+
+    def get_nb_clauses(self):
+        """Gives the number of clauses declared by the p line"""
+        return int(self.header[1])
+
+    def get_nb_declared(self):
+        """Gives the largest variable of the p line, the comments and the
+        clauses"""
+        return len(self.coverage) - 1
+
+    def get_nb_covered(self):
+        """Gives the number of variables declared or used by a clause"""
+        return int(np.count_nonzero(self.coverage))
+
+    def get_symbols(self):
+        """Gives the symbol table
+
+        :return: {id: name} in file order
+        :rtype: dict
+        """
+        return dict(zip(self.ids.tolist(),
+                        (name.decode() for name in self.names.tolist())))
+
+    def get_clauses(self):
+        """Gives the clauses
+
+        :return: clauses as lists of literals
+        :rtype: list
+        """
+        literals = self.literals.tolist()
+        bounds = self.offsets.tolist()
+        return [literals[bounds[i]:bounds[i + 1]]
+                for i in range(len(bounds) - 1)]
+
+
+def file_hash(path):
+    """Hashes the content of a file
+
+    :param path: file
+    :type path: str
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# bytes read at once by the parser
+CHUNK_SIZE = 1 << 20
+
+
+def _parse_literals(lines):
+    """Parses clause lines into an array of zero-terminated literals
+
+    :raises ValueError: if a line holds something else than integers, or a
+                        literal beyond 32 bits
+    """
+    if not lines:
+        return np.zeros(0, dtype=np.int32)
+    try:
+        # older NumPy versions stop at the first bad token with a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(b" ".join(lines).decode(), dtype=np.int64,
+                                   sep=" ")
+    except (ValueError, DeprecationWarning):
+        line = next(line for line in lines
+                    if not all(_is_integer(token) for token in line.split()))
+        raise ValueError("malformed clause line: {!r}".format(line.decode(
+            errors="replace"))) from None
+    if len(values) and np.abs(values).max() > np.iinfo(np.int32).max:
+        raise ValueError("literal out of range: {}".format(
+            values[np.argmax(np.abs(values))]))
+    return values.astype(np.int32)
+
+
+def _is_integer(token):
+    """Tells whether a token of a clause line is an integer"""
+    try:
+        int(token)
+    except ValueError:
+        return False
+    return True
+
+
+def parse(path):
+    """Parses a DIMACS file in a single streaming pass
+
+    The file is read by chunks and the clause lines of each chunk are
+    converted at once, so that memory stays proportional to the parsed
+    arrays rather than to the text of the file.
+
+    :param path: DIMACS file
+    :type path: str
+    :return: parsed formula
+    :rtype: Formula
+    :raises ValueError: if a clause line is malformed or the last clause is
+                        not terminated by 0
+    """
+    header = [0, 0]
+    ids, names = [], []
+    blocks = []         # zero-terminated literals, per chunk
+    rest = b""
+    with open(path, 'rb') as stream:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            lines = (rest + data).split(b"\n")
+            # last line may be incomplete
+            rest = lines.pop() if data else b""
+            clause_lines = []
+            for line in lines:
+                if line.startswith(b"c"):
+                    # c 666 FEATURE_NAME
+                    fields = line.split()
+                    ids.append(int(fields[1]))
+                    names.append(fields[2])
+                elif line.startswith(b"p"):
+                    header = [int(field) for field in line.split()[2:4]]
+                elif line.strip():
+                    clause_lines.append(line)
+            try:
+                blocks.append(_parse_literals(clause_lines))
+            except ValueError as e:
+                raise ValueError("{}: {}".format(path, e)) from None
+            if not data:
+                break
+    values = np.concatenate(blocks)
+    del blocks
+    if len(values) and values[-1] != 0:
+        raise ValueError("{}: the last clause is not terminated by 0"\
+                         .format(path))
+    ends = np.flatnonzero(values == 0)
+    literals = values[values != 0]
+    offsets = np.zeros(len(ends) + 1, dtype=np.int64)
+    # a clause ends where its terminating zero is, minus the previous zeros
+    offsets[1:] = ends - np.arange(len(ends))
+    ids = np.array(ids, dtype=np.int32)
+    nb_vars = max(header[0], int(np.abs(literals).max(initial=0)),
+                  int(ids.max(initial=0)))
+    coverage = np.zeros(nb_vars + 1, dtype=bool)
+    coverage[np.abs(literals)] = True
+    coverage[ids] = True
+    coverage[0] = False
+    return Formula(np.array(header, dtype=np.int64), ids,
+                   np.array(names, dtype=bytes), literals, offsets,
+                   coverage)
+
+
+def _cache_entry(path, cache_dir):
+    return os.path.join(cache_dir, "v{}-{}".format(CACHE_VERSION,
+                                                   file_hash(path)))
+
+
+def save_arrays(obj, entry, names):
+    """Writes the arrays of an object as a cache entry, atomically
+
+    :param obj: object holding the arrays as attributes
+    :type obj: object
+    :param entry: directory of the entry
+    :type entry: str
+    :param names: names of the arrays, one .npy file each
+    :type names: tuple
+    """
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    try:
+        for name in names:
+            np.save(os.path.join(tmp, name + ".npy"), getattr(obj, name))
+        os.rename(tmp, entry)
+    except OSError:
+        # written by another process in the meantime, or not writable
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load(path, cache_dir=CACHE_DIR):
+    """Loads a DIMACS file through the binary cache
+
+    :param path: DIMACS file
+    :type path: str
+    :param cache_dir: cache directory; None to always parse the file
+    :type cache_dir: str
+    :return: parsed formula, memory-mapped if it comes from the cache
+    :rtype: Formula
+    """
+    if cache_dir is None:
+        return parse(path)
+    entry = _cache_entry(path, cache_dir)
+    if os.path.isdir(entry):
+        try:
+            return Formula(*[np.load(os.path.join(entry, name + ".npy"),
+                                     mmap_mode='r')
+                             for name in CACHE_ARRAYS])
+        except (OSError, ValueError):
+            # corrupted entry: parse again
+            shutil.rmtree(entry, ignore_errors=True)
+    formula = parse(path)
+    try:
+        save_arrays(formula, entry, CACHE_ARRAYS)
+    except OSError:
+        pass
+    return formula
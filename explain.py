@@ -0,0 +1,184 @@
+"""EXPLANATIONS OF INVALID CONFIGURATIONS
+
+The core of an invalid configuration, as given by the solver, is seldom
+minimal. An :class:`Explainer` shrinks it by deletion, under a solve budget,
+and keeps the minimised cores: many configurations fail for the same reason,
+and a configuration whose literals contain a known core is explained by it
+by a subset check, before any solving.
+"""
+
+from itertools import chain
+import time
+import solving
+
+# conflicts of each solve call while minimising a core
+MINIMIZE_CONFLICTS = 10000
+
+# solve calls spent on minimising one core
+MINIMIZE_CALLS = 200
+
+
+class Explainer:
+    """Explainer class minimises unsatisfiability cores and caches them.
+
+    The minimised cores are cached by their symbol set (the variables of
+    their literals), and indexed by one of their literals, the one indexing
+    the fewest cores so far: the literals of a configuration are only
+    matched against the cores indexed by one of them.
+
+    :param solver: solver bootstrapped with the formula, supporting limited
+                   calls (see :func:`solving.solve_limited`)
+    :type solver: preprocess.SimplifiedSolver
+    :param budget: budget of each solve call; None for no bound
+    :type budget: solving.Budget
+    :param calls: solve calls spent on minimising one core
+    :type calls: int
+    """
+
+    def __init__(self, solver,
+                 budget=solving.Budget(conflicts=MINIMIZE_CONFLICTS),
+                 calls=MINIMIZE_CALLS):
+        """Constructor"""
+        self.__solver = solver
+        self.__budget = budget
+        self.__calls = calls
+        # symbol set -> {core: [minimal, hits]}
+        self.__cores = dict()
+        # literal -> [(core, [minimal, hits])]
+        self.__index = dict()
+        self.__stats = {"hits": 0, "minimised": 0, "calls": 0}
+
+    def get_stats(self):
+        """Gives the counters of the explainer
+
+        :return: {"hits": cores found in the cache, "minimised": cores
+                 minimised, "calls": solve calls}
+        :rtype: dict
+        """
+        return dict(self.__stats)
+
+    def get_explanations(self):
+        """Gives the cached cores, the most used first
+
+        :return: (core, minimal, hits)
+        :rtype: list
+        """
+        return sorted(((sorted(core, key=abs), minimal, hits)
+                       for cores in self.__cores.values()
+                       for core, (minimal, hits) in cores.items()),
+                      key=lambda row: -row[2])
+
+    def match(self, assumptions):
+        """Finds a cached core included in assumptions
+
+        The core is only counted as a hit once :meth:`explain` gives it as
+        the explanation of a core.
+
+        :param assumptions: literals, e.g. of a configuration
+        :type assumptions: list
+        :return: core, None if no cached core is included
+        :rtype: list
+        """
+        counters = self.__match(assumptions)
+        return None if counters is None else sorted(counters[0], key=abs)
+
+    def __match(self, assumptions):
+        """Finds a cached core included in assumptions: (core, counters)"""
+        given = set(assumptions)
+        index = self.__index
+        literals = given if len(given) < len(index) else \
+            [lit for lit in index if lit in given]
+        for lit in chain((0,), literals):
+            for core, counters in index.get(lit, ()):
+                if core <= given:
+                    return core, counters
+        return None
+
+    def explain(self, core, deadline=None):
+        """Explains unsatisfiable assumptions by a cached or minimised core
+
+        :param core: unsatisfiability core, e.g. as given by :meth:`match`
+        :type core: list
+        :param deadline: :func:`time.monotonic` time the minimisation stops
+                         at; None for no bound
+        :type deadline: float
+        :return: core included in the given one, minimal unless the budget
+                 ran out
+        :rtype: list
+        """
+        known = self.__match(core)
+        if known is not None:
+            known[1][1] += 1
+            self.__stats["hits"] += 1
+            return sorted(known[0], key=abs)
+        core, minimal = self.minimize(core, deadline)
+        key, counters = frozenset(core), [minimal, 1]
+        self.__cores.setdefault(frozenset(abs(lit) for lit in core),
+                                dict())[key] = counters
+        # the empty core of an unsatisfiable formula is indexed by 0
+        lit = min(core, key=lambda lit: len(self.__index.get(lit, ())),
+                  default=0)
+        self.__index.setdefault(lit, []).append((key, counters))
+        return core
+
+    def minimize(self, core, deadline=None):
+        """Minimises a core by deletion
+
+        Each literal is dropped in turn and kept if the others become
+        satisfiable (or the call runs out of budget); when they are still
+        unsatisfiable, their own core replaces the candidates, which drops
+        several literals at once.
+
+        :param core: unsatisfiability core
+        :type core: list
+        :param deadline: :func:`time.monotonic` time the minimisation stops
+                         at; None for no bound
+        :type deadline: float
+        :return: (core, True if it is minimal)
+        :rtype: tuple
+        """
+        self.__stats["minimised"] += 1
+        core = sorted(set(core), key=abs)
+        minimal = True
+        i = calls = 0
+        while i < len(core):
+            if calls == self.__calls or deadline is not None \
+               and time.monotonic() >= deadline:
+                return core, False
+            trial = core[:i] + core[i + 1:]
+            res = self.__solve(trial, deadline)
+            calls += 1
+            if res is False:
+                smaller = set(self.__solver.get_core() or ())
+                core = [lit for lit in trial if lit in smaller]
+            else:
+                minimal &= res is not None
+                i += 1
+        return core, minimal
+
+    def __solve(self, assumptions, deadline=None):
+        """Solves within the budget and the deadline; None when they run
+        out"""
+        self.__stats["calls"] += 1
+        limits = self.__budget.get_limits(0) if self.__budget else None
+        conflicts, seconds = limits or (None, None)
+        if deadline is not None:
+            left = max(deadline - time.monotonic(), 0.0)
+            seconds = left if seconds is None else min(seconds, left)
+        if conflicts is None and seconds is None:
+            return self.__solver.solve(assumptions=assumptions)
+        return solving.solve_limited(self.__solver, assumptions, conflicts,
+                                     seconds)
+
+
+def report(explainer):
+    """Summarizes the work of an explainer in one line
+
+    :param explainer: explainer
+    :type explainer: Explainer
+    :return: summary
+    :rtype: str
+    """
+    return ("{minimised} cores minimised with {calls} solve calls, "
+            "{hits} explained by a cached core").format(
+                **explainer.get_stats())
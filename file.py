@@ -9,8 +9,12 @@ https://github.com/TuxML/Kanalyser/blob/master/alloptions-x64-v4.15.csv
 
 '''
 import os
+from bisect import bisect_left
 from pysat.formula import CNF
 from pysat.solvers import Solver
+import dimacsio
+import solving
+import utils
 
 
 DOT_DIR = 'dot'
@@ -89,34 +93,21 @@ class DimacsFile:
 
     def __init__(self, filename):
         self.__filename = filename
+        self.__parsed = dimacsio.load(filename)
         self.__features = dict()
-        self.__variables = set()
-        self.__nb_variables = 0
-        self.__nb_clauses = 0
-        stream = open(filename, 'r')
-        content = stream.readlines()
-        stream.close()
-        for line in content:
-            if line[0] == 'c':
-                # c 666 FEATURE_NAME
-                feature = line.split()[2].rstrip('\n').strip()
-                number = int(line.split()[1].strip())
-                self.__features[feature] = number
-                self.__variables.add(number)
-            elif line[0] == 'p':
-                mline = list(map(int, line.split()[2:]))
-                self.__nb_variables, self.__nb_clauses = mline[0], mline[1]
-            else:
-                mlist = line.split()[:-1]
-                mlist = list(map(int, mlist))
-                mlist = list(map(abs, mlist))
-                for k in mlist:
-                    self.__variables.add(k)
+        # c 666 FEATURE_NAME
+        for number, feature in zip(self.__parsed.ids.tolist(),
+                                   self.__parsed.names.tolist()):
+            self.__features[feature.decode()] = number
+        self.__nb_variables = self.__parsed.get_nb_variables()
+        self.__nb_clauses = self.__parsed.get_nb_clauses()
         self.__features_set = set(self.__features)
         self.__features_clean_set = self.__cleanSet(self.__features_set)
         self.__nb_features = len(self.__features_clean_set)
         self.__name_variation_dict = None
-        assert self.__nb_variables == len(self.__variables)
+        self.__clean_trie = None
+        self.__sorted_features = None
+        assert self.__nb_variables == self.__parsed.get_nb_covered()
 
     def getFileName(self):
         return self.__filename
@@ -139,6 +130,9 @@ class DimacsFile:
     def getVariableOf(self, feature):
         return self.__features[feature]
 
+    def getClauses(self):
+        return self.__parsed.get_clauses()
+
     # def __cleanName(self, name):
     #     if '=' in name:
     #         return name.split('=')[0].split('_MODULE')[0].strip()
@@ -168,20 +162,40 @@ class DimacsFile:
                 return not word[len(prefix):].startswith("ULE")
             return True
 
+    def __buildCleanTrie(self):
+        ''' Prefix trie of the clean names, None marking a clean name '''
+        self.__clean_trie = dict()
+        for feat in self.__features_clean_set:
+            node = self.__clean_trie
+            for char in feat:
+                node = node.setdefault(char, dict())
+            node[None] = feat
+
+    def __longestCleanPrefix(self, rep):
+        ''' Longest clean name that __my_contains the raw name rep '''
+        if self.__clean_trie is None:
+            self.__buildCleanTrie()
+        res = None
+        node = self.__clean_trie
+        for depth in range(len(rep) + 1):
+            feat = node.get(None)
+            if feat is not None and DimacsFile.__my_contains(feat, rep):
+                res = feat
+            if depth == len(rep) or rep[depth] not in node:
+                break
+            node = node[rep[depth]]
+        return res
+
     def __buildNameVariationDiff(self):
+        # every raw name goes to the longest clean name it starts with
         self.__name_variation_dict = dict()
-        features_list_sorted = sorted(list(self.__features_clean_set),
-                                      key=len, reverse=True)
-        added = set()
-        for feat in features_list_sorted:
-            for rep in self.__features:
-                if rep not in added and DimacsFile.__my_contains(feat, rep):
-                        # str.startswith(rep, feat):
-                    try:
-                        self.__name_variation_dict[feat].add(rep)
-                    except KeyError:
-                        self.__name_variation_dict[feat] = {rep}
-                    added.add(rep)
+        for rep in self.__features:
+            feat = self.__longestCleanPrefix(rep)
+            if feat is not None:
+                try:
+                    self.__name_variation_dict[feat].add(rep)
+                except KeyError:
+                    self.__name_variation_dict[feat] = {rep}
 
     def getNameVariationDict(self):
         if self.__name_variation_dict is None:
@@ -208,20 +222,39 @@ class DimacsFile:
         os.system('eom {}/{}.dot.png'.format(IMG_DIR, feature))
 
     def getNamesOf(self, name):
-        if self.__name_variation_dict is None:
-            self.getNameVariationDict()
-        else:
-            return self.getNameTreeOf()[name]
+        if self.__name_variation_dict is not None:
+            return self.__name_variation_dict.get(name, set())
+        # only the raw names starting with name, found by bisection
+        if self.__sorted_features is None:
+            self.__sorted_features = sorted(self.__features)
+        res = set()
+        start = bisect_left(self.__sorted_features, name)
+        for rep in self.__sorted_features[start:]:
+            if not rep.startswith(name):
+                break
+            if self.__longestCleanPrefix(rep) == name:
+                res.add(rep)
+        return res
 
 
 class Checker:
     """Checker class"""
 
-    def __init__(self, dimacs_file, csv_file, verbose=False):
+    def __init__(self, dimacs_file, csv_file, verbose=False, profiler=None):
         self.__dimacs = DimacsFile(dimacs_file)
         self.__csv = CSVFile(csv_file)
-        self.__cnf = CNF(from_file=dimacs_file)
+        self.__cnf = CNF()
+        self.__cnf.clauses = self.__dimacs.getClauses()
         self.__formula = Solver(bootstrap_with=self.__cnf.clauses)
+        if profiler is not None:
+            # records the solver calls and the lookups (see profiling.py)
+            profiler.set_variables({self.__dimacs.getVariableOf(feature):
+                                    feature for feature in
+                                    self.__dimacs.getFeaturesSet()})
+            profiler.instrument(self.__dimacs,
+                                ("getVariableOf", "getFeaturesSet"))
+            profiler.instrument(self.__csv, ("getType", "getFeaturesSet"))
+            self.__formula = profiler.solver(self.__formula)
         assert self.__formula.solve() is True, "initial formula is UNSAT"
         self.__config_d = None
         self.__verbose = verbose
@@ -233,140 +266,124 @@ class Checker:
 
     def set_dot_config_file(self, filename):
         """Sets the .config source file"""
-        self.__config_d = Checker.__read_file(filename)
+        self.__config_d = utils.read_config(filename)
+
+    def __add_steps(self, in_steps, out_steps, kind):
+        """Adds (feature, literals, verbose lines) steps to the assumptions
+
+        The features of the .config (in_steps) come before the others
+        (out_steps). A single solve checks them all when they are
+        satisfiable; otherwise the first failing feature is located and the
+        assumptions stop at it, as if the features were added one by one.
+        """
+        steps = in_steps + out_steps
+        i, _ = solving.first_unsat_step(
+            self.__formula, [literals for _, literals, _ in steps],
+            base=self.__assumptions)
+        done = steps if i is None else steps[:i + 1]
+
+        def not_in_title():
+            title = "=> ADDING FEATURES THAT ARE NOT IN THE .CONFIG [{}]"\
+                .format(kind)
+            print()
+            print(title)
+            print("-" * len(title))
+
+        if self.__verbose:
+            print("=> ADDING FEATURES FROM .CONFIG FILE [{}]".format(kind))
+            print("-----------------------------------------------")
+        for n, (feature, literals, lines) in enumerate(done):
+            if self.__verbose and n == len(in_steps):
+                not_in_title()
+            self.__assumptions.extend(literals)
+            if self.__verbose:
+                for line in lines:
+                    print(line)
+        if i is not None:
+            if self.__verbose:
+                print("== UNSAT")
+            return {"return" : False,
+                    "last_clause" : steps[i][0],
+                    "In" : i < len(in_steps)}
+        if self.__verbose and not out_steps:
+            not_in_title()
+        # End
+        if self.__verbose:
+            print("== SAT")
+        return {"return" : True,
+                "last_clause" : None,
+                "In" : None}
 
     def check_tristate(self, dot_config_file=None):
         """Checks tristate by adding it in assumptions"""
         if dot_config_file is not None:
             self.set_dot_config_file(dot_config_file)
-        if self.__verbose:
-            print("=> ADDING FEATURES FROM .CONFIG FILE [TRISTATE]")
-            print("-----------------------------------------------")
         tristates = {feature : self.__config_d[feature]\
                      for feature in self.__config_d\
                      if feature in self.__dimacs.getFeaturesSet()\
                      and feature in self.__csv.getFeaturesSet()\
                      and self.__csv.getType(feature) == "TRISTATE"}
+        in_steps = []
         for feature in tristates:
             feat_mod = "{}_MODULE".format(feature)
             var_for_name = self.__dimacs.getVariableOf(feature)
             var_for_module = self.__dimacs.getVariableOf(feat_mod)
             if self.__config_d[feature] == 'y':
                 # OPTION ^ ¬ MODULE
-                self.__assumptions.extend([var_for_name, -var_for_module])
-                if self.__verbose:
-                    print("+ Adding clause: {}({})"
-                          .format(feature, var_for_name))
-                    print("+ Adding clause: {}({})"
-                          .format(feat_mod, -var_for_module))
+                literals = [var_for_name, -var_for_module]
             elif self.__config_d[feature] == 'm':
                 # ¬ OPTION ^ MODULE
-                self.__assumptions.extend([-var_for_name, var_for_module])
-                if self.__verbose:
-                    print("+ Adding clause: {}({})"
-                          .format(feature, -var_for_name))
-                    print("+ Adding clause: {}({})"
-                          .format(feat_mod, var_for_module))
-            # SAT testing
-            if not self.__formula.solve(assumptions=self.__assumptions):
-                if self.__verbose:
-                    print("== UNSAT")
-                return {"return" : False,
-                        "last_clause" : feature,
-                        "In" : True}
-        if self.__verbose:
-            print()
-            print("=> ADDING FEATURES THAT ARE NOT IN THE .CONFIG [TRISTATE]")
-            print("---------------------------------------------------------")
+                literals = [-var_for_name, var_for_module]
+            else:
+                literals = []
+            in_steps.append((feature, literals,
+                             ["+ Adding clause: {}({})".format(name, lit)
+                              for name, lit in zip((feature, feat_mod),
+                                                   literals)]))
         not_in_tristates = {feature for feature in self.__csv.getFeaturesSet()\
                             if feature not in set(self.__config_d)\
                             and feature in self.__dimacs.getFeaturesSet()\
                             and self.__csv.getType(feature) == "TRISTATE"}
+        out_steps = []
         for feature in not_in_tristates:
             feat_mod = "{}_MODULE".format(feature)
             var_for_name = self.__dimacs.getVariableOf(feature)
             var_for_module = self.__dimacs.getVariableOf(feat_mod)
-            self.__assumptions.extend([-var_for_name, -var_for_module])
-            if self.__verbose:
-                print("+ Adding clause: {} ({})"
-                      .format(feature, -var_for_name))
-                print("+ Adding clause: {} ({})"
-                      .format(feat_mod, -var_for_module))
-            if not self.__formula.solve(assumptions=self.__assumptions):
-                if self.__verbose:
-                    print("== UNSAT")
-                return {"return" : False,
-                        "last_clause" : feature,
-                        "In" : False}
-        # End
-        if self.__verbose:
-            print("== SAT")
-        return {"return" : True,
-                "last_clause" : None,
-                "In" : None}
+            literals = [-var_for_name, -var_for_module]
+            out_steps.append((feature, literals,
+                              ["+ Adding clause: {} ({})".format(name, lit)
+                               for name, lit in zip((feature, feat_mod),
+                                                    literals)]))
+        return self.__add_steps(in_steps, out_steps, "TRISTATE")
 
     def check_bool(self, dot_config_file=None):
         """Checks boolean type by adding it in the assumptions"""
         if dot_config_file is not None:
             self.set_dot_config_file(dot_config_file)
-        if self.__verbose:
-            print("=> ADDING FEATURES FROM .CONFIG FILE [BOOL]")
-            print("-----------------------------------------------")
         boolean = {feature : self.__config_d[feature]\
                    for feature in self.__config_d\
                    if feature in self.__dimacs.getFeaturesSet()\
                    and feature in self.__csv.getFeaturesSet()\
                    and self.__csv.getType(feature) == "BOOL"}
+        in_steps = []
         for feature in boolean:
             var_name = self.__dimacs.getVariableOf(feature)
             # OPTION
-            self.__assumptions.append(var_name)
-            if self.__verbose:
-                print("+ Adding clause: {} ({})"
-                      .format(feature, var_name))
-            if not self.__formula.solve(assumptions=self.__assumptions):
-                if self.__verbose:
-                    print("== UNSAT")
-                return {"return" : False,
-                        "last_clause" : feature,
-                        "In" : True}
-        if self.__verbose:
-            print()
-            print("=> ADDING FEATURES THAT ARE NOT IN THE .CONFIG [BOOL]")
-            print("-----------------------------------------------------")
+            in_steps.append((feature, [var_name],
+                             ["+ Adding clause: {} ({})"
+                              .format(feature, var_name)]))
         not_in_boolean = {feature for feature in self.__csv.getFeaturesSet()\
                           if feature not in set(self.__config_d)\
                           and feature in self.__dimacs.getFeaturesSet()\
                           and self.__csv.getType(feature) == "BOOL"}
+        out_steps = []
         for feature in not_in_boolean:
             var_name = self.__dimacs.getVariableOf(feature)
             # ¬ OPTION
-            self.__assumptions.append(-var_name)
-            if self.__verbose:
-                print("+ Adding clause: {} ({})".format(feature, -var_name))
-            if not self.__formula.solve(assumptions=self.__assumptions):
-                if self.__verbose:
-                    print("== UNSAT")
-                return {"return" : False,
-                        "last_clause" : feature,
-                        "In" : False}
-        # End
-        if self.__verbose:
-            print("== SAT")
-        return {"return" : True,
-                "last_clause" : None,
-                "In" : None}
-
-    @staticmethod
-    def __read_file(filename):
-        res = dict()
-        with open(filename, 'r') as stream:
-            for line in stream:
-                if line[0] != '#' and line != '\n':
-                    feature = line[7:]
-                    flist = feature.split('=')
-                    res[flist[0]] = flist[1].rstrip('\n')
-        return res
+            out_steps.append((feature, [-var_name],
+                              ["+ Adding clause: {} ({})"
+                               .format(feature, -var_name)]))
+        return self.__add_steps(in_steps, out_steps, "BOOL")
 
     def get_nb_tristate(self):
         """Counts the number of tristates number of modules and always yes"""
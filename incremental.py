@@ -0,0 +1,277 @@
+"""INCREMENTAL SANITY CHECK
+
+Two releases of the kernel share most of their clauses. The clauses of both
+formulas are compared by symbol names (DIMACS IDs are renumbered from one
+release to the next) and only the symbols close to a changed clause are
+checked again. The verdicts of the other symbols are carried over from the
+previous results: their impossible values are proven again, by unit
+propagation when it suffices and by solving otherwise, and their possible
+values are confirmed by the witness models of the check (see
+:func:`sanity.check_values`), which confirm most of them at once. A change
+may reach a symbol further than the radius, so the possible values are
+only reused unverified on request.
+"""
+
+from collections import Counter
+import argparse
+import sys
+import numpy as np
+import preprocess
+import results
+import sanity
+import solving
+import utils
+
+# clause hops from a changed clause within which symbols are checked again
+RADIUS = 2
+
+# variables in more clauses (MODULES, common dependencies) are checked again
+# when reached, but the search does not go through them: most of the formula
+# is one hop away from them
+HUB_OCCURRENCES = 100
+
+
+def _names(dimacs):
+    """Names of the variables, by DIMACS ID; unnamed variables get their ID"""
+    variables = dimacs.get_variables()
+    nb_vars = max(dimacs.get_formula().nv, max(variables, default=0))
+    return [variables.get(var, "#{}".format(var))
+            for var in range(nb_vars + 1)]
+
+
+def _clauses(dimacs):
+    """Clauses of a formula as lists of DIMACS IDs and signs"""
+    literals, offsets = dimacs.get_clause_array()
+    ids = np.abs(literals).tolist()
+    signs = (literals > 0).tolist()
+    bounds = offsets.tolist()
+    return [(ids[bounds[i]:bounds[i + 1]], signs[bounds[i]:bounds[i + 1]])
+            for i in range(len(bounds) - 1)]
+
+
+def _signatures(dimacs):
+    """Clauses of a formula as sets of (name, sign), which survive the
+    renumbering of the variables"""
+    names = _names(dimacs)
+    return Counter(frozenset(zip([names[var] for var in ids], signs))
+                   for ids, signs in _clauses(dimacs))
+
+
+def _symbol(name):
+    """Symbol of a variable: the _MODULE variable belongs to its symbol"""
+    return name[:-len("_MODULE")] if name.endswith("_MODULE") else name
+
+
+def changed_symbols(previous, dimacs, radius=RADIUS):
+    """Finds the symbols whose clause neighbourhood changed
+
+    The names of the clauses that are in one formula only are the seeds;
+    every name within ``radius`` clauses of a seed in the new formula is
+    changed, as well as the names that are new. The search stops at the
+    variables of more than :data:`HUB_OCCURRENCES` clauses.
+
+    :param previous: formula of the previous release
+    :type previous: utils.DimacsFla
+    :param dimacs: formula of the new release
+    :type dimacs: utils.DimacsFla
+    :param radius: clause hops from the seeds
+    :type radius: int
+    :return: symbols
+    :rtype: set
+    """
+    old, new = _signatures(previous), _signatures(dimacs)
+    names = _names(dimacs)
+    ids = {name: var for var, name in enumerate(names)}
+    seeds = {name for signature in (old - new) + (new - old)
+             for name, _ in signature}
+    reached = {ids[name] for name in seeds if name in ids}
+
+    # breadth-first search over the variable-clause incidence of the new
+    # formula
+    clauses = _clauses(dimacs)
+    occurrences = [[] for _ in names]
+    for i, (variables, _) in enumerate(clauses):
+        for var in variables:
+            occurrences[var].append(i)
+    visited = set()
+    frontier = reached
+    for _ in range(radius):
+        touched = {i for var in frontier
+                   if len(occurrences[var]) <= HUB_OCCURRENCES
+                   for i in occurrences[var]} - visited
+        visited |= touched
+        frontier = {var for i in touched for var in clauses[i][0]} - reached
+        reached |= frontier
+
+    changed = {_symbol(names[var]) for var in reached}
+    changed |= {_symbol(name) for name in names} - \
+        {_symbol(name) for name in _names(previous)}
+    return changed
+
+
+def previous_results(path, previous_dimacs):
+    """Loads the impossible values of the previous release
+
+    :param path: examples/impossible.csv like file, sanity check table, or
+                 results store (:mod:`results`) holding a finished run on the
+                 previous formula
+    :type path: str
+    :param previous_dimacs: DIMACS file of the previous release
+    :type previous_dimacs: str
+    :return: dictionary {symbol: set of impossible values}
+    :rtype: dict
+    """
+    if path.endswith(".csv"):
+        return results.read_csv(path)
+    if results.is_table(path):
+        return results.table_impossible_values(path)
+    with results.SanityStore(path) as store:
+        run = store.get_last_run(previous_dimacs)
+        if run is None:
+            raise ValueError("no finished run on {} in {}"
+                             .format(previous_dimacs, path))
+        return store.get_impossible_values(run)
+
+
+def incremental_sanity_check(dimacs, alloptions_file, previous_dimacs,
+                             previous, radius=RADIUS, verbose=False,
+                             store=None, table=None, trust=False,
+                             profiler=None, budget=None, race=None):
+    """Sanity checks a formula from the results of the previous release
+
+    :param dimacs: DIMACS file contaning the formula to check
+    :type dimacs: str
+    :param alloptions_file: CSV file of all options
+    :type alloptions_file: str
+    :param previous_dimacs: DIMACS file of the previous release
+    :type previous_dimacs: str
+    :param previous: impossible values of the previous release, or their
+                     file (see :func:`previous_results`)
+    :type previous: dict
+    :param radius: clause hops from a changed clause within which symbols
+                   are checked again
+    :type radius: int
+    :param verbose: verbosity
+    :type verbose: bool
+    :param store: database where the results are recorded (see
+                  :mod:`results`), to be the previous results of the next
+                  release
+    :type store: str
+    :param table: table where the impossible values of every symbol are
+                  written (see :func:`results.write_table`)
+    :type table: str
+    :param trust: reuse the possible values of the unchanged symbols without
+                  confirming them, which misses the values killed by a
+                  change further than the radius
+    :type trust: bool
+    :param profiler: records the solver calls and lookups
+    :type profiler: profiling.Profiler
+    :param budget: budget of the solve calls, retried with larger budgets
+                   when they run out of it
+    :type budget: solving.Budget
+    :param race: pysat backends racing the calls out of budget (see
+                 :mod:`portfolio`)
+    :type race: list
+    :return: dictionary {symbol: set of impossible values}
+    :rtype: dict
+    """
+    if isinstance(previous, str):
+        previous = previous_results(previous, previous_dimacs)
+    fla = utils.DimacsFla(dimacs)
+    alloptions = utils.Alloptions(alloptions_file)
+    changed = changed_symbols(utils.DimacsFla(previous_dimacs), fla, radius)
+
+    candidates = sanity._candidates(fla, alloptions)
+    simplification = preprocess.Simplification(
+        fla.get_formula().clauses, sanity._frozen(candidates))
+    if verbose:
+        print("* Preprocessing:", preprocess.report(simplification))
+
+    impossible_values = dict()
+    recheck = [c for c in candidates if c[1] in changed]
+    nb_carried = nb_solved = 0
+    with sanity._solver(simplification, profiler) as l:
+        for k, v, tag, value, assumptions in candidates:
+            if v in changed or value not in previous.get(v, ()):
+                continue
+            nb_carried += 1
+            st, _ = l.propagate(assumptions=assumptions)
+            if st and l.solve(assumptions=assumptions):
+                # possible now: the symbol is checked again
+                changed.add(v)
+                recheck.extend(c for c in candidates if c[1] == v)
+                continue
+            nb_solved += st
+            impossible_values.setdefault(v, set()).add(value)
+    # possible values of the unchanged symbols
+    carried = [c for c in candidates if c[1] not in changed and
+               c[3] not in previous.get(c[1], ())]
+    if verbose:
+        print("* {} symbols changed, {} values checked again".format(
+            len({c[1] for c in recheck}), len(recheck)))
+        print("* {} impossible values carried over, {} of them proven "
+              "by solving".format(nb_carried, nb_solved))
+        print("* {} possible values carried over{}".format(
+            len(carried), ", not confirmed" if trust else ""))
+    if trust:
+        print("Warning: the possible values of the unchanged symbols are "
+              "reused unverified", file=sys.stderr)
+        carried = []
+    for v, values in sanity._check(simplification, recheck + carried,
+                                   verbose, None, profiler, budget,
+                                   race).items():
+        impossible_values.setdefault(v, set()).update(values)
+
+    # in DIMACS ID order, as a full sanity check
+    impossible_values = {v: impossible_values[v] for _, v, _, _, _ in
+                         candidates if v in impossible_values}
+    if store is not None:
+        with results.SanityStore(store) as db:
+            run = db.start(dimacs, alloptions_file)
+            for k, v, _, _, _ in candidates:
+                db.record(run, k, v, impossible_values.get(v, set()))
+            db.finish(run)
+    if table is not None:
+        results.write_table(
+            table, results.SANITY_COLUMNS,
+            results.sanity_columns(impossible_values,
+                                   [(k, v) for k, v, _, _, _ in candidates]),
+            results.table_metadata("sanity", dimacs, alloptions_file))
+    return impossible_values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
+                        required=True)
+    parser.add_argument("--dimacs", type=str, help="dimacs file name",
+                        required=True)
+    parser.add_argument("--previous-dimacs", type=str, required=True,
+                        help="dimacs file of the previous release")
+    parser.add_argument("--previous", type=str, required=True,
+                        help="impossible values of the previous release: "\
+                        "impossible.csv like file, sanity check table or "\
+                        "results store")
+    parser.add_argument("--radius", type=int, default=RADIUS,
+                        help="clause hops from a changed clause within "\
+                        "which symbols are checked again")
+    parser.add_argument("--store", type=str,
+                        help="database recording the results")
+    parser.add_argument("--results", type=results.table_argument,
+                        metavar="TABLE",
+                        help="table of the impossible values (.parquet, "\
+                        ".arrow, .feather, .sqlite or .db)")
+    parser.add_argument("--trust-previous", action="store_true",
+                        help="reuses the possible values of the unchanged "\
+                        "symbols without confirming them")
+    solving.add_budget_arguments(parser)
+    args = parser.parse_args()
+    budget, race = solving.budget_arguments(args)
+    incremental_sanity_check(args.dimacs, args.alloptions,
+                             args.previous_dimacs, args.previous, args.radius,
+                             True, args.store, args.results,
+                             args.trust_previous, budget=budget, race=race)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
-"""MAIN PROGRAM TO LAUNCH CHECKERS"""
+"""MAIN PROGRAM TO LAUNCH CHECKERS
 
-import sanity, config_check
+The checkers (and pysat, numpy, pandas behind them) are only imported once
+the command line is parsed, by the checker that runs: usage errors and
+--help answer without loading them.
+"""
+
+import profiling, solving
 import argparse
 
 def main():
@@ -11,25 +16,143 @@ def main():
                         required=True)
     parser.add_argument("--sanity", action="store_true",
                         help="enable sanity check")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes for the sanity "\
+                        "check")
+    parser.add_argument("--store", type=str,
+                        help="database where the sanity check records every "\
+                        "decided symbol (see results.py)")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume the last sanity check of the store")
+    solving.add_budget_arguments(parser)
+    parser.add_argument("--previous-dimacs", type=str,
+                        help="dimacs file of the previous release: the "\
+                        "sanity check only checks again the symbols whose "\
+                        "clauses changed")
+    parser.add_argument("--trust-previous", action="store_true",
+                        help="reuses the possible values of the symbols "\
+                        "whose clauses did not change without confirming "\
+                        "them")
+    parser.add_argument("--previous", type=str,
+                        help="impossible values of the previous release "\
+                        "(impossible.csv like file, sanity check table or "\
+                        "results store)")
 
     parser.add_argument("--ccheck", type=str, metavar=".CONFIG",
                         help=".config check. "\
                         "Must be followed by a configuration file")
+    parser.add_argument("--batch", type=str, nargs='+', metavar="SOURCE",
+                        help="batch .config check of directories, globs or "\
+                        "files ('-' reads paths from stdin)")
+    parser.add_argument("--output", type=str, default="extractor_out.csv",
+                        help="results of the batch .config check")
+    parser.add_argument("--shared", action="store_true",
+                        help="batch .config check along the prefix trie of "\
+                        "the literals of the configurations")
+    parser.add_argument("--minimize", action="store_true",
+                        help="minimises the unsatisfiability cores of the "\
+                        ".config check")
+    parser.add_argument("--repair", type=str, nargs='+', metavar="SOURCE",
+                        help="repairs the invalid .config files of "\
+                        "directories, globs or files into the valid "\
+                        "configurations changing the fewest symbols")
+    parser.add_argument("--repaired", type=str, default="repaired",
+                        help="directory of the repaired .config files")
+    parser.add_argument("--repair-seconds", type=float, metavar="SECONDS",
+                        help="time budget of a repair (default: 60, 0 "\
+                        "for no bound)")
+    parser.add_argument("--results", type=str, metavar="TABLE",
+                        help="table of the sanity or batch .config check "\
+                        "results (.parquet, .arrow, .feather, .sqlite or "\
+                        ".db, see results.py)")
+    parser.add_argument("--profile", type=str, metavar="REPORT",
+                        help="records every solver call of the checker in a "\
+                        "JSON report and sums up the hottest symbols")
+    parser.add_argument("--top", type=int, default=profiling.TOP,
+                        help="number of symbols in the profile summary")
 
     args = parser.parse_args()
+    if args.previous_dimacs and not (args.previous or args.store):
+        parser.error("--previous-dimacs needs --previous or --store")
+    if args.previous_dimacs and (args.jobs > 1 or args.resume):
+        parser.error("--previous-dimacs runs in one process and cannot "
+                     "resume: --jobs and --resume are not supported")
+    if args.results:
+        import results
+        try:
+            results.check_table(args.results)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.batch or args.repair:
+        import config_check
+        missing = config_check.unmatched_sources(args.batch or args.repair)
+        if missing:
+            parser.error("no .config file matches {}".format(
+                ", ".join(missing)))
+
+    profiler = profiling.Profiler() if args.profile else None
 
     if args.sanity:
         print("SANITY CHECK")
         print("------------")
-        sanity\
-            .sanity_check_optionsvalues(args.dimacs, args.alloptions, True)
+        budget, race = solving.budget_arguments(args)
+        if args.previous_dimacs:
+            import incremental
+            incremental\
+                .incremental_sanity_check(args.dimacs, args.alloptions,
+                                          args.previous_dimacs,
+                                          args.previous or args.store,
+                                          verbose=True, store=args.store,
+                                          table=args.results,
+                                          trust=args.trust_previous,
+                                          profiler=profiler, budget=budget,
+                                          race=race)
+        else:
+            import sanity
+            sanity\
+                .sanity_check_optionsvalues(args.dimacs, args.alloptions,
+                                            True, args.jobs, args.store,
+                                            args.resume, profiler, budget,
+                                            race, args.results)
     elif args.ccheck:
         print(".CONFIG CHECK")
         print("-------------")
+        import config_check
         config_check\
-            .config_check(args.ccheck, args.dimacs, args.alloptions, True)
+            .config_check(args.ccheck, args.dimacs, args.alloptions, True,
+                          profiler, args.minimize)
+    elif args.batch:
+        print("BATCH .CONFIG CHECK")
+        print("-------------------")
+        import config_check
+        nb = config_check.batch_check(args.batch, args.dimacs,
+                                      args.alloptions, args.output, profiler,
+                                      args.shared, args.minimize,
+                                      args.results, verbose=True)
+        print("{} configurations checked, results in {}"\
+              .format(nb, args.output))
+    elif args.repair:
+        print(".CONFIG REPAIR")
+        print("--------------")
+        import repair
+        nb, nb_repaired = repair.repair_check(
+            args.repair, args.dimacs, args.alloptions, args.repaired,
+            repair.REPAIR_SECONDS if args.repair_seconds is None
+            else args.repair_seconds)
+        print("{} configurations checked, {} repaired in {}"\
+              .format(nb, nb_repaired, args.repaired))
     else:
         print("No checker selcted. You must chose one.")
+        return
+
+    if profiler is not None:
+        profiler.write(args.profile)
+        print()
+        print("PROFILE")
+        print("-------")
+        for line in profiler.summary(args.top):
+            print(line)
+        print("Report written in", args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+"""PORTFOLIO OF SOLVERS
+
+Hard queries are raced between several pysat backends, each in its own
+process with its own warm solver over the same (preprocessed) formula; the
+first answer is taken and the other racers give up the query.
+"""
+
+from multiprocessing import get_context
+import preprocess
+import solving
+
+# backends raced by default
+BACKENDS = solving.RACE_BACKENDS
+
+# conflicts between two checks of whether a racer's query is still open:
+# CaDiCaL calls cannot be interrupted, so racers run in slices instead
+RACE_SLICE = 5000
+
+
+def _racer(name, simplification, tasks, answers, current):
+    """Answers the queries of a portfolio with one backend
+
+    :param name: pysat backend
+    :type name: str
+    :param simplification: formula
+    :type simplification: preprocess.Simplification
+    :param tasks: queue of (query, assumptions), None to stop
+    :type tasks: multiprocessing.Queue
+    :param answers: queue of (query, backend, result, model or core)
+    :type answers: multiprocessing.Queue
+    :param current: query still open, 0 if none
+    :type current: multiprocessing.Value
+    """
+    with preprocess.SimplifiedSolver(simplification, name) as solver:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            query, assumptions = task
+            res = None
+            while res is None and current.value == query:
+                solver.conf_budget(RACE_SLICE)
+                res = solver.solve_limited(assumptions=assumptions)
+            if res is not None:
+                answers.put((query, name, res, solver.get_model() if res
+                             else solver.get_core()))
+    # late answers may never be read: do not wait for them to be sent
+    answers.cancel_join_thread()
+
+
+class Portfolio:
+    """Portfolio class races the backends on queries.
+
+    :param simplification: formula
+    :type simplification: preprocess.Simplification
+    :param backends: pysat backends, one process each
+    :type backends: list
+    """
+
+    def __init__(self, simplification, backends=BACKENDS):
+        """Constructor"""
+        ctx = get_context()
+        self.__query = 0
+        self.__current = ctx.Value('l', 0, lock=False)
+        self.__answers = ctx.Queue()
+        self.__tasks = []
+        self.__racers = []
+        self.__wins = dict.fromkeys(backends, 0)
+        for name in backends:
+            tasks = ctx.Queue()
+            racer = ctx.Process(target=_racer, daemon=True,
+                                args=(name, simplification, tasks,
+                                      self.__answers, self.__current))
+            racer.start()
+            self.__tasks.append(tasks)
+            self.__racers.append(racer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stops the racers"""
+        self.__current.value = 0
+        for tasks in self.__tasks:
+            tasks.put(None)
+        for racer in self.__racers:
+            racer.join()
+
+    def get_wins(self):
+        """Gives the number of queries won by each backend
+
+        :return: {backend: wins}
+        :rtype: dict
+        """
+        return dict(self.__wins)
+
+    def solve(self, assumptions=[]):
+        """Races the backends on assumptions
+
+        :param assumptions: assumptions of the original formula
+        :type assumptions: list
+        :return: (result, model if SAT or core if UNSAT, winning backend)
+        :rtype: tuple
+        """
+        self.__query += 1
+        self.__current.value = self.__query
+        for tasks in self.__tasks:
+            tasks.put((self.__query, list(assumptions)))
+        while True:
+            query, name, res, answer = self.__answers.get()
+            # answers to queries already decided are late racers
+            if query == self.__query:
+                break
+        self.__current.value = 0
+        self.__wins[name] += 1
+        return res, answer, name
@@ -0,0 +1,513 @@
+"""FORMULA PREPROCESSING
+
+Kernel formulas contain many unit clauses, equivalent symbols (binary
+clauses a -> b and b -> a) and redundant clauses. They are simplified once
+before solving, and :class:`SimplifiedSolver` maps every literal given to or
+coming from the solver between the original variables and the simplified
+formula, so that callers keep working with the original DIMACS IDs.
+"""
+
+from pysat.solvers import Solver
+import numpy as np
+
+
+class Simplification:
+    """Simplification class simplifies a formula and keeps the mapping back
+    to its variables.
+
+    The simplification runs, until nothing changes: unit propagation,
+    merging of equivalent literals (strongly connected components of the
+    binary implication graph), removal of duplicate and subsumed clauses,
+    and removal of pure literals. A pure literal is only removed for
+    variables that are not frozen: the others may be assumed later on, which
+    the removal of their clauses would not allow.
+
+    Every variable ends up either fixed, replaced by the literal of its
+    representative, or kept as is.
+
+    :param clauses: clauses of the formula
+    :type clauses: list
+    :param frozen: variables that may be assumed or queried later on; every
+                   variable if None
+    :type frozen: iterable
+    """
+
+    def __init__(self, clauses, frozen=None):
+        """Constructor"""
+        clauses = [list(dict.fromkeys(clause)) for clause in clauses]
+        self.__nb_vars = max((abs(lit) for clause in clauses
+                              for lit in clause), default=0)
+        self.__frozen = None if frozen is None else set(frozen)
+        self.__fixed = dict()            # var -> True/False
+        self.__representative = dict()   # var -> literal of representative
+        self.__unsat = False
+        self.__stats = dict.fromkeys(("units", "equivalences", "subsumed",
+                                      "pure"), 0)
+        nb_clauses = len(clauses)
+        while not self.__unsat:
+            clauses, units = self.__propagate(clauses)
+            clauses, merged = self.__merge_equivalences(clauses)
+            if not units and not merged:
+                break
+        if self.__unsat:
+            clauses = [[]]
+        else:
+            clauses = self.__subsume(clauses)
+            clauses = self.__remove_pure(clauses)
+        self.__clauses = clauses
+        self.__stats["clauses"] = nb_clauses - len(clauses)
+        # literal standing for every variable: True/False when fixed
+        self.__literals = [0] + [self.__resolve(var) for var in
+                                    range(1, self.__nb_vars + 1)]
+        # same as arrays, to map whole models at once
+        fixed = [lit is True or lit is False for lit in self.__literals]
+        self.__fixed_mask = np.array(fixed, dtype=bool)
+        self.__fixed_values = np.array(
+            [lit is True for lit in self.__literals], dtype=bool)
+        self.__targets = np.array(
+            [0 if is_fixed else abs(lit) for lit, is_fixed in
+             zip(self.__literals, fixed)], dtype=np.int64)
+        self.__negated = np.array(
+            [not is_fixed and lit < 0 for lit, is_fixed in
+             zip(self.__literals, fixed)], dtype=bool)
+
+    def get_clauses(self):
+        """Gives the simplified formula
+
+        :return: clauses over the original IDs of the variables kept
+        :rtype: list
+        """
+        return self.__clauses
+
+    def get_nb_vars(self):
+        """Gives the number of variables of the original formula"""
+        return self.__nb_vars
+
+    def get_fixed(self):
+        """Gives the variables fixed by the simplification
+
+        :return: {var: value}
+        :rtype: dict
+        """
+        return self.__fixed
+
+    def get_stats(self):
+        """Gives what the simplification removed
+
+        :return: numbers of fixed variables (units), merged variables
+                 (equivalences), subsumed clauses, pure literals, and
+                 clauses removed overall
+        :rtype: dict
+        """
+        return self.__stats
+
+    def is_unsat(self):
+        """Tells whether the formula was proved unsatisfiable"""
+        return self.__unsat
+
+    def literal(self, lit):
+        """Maps a literal of the original formula to the simplified one
+
+        :param lit: literal of the original formula
+        :type lit: int
+        :return: True or False if the literal is fixed, the literal standing
+                 for it in the simplified formula otherwise
+        :rtype: bool or int
+        """
+        var = abs(lit)
+        if var <= self.__nb_vars:
+            new = self.__literals[var]
+            if new is True or new is False:
+                return new == (lit > 0)
+            return new if lit > 0 else -new
+        return lit
+
+    def __resolve(self, lit):
+        """Follows the representatives and fixed values of a literal"""
+        var = abs(lit)
+        while var in self.__representative:
+            rep = self.__representative[var]
+            lit = rep if lit > 0 else -rep
+            var = abs(lit)
+        if var in self.__fixed:
+            return self.__fixed[var] == (lit > 0)
+        return lit
+
+    def model(self, model):
+        """Extends a model of the simplified formula to the original one
+
+        :param model: model of the simplified formula
+        :type model: list
+        :return: model over every variable of the original formula
+        :rtype: list
+        """
+        model = np.asarray(model, dtype=np.int64)
+        values = np.zeros(max(self.__nb_vars, len(model)) + 1, dtype=bool)
+        values[np.abs(model)] = model > 0
+        values = values[self.__targets] ^ self.__negated
+        values[self.__fixed_mask] = self.__fixed_values[self.__fixed_mask]
+        ids = np.arange(1, self.__nb_vars + 1)
+        return np.where(values[1:], ids, -ids).tolist()
+
+    def phases(self, literals):
+        """Maps literals of the original formula to the simplified one, to
+        steer the phases of a solver
+
+        :param literals: literals of the original formula
+        :type literals: list
+        :return: literals of the simplified formula, the last one of every
+                 variable; fixed literals are left out
+        :rtype: list
+        """
+        literals = np.asarray(literals, dtype=np.int64)
+        variables = np.abs(literals)
+        # variables out of the formula are kept as is
+        inside = variables <= self.__nb_vars
+        known = variables * inside
+        keep = ~inside | ~self.__fixed_mask[known]
+        targets = np.where(inside, self.__targets[known], variables)
+        positive = (literals > 0) ^ (inside & self.__negated[known])
+        mapped = np.where(positive, targets, -targets)[keep][::-1]
+        # last literal of every variable, as for a solver
+        _, last = np.unique(np.abs(mapped), return_index=True)
+        return mapped[np.sort(last)][::-1].tolist()
+
+    def __fix(self, lit):
+        var = abs(lit)
+        if var in self.__fixed:
+            if self.__fixed[var] != (lit > 0):
+                self.__unsat = True
+            return
+        self.__fixed[var] = lit > 0
+
+    def __propagate(self, clauses):
+        """Fixes the literals implied by unit propagation"""
+        occurrences = dict()
+        for i, clause in enumerate(clauses):
+            for lit in clause:
+                occurrences.setdefault(lit, []).append(i)
+        # unassigned literals left in every clause not satisfied yet
+        left = [len(clause) for clause in clauses]
+        satisfied = [False] * len(clauses)
+        queue = [clause[0] for clause in clauses if len(clause) == 1]
+        units = []
+        while queue and not self.__unsat:
+            lit = queue.pop()
+            if abs(lit) in self.__fixed:
+                self.__fix(lit)     # conflict if fixed the other way
+                continue
+            self.__fix(lit)
+            units.append(lit)
+            for i in occurrences.get(lit, ()):
+                satisfied[i] = True
+            for i in occurrences.get(-lit, ()):
+                if satisfied[i]:
+                    continue
+                left[i] -= 1
+                if left[i] == 0:
+                    self.__unsat = True
+                elif left[i] == 1:
+                    queue.extend(other for other in clauses[i]
+                                 if abs(other) not in self.__fixed)
+        self.__stats["units"] += len(units)
+        if self.__unsat:
+            return clauses, units
+        return self.__substitute(clauses), units
+
+    def __substitute(self, clauses):
+        """Rewrites clauses with the fixed and merged variables"""
+        res = []
+        for clause in clauses:
+            rewritten = set()
+            for lit in clause:
+                lit = self.__resolve(lit)
+                if lit is True or -lit in rewritten:
+                    break   # satisfied or tautology
+                if lit is not False:
+                    rewritten.add(lit)
+            else:
+                if not rewritten:
+                    self.__unsat = True
+                res.append(sorted(rewritten, key=abs))
+        return res
+
+    def __merge_equivalences(self, clauses):
+        """Replaces literals equivalent through binary clauses by one
+        representative, the literal of smallest variable of their strongly
+        connected component in the implication graph"""
+        graph = dict()
+        for clause in clauses:
+            if len(clause) == 2:
+                a, b = clause
+                graph.setdefault(-a, []).append(b)
+                graph.setdefault(-b, []).append(a)
+        merged = 0
+        for component in _strongly_connected(graph):
+            if len(component) < 2:
+                continue
+            rep = min(component, key=abs)
+            if -rep in component:
+                self.__unsat = True
+                return clauses, 0
+            if rep < 0:
+                # the component of the negations does the merging
+                continue
+            for lit in component:
+                if lit != rep:
+                    self.__representative[abs(lit)] = rep if lit > 0 \
+                        else -rep
+                    merged += 1
+        self.__stats["equivalences"] += merged
+        return (self.__substitute(clauses) if merged else clauses), merged
+
+    def __subsume(self, clauses):
+        """Removes duplicate clauses and clauses containing another one"""
+        clauses = sorted({tuple(clause) for clause in clauses}, key=len)
+        occurrences = dict()
+        for i, clause in enumerate(clauses):
+            for lit in clause:
+                occurrences.setdefault(lit, []).append(i)
+        removed = set()
+        for i, clause in enumerate(clauses):
+            if i in removed:
+                continue
+            literals = set(clause)
+            # a clause containing this one contains its rarest literal
+            rarest = min(clause, key=lambda lit: len(occurrences[lit]))
+            for j in occurrences[rarest]:
+                if j != i and j not in removed and \
+                   len(clauses[j]) >= len(clause) and \
+                   literals.issubset(clauses[j]):
+                    removed.add(j)
+        self.__stats["subsumed"] += len(removed)
+        return [list(clause) for i, clause in enumerate(clauses)
+                if i not in removed]
+
+    def __remove_pure(self, clauses):
+        """Satisfies the clauses of pure literals of variables not frozen"""
+        if self.__frozen is None:
+            return clauses
+        # frozen variables may have been merged into another variable
+        frozen = {abs(self.__resolve(var)) for var in self.__frozen}
+        occurrences = dict()
+        for i, clause in enumerate(clauses):
+            for lit in clause:
+                occurrences.setdefault(lit, set()).add(i)
+        removed = set()
+        candidates = list(occurrences)
+        while candidates:
+            lit = candidates.pop()
+            var = abs(lit)
+            if var in self.__fixed or var in frozen or \
+               occurrences.get(-lit) or not occurrences.get(lit):
+                continue
+            self.__fix(lit)
+            self.__stats["pure"] += 1
+            for i in occurrences.pop(lit):
+                removed.add(i)
+                for other in clauses[i]:
+                    if other != lit:
+                        occurrences[other].discard(i)
+                        # may have become pure
+                        candidates.append(-other)
+        return [clause for i, clause in enumerate(clauses)
+                if i not in removed]
+
+
+def report(simplification):
+    """Summarizes a simplification in one line
+
+    :param simplification: simplification of a formula
+    :type simplification: Simplification
+    :return: summary
+    :rtype: str
+    """
+    stats = simplification.get_stats()
+    return ("{clauses} clauses removed, {units} variables fixed, "
+            "{equivalences} merged, {subsumed} subsumed clauses, "
+            "{pure} pure literals").format(**stats)
+
+
+def _strongly_connected(graph):
+    """Strongly connected components of a graph (iterative Tarjan)
+
+    :param graph: {node: successors}
+    :type graph: dict
+    :return: list of components, as lists of nodes
+    :rtype: list
+    """
+    index = dict()
+    low = dict()
+    stack = []
+    on_stack = set()
+    components = []
+    for start in graph:
+        if start in index:
+            continue
+        work = [(start, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = len(index)
+                stack.append(node)
+                on_stack.add(node)
+            successors = graph.get(node, ())
+            for j in range(i, len(successors)):
+                succ = successors[j]
+                if succ not in index:
+                    work.append((node, j + 1))
+                    work.append((succ, 0))
+                    break
+                if succ in on_stack:
+                    low[node] = min(low[node], index[succ])
+            else:
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        other = stack.pop()
+                        on_stack.discard(other)
+                        component.append(other)
+                        if other == node:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+    return components
+
+
+class SimplifiedSolver:
+    """SimplifiedSolver is a solver over a simplified formula that speaks
+    the literals of the original one.
+
+    Assumptions, phases, models and cores are mapped between both formulas.
+    Assumptions contradicting a fixed variable, or each other once merged,
+    are answered without calling the solver.
+
+    :param simplification: simplified formula; simplifications are
+                           picklable, so that worker processes can share one
+    :type simplification: Simplification
+    :param name: name of the pysat solver
+    :type name: str
+    """
+
+    def __init__(self, simplification, name='m22'):
+        """Constructor"""
+        self.__simplification = simplification
+        self.__solver = Solver(name=name,
+                               bootstrap_with=simplification.get_clauses())
+        self.__core = None
+        self.__model = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.delete()
+
+    def delete(self):
+        """Frees the solver"""
+        self.__solver.delete()
+
+    def get_simplification(self):
+        return self.__simplification
+
+    def nof_vars(self):
+        return self.__simplification.get_nb_vars()
+
+    def __assumptions(self, assumptions):
+        """Maps assumptions to the simplified formula
+
+        :return: (mapped assumptions, {mapped literal: original literal}),
+                 or (None, core) if they contradict the simplification
+        :rtype: tuple
+        """
+        mapped = []
+        origin = dict()
+        for lit in assumptions:
+            new = self.__simplification.literal(lit)
+            if new is True:
+                continue
+            if new is False:
+                return None, [lit]
+            if -new in origin:
+                return None, [origin[-new], lit]
+            if new not in origin:
+                origin[new] = lit
+                mapped.append(new)
+        return mapped, origin
+
+    def solve(self, assumptions=[]):
+        """Solves the formula under assumptions of the original formula"""
+        return self.__solve(assumptions, self.__solver.solve)
+
+    def solve_limited(self, assumptions=[], expect_interrupt=False):
+        """Solves the formula under assumptions of the original formula,
+        within the budget of :meth:`conf_budget` or until :meth:`interrupt`
+
+        :return: None if the budget ran out or the call was interrupted
+        """
+        return self.__solve(
+            assumptions,
+            lambda assumptions: self.__solver.solve_limited(
+                assumptions=assumptions, expect_interrupt=expect_interrupt))
+
+    def __solve(self, assumptions, solve):
+        self.__model = self.__core = None
+        if self.__simplification.is_unsat():
+            self.__core = []
+            return False
+        mapped, origin = self.__assumptions(assumptions)
+        if mapped is None:
+            self.__core = origin
+            return False
+        res = solve(mapped)
+        if res:
+            self.__model = self.__simplification.model(
+                self.__solver.get_model())
+        elif res is False:
+            self.__core = [origin[lit] for lit in
+                           self.__solver.get_core() or () if lit in origin]
+        return res
+
+    def conf_budget(self, budget=-1):
+        """Bounds the conflicts of the next limited calls; -1 for no bound"""
+        self.__solver.conf_budget(budget)
+
+    def interrupt(self):
+        """Interrupts the running limited call"""
+        self.__solver.interrupt()
+
+    def clear_interrupt(self):
+        """Clears an interruption, before the next limited call"""
+        self.__solver.clear_interrupt()
+
+    def propagate(self, assumptions=[]):
+        """Propagates assumptions of the original formula
+
+        :return: (status, implied literals of the simplified formula)
+        :rtype: tuple
+        """
+        if self.__simplification.is_unsat():
+            return False, []
+        mapped, origin = self.__assumptions(assumptions)
+        if mapped is None:
+            return False, []
+        return self.__solver.propagate(assumptions=mapped)
+
+    def set_phases(self, literals=[]):
+        """Sets the preferred phases of literals of the original formula"""
+        self.__solver.set_phases(
+            literals=self.__simplification.phases(literals))
+
+    def get_model(self):
+        """Gives the last model, over the variables of the original formula"""
+        return self.__model
+
+    def get_core(self):
+        """Gives the last core, as original assumptions"""
+        return self.__core
+
+    def accum_stats(self):
+        """Gives the counters (conflicts, decisions...) of the solver"""
+        return self.__solver.accum_stats()
@@ -0,0 +1,270 @@
+"""PROFILING OF THE CHECKERS
+
+A :class:`Profiler` records every solver call of a checker (wall time,
+conflicts, decisions, propagations and number of assumptions), tagged by the
+symbol and value it is about, and the time spent in lookup helpers. The calls
+are written as a JSON report and summed up per symbol to find the symbols
+that dominate the runtime.
+"""
+
+from functools import wraps
+import json
+import time
+
+# solver counters recorded for every call, as given by accum_stats()
+STATS = ("conflicts", "decisions", "propagations")
+
+# fields of a recorded call
+CALL_FIELDS = ("call", "symbol", "kind", "seconds") + STATS + \
+    ("assumptions", "result")
+
+# symbols in the summary
+TOP = 20
+
+# lookups of utils.DimacsFla and utils.Alloptions timed by the checkers
+DIMACS_LOOKUPS = ("get_variables", "get_kmodule", "get_id", "is_dummy")
+ALLOPTIONS_LOOKUPS = ("get_kconfig_type", "get_options_of_type")
+
+
+class Profiler:
+    """Profiler class records the solver calls and lookups of a checker.
+
+    Calls are tagged from their assumptions: the symbol is the one of the
+    last assumption (the candidate value of a sanity check, the step that
+    closes a prefix of a .config check) and the kind is its value, 'y', 'm'
+    or 'n'. Calls without assumptions are tagged with the 'free' kind.
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self.__calls = []
+        self.__helpers = dict()
+        self.__symbols = dict()
+        self.__ids = dict()
+
+    def set_variables(self, variables):
+        """Sets the names of the variables, to tag the calls
+
+        :param variables: {id: variable}, the ``_MODULE`` variables
+                          belonging to their symbol
+        :type variables: dict
+        """
+        ids = {v: k for k, v in variables.items()}
+        for k, v in variables.items():
+            symbol = v[:-len("_MODULE")] if v.endswith("_MODULE") else v
+            self.__symbols[k] = symbol
+            self.__ids[symbol] = (ids.get(symbol),
+                                  ids.get(symbol + "_MODULE"))
+
+    def tag(self, assumptions):
+        """Tags a call from its assumptions
+
+        :param assumptions: assumptions of the call
+        :type assumptions: list
+        :return: (symbol, kind)
+        :rtype: tuple
+        """
+        if not assumptions:
+            return "", "free"
+        symbol = self.__symbols.get(abs(assumptions[-1]))
+        if symbol is None:
+            return "", ""
+        k, kmodule = self.__ids[symbol]
+        # the literals of a symbol are assumed together
+        tail = set(assumptions[-2:])
+        if k in tail:
+            return symbol, 'y'
+        if kmodule is not None and kmodule in tail:
+            return symbol, 'm'
+        return symbol, 'n'
+
+    def record(self, call, assumptions, seconds, stats, result):
+        """Records a solver call
+
+        :param call: name of the call
+        :type call: str
+        :param assumptions: assumptions of the call
+        :type assumptions: list
+        :param seconds: wall time
+        :type seconds: float
+        :param stats: increase of the solver counters during the call
+        :type stats: dict
+        :param result: result of the call, None for a limited call that ran
+                       out of budget
+        :type result: bool
+        """
+        symbol, kind = self.tag(assumptions)
+        self.__calls.append((call, symbol, kind, seconds) +
+                            tuple(stats.get(name, 0) for name in STATS) +
+                            (len(assumptions),
+                             None if result is None else bool(result)))
+
+    def solver(self, solver):
+        """Wraps a solver to record its calls
+
+        :param solver: pysat solver or :class:`preprocess.SimplifiedSolver`
+        :type solver: object
+        :return: solver recording its calls in this profiler
+        :rtype: ProfiledSolver
+        """
+        return ProfiledSolver(solver, self)
+
+    def helper(self, name, function):
+        """Wraps a function to time its calls
+
+        :param name: name of the helper in the report
+        :type name: str
+        :param function: function
+        :type function: function
+        :return: function timing its calls in this profiler
+        :rtype: function
+        """
+        counters = self.__helpers.setdefault(name, [0, 0.0])
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                counters[0] += 1
+                counters[1] += time.perf_counter() - start
+        return timed
+
+    def instrument(self, obj, names):
+        """Times the calls of methods of an object
+
+        :param obj: object, e.g. a :class:`utils.DimacsFla`
+        :type obj: object
+        :param names: names of the methods
+        :type names: list
+        """
+        for name in names:
+            setattr(obj, name, self.helper(
+                "{}.{}".format(type(obj).__name__, name),
+                getattr(obj, name)))
+
+    def get_calls(self):
+        """Gives the recorded solver calls
+
+        :return: calls, as tuples of :data:`CALL_FIELDS`
+        :rtype: list
+        """
+        return self.__calls
+
+    def get_helpers(self):
+        """Gives the time spent in the helpers
+
+        :return: {name: (calls, seconds)}
+        :rtype: dict
+        """
+        return {name: tuple(counters)
+                for name, counters in self.__helpers.items()}
+
+    def top_symbols(self, n=TOP):
+        """Sums the solver calls up per symbol
+
+        :param n: number of symbols
+        :type n: int
+        :return: (symbol, calls, seconds, conflicts, decisions) of the n
+                 symbols that took the most time
+        :rtype: list
+        """
+        symbols = dict()
+        for call in self.__calls:
+            totals = symbols.setdefault(call[1], [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += call[3]
+            totals[2] += call[4]
+            totals[3] += call[5]
+        return sorted(((symbol,) + tuple(totals)
+                       for symbol, totals in symbols.items()),
+                      key=lambda row: -row[2])[:n]
+
+    def write(self, path):
+        """Writes the report as JSON
+
+        :param path: file
+        :type path: str
+        """
+        with open(path, 'w') as stream:
+            json.dump({"calls": [dict(zip(CALL_FIELDS, call))
+                                 for call in self.__calls],
+                       "helpers": {name: {"calls": calls, "seconds": seconds}
+                                   for name, (calls, seconds)
+                                   in self.get_helpers().items()},
+                       "top": [dict(zip(("symbol", "calls", "seconds",
+                                         "conflicts", "decisions"), row))
+                               for row in self.top_symbols()]},
+                      stream, indent=1)
+
+    def summary(self, n=TOP):
+        """Sums the profile up
+
+        :param n: number of symbols
+        :type n: int
+        :return: lines
+        :rtype: list
+        """
+        seconds = sum(call[3] for call in self.__calls)
+        lines = ["{} solver calls, {:.2f}s".format(len(self.__calls),
+                                                   seconds)]
+        for name, (calls, total) in sorted(self.get_helpers().items(),
+                                           key=lambda item: -item[1][1]):
+            lines.append("{:<40} {:>10} calls {:>9.3f}s".format(
+                name, calls, total))
+        lines.append("{:<40} {:>8} {:>9} {:>10} {:>10}".format(
+            "symbol", "calls", "seconds", "conflicts", "decisions"))
+        for symbol, calls, total, conflicts, decisions in \
+                self.top_symbols(n):
+            lines.append("{:<40} {:>8} {:>9.3f} {:>10} {:>10}".format(
+                symbol or "-", calls, total, conflicts, decisions))
+        return lines
+
+
+class ProfiledSolver:
+    """ProfiledSolver records the solve, solve_limited and propagate calls of
+    a solver in a profiler; every other method is the one of the solver.
+
+    :param solver: pysat solver or :class:`preprocess.SimplifiedSolver`
+    :type solver: object
+    :param profiler: profiler
+    :type profiler: Profiler
+    """
+
+    def __init__(self, solver, profiler):
+        """Constructor"""
+        self.__solver = solver
+        self.__profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.__solver, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.__solver.delete()
+
+    def __call(self, call, assumptions, **kwargs):
+        before = self.__solver.accum_stats()
+        start = time.perf_counter()
+        res = getattr(self.__solver, call)(assumptions=assumptions, **kwargs)
+        seconds = time.perf_counter() - start
+        after = self.__solver.accum_stats()
+        self.__profiler.record(
+            call, assumptions, seconds,
+            {name: after.get(name, 0) - before.get(name, 0)
+             for name in STATS},
+            res[0] if call == "propagate" else res)
+        return res
+
+    def solve(self, assumptions=[]):
+        return self.__call("solve", assumptions)
+
+    def solve_limited(self, assumptions=[], expect_interrupt=False):
+        return self.__call("solve_limited", assumptions,
+                           expect_interrupt=expect_interrupt)
+
+    def propagate(self, assumptions=[]):
+        return self.__call("propagate", assumptions)
@@ -0,0 +1,250 @@
+"""REPAIR OF INVALID CONFIGURATIONS
+
+An invalid configuration is repaired into the valid configuration that
+changes the fewest symbols: the formula is hard and the value of each BOOL
+and TRISTATE symbol is soft. The minimum is found with implicit hitting sets
+over the warm solver of a :class:`config_check.ConfigChecker`: the symbols
+to change are a minimum hitting set of the cores found so far, itself a
+small MaxSAT problem solved with RC2; if the other symbols keep their values
+satisfiably, the model is an optimal repair, otherwise its core is minimised
+and added. The minimisations and the RC2 calls are charged to the time budget
+of the repair, as the solve calls are.
+"""
+
+from pysat.examples.rc2 import RC2
+from pysat.formula import WCNF
+from itertools import islice
+import argparse
+import csv
+import os
+import threading
+import time
+import config_check
+import explain
+import solving
+import utils
+
+# seconds spent on repairing one configuration
+REPAIR_SECONDS = 60.0
+
+# header of the batch repair results
+REPAIR_HEADER = ["name", "sat", "repaired", "nb_changes", "changes"]
+
+
+def _hitting_set(cores, seconds=None):
+    """Minimum set of symbols hitting every core, found by RC2 within a time
+    budget; None if it runs out"""
+    symbols = sorted(set().union(*cores))
+    ids = {v: i + 1 for i, v in enumerate(symbols)}
+    wcnf = WCNF()
+    for core in cores:
+        wcnf.append([ids[v] for v in core])
+    for v in symbols:
+        wcnf.append([-ids[v]], weight=1)
+    with RC2(wcnf) as rc2:
+        if seconds is None:
+            model = rc2.compute()
+        else:
+            timer = threading.Timer(seconds, rc2.interrupt)
+            timer.start()
+            try:
+                model = rc2.compute(expect_interrupt=True)
+            finally:
+                timer.cancel()
+    if model is None:
+        return None
+    return {v for v in symbols if model[ids[v] - 1] > 0}
+
+
+def _value(kconfig_type, k, kmodule, true):
+    """Value of a symbol in a model, given its true variables"""
+    if k in true:
+        return 'y'
+    if kconfig_type == "TRISTATE" and kmodule in true:
+        return 'm'
+    return 'n'
+
+
+class Repairer:
+    """Repairer class repairs configurations against the formula of a
+    checker.
+
+    The cores found by a repair are minimised by the explainer of the
+    checker, or by an explainer of its own, whose cache serves the next
+    repairs.
+
+    :param checker: checker whose warm solver is used
+    :type checker: config_check.ConfigChecker
+    :param seconds: time budget of a repair; None, 0 or less for no bound
+    :type seconds: float
+    """
+
+    def __init__(self, checker, seconds=REPAIR_SECONDS):
+        """Constructor"""
+        self.__checker = checker
+        self.__seconds = seconds if seconds is not None and seconds > 0 \
+            else None
+        self.__explainer = checker.get_explainer() \
+            or explain.Explainer(checker.get_solver())
+
+    def repair(self, dconfig):
+        """Finds the valid configuration closest to a configuration
+
+        The symbols that are not set in the configuration have the 'n' value;
+        options of other types, and TRISTATE symbols with another value, are
+        left as they are.
+
+        :param dconfig: configuration as given by :func:`utils.read_config`
+        :type dconfig: dict
+        :return: (repaired configuration, {symbol: (value, new value)});
+                 None if the time budget ran out first or the formula is
+                 unsatisfiable
+        :rtype: tuple
+        """
+        checker = self.__checker
+        solver = checker.get_solver()
+        deadline = None if self.__seconds is None \
+            else time.monotonic() + self.__seconds
+        # the literals of the variables of a symbol's name, one soft value
+        steps = dict()
+        for k, v, kconfig_type, literals, _ in config_check.config_literals(
+                dconfig, checker.get_dimacs(), checker.get_alloptions(),
+                checker.get_symbols()):
+            if literals:
+                kmodule = abs(literals[1]) if len(literals) > 1 else None
+                steps.setdefault(v, (k, kconfig_type, kmodule, []))[3]\
+                    .extend(literals)
+        symbol_of = {lit: v for v, (_, _, _, literals) in steps.items()
+                     for lit in literals}
+        # the cached cores of the configuration are cores of its values
+        cores = [{symbol_of[lit] for lit in core} for core, _, _ in
+                 self.__explainer.get_explanations()
+                 if all(lit in symbol_of for lit in core)]
+        while True:
+            changed = set()
+            if cores:
+                changed = _hitting_set(cores, self.__left(deadline))
+                if changed is None:
+                    return None
+            assumptions = [lit for v, (_, _, _, literals) in steps.items()
+                           if v not in changed for lit in literals]
+            seconds = self.__left(deadline)
+            if seconds is not None and seconds <= 0:
+                return None
+            res = solving.solve_limited(solver, assumptions, None, seconds)
+            if res is None:
+                return None
+            if res:
+                break
+            core = solver.get_core()
+            if not core:
+                return None
+            cores.append({symbol_of[lit] for lit in
+                          self.__explainer.explain(core, deadline)})
+
+        true = {lit for lit in solver.get_model() if lit > 0}
+        repaired = dict(dconfig)
+        changes = dict()
+        for v in changed:
+            k, kconfig_type, kmodule, literals = steps[v]
+            value = _value(kconfig_type, k, kmodule, set(literals))
+            new = _value(kconfig_type, k, kmodule, true)
+            if new != value:
+                changes[v] = (value, new)
+                repaired[v] = new
+        return repaired, changes
+
+    @staticmethod
+    def __left(deadline):
+        """Seconds left before a deadline, at least 0; None for no bound"""
+        if deadline is None:
+            return None
+        return max(deadline - time.monotonic(), 0.0)
+
+
+def repair_check(sources, dimacs, alloptions_file, output,
+                 seconds=REPAIR_SECONDS):
+    """Repairs the invalid configurations of many .config files
+
+    The formula is loaded once and every configuration is checked, then
+    repaired if it is invalid, with one warm solver. The repaired
+    configurations are written in the output directory, under the name of
+    their .config file, with a repairs.csv file listing the changes.
+
+    :param sources: .config sources (see :func:`config_check.config_paths`)
+    :type sources: list
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param output: directory of the repaired configurations
+    :type output: str
+    :param seconds: time budget of a repair; None, 0 or less for no bound
+    :type seconds: float
+    :return: (checked configurations, repaired configurations)
+    :rtype: tuple
+    """
+    os.makedirs(output, exist_ok=True)
+    paths = config_check.config_paths(sources)
+    nb = nb_repaired = 0
+    # the cores are minimised by the repairs, within their time budget
+    with config_check.ConfigChecker(dimacs, alloptions_file) as checker, \
+         open(os.path.join(output, "repairs.csv"), 'w', newline='') \
+         as stream:
+        repairer = Repairer(checker, seconds)
+        writer = csv.writer(stream)
+        writer.writerow(REPAIR_HEADER)
+        while True:
+            chunk = list(islice(paths, config_check.BATCH_SIZE))
+            if not chunk:
+                break
+            dconfigs = [utils.read_config(path, True) for path in chunk]
+            for path, dconfig, (sat, _, _) in \
+                    zip(chunk, dconfigs, checker.check_all(dconfigs)):
+                name = os.path.basename(path)
+                if sat:
+                    writer.writerow([name, True, None, 0, None])
+                    continue
+                res = repairer.repair(dconfig)
+                if res is None:
+                    writer.writerow([name, False, False, None, None])
+                    continue
+                repaired, changes = res
+                utils.write_config(repaired, os.path.join(output, name))
+                writer.writerow([name, False, True, len(changes),
+                                 " ".join("{}:{}>{}".format(v, *change)
+                                          for v, change in changes.items())])
+                nb_repaired += 1
+            nb += len(chunk)
+    return nb, nb_repaired
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--config", type=str, help=".config file")
+    group.add_argument("--batch", type=str, nargs='+', metavar="SOURCE",
+                       help="directories, globs or .config files to repair "\
+                       "('-' reads paths from stdin)")
+    parser.add_argument("--dimacs", type=str, help="dimacs file",
+                        required=True)
+    parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
+                        required=True)
+    parser.add_argument("--output", type=str, default="repaired",
+                        help="directory of the repaired configurations")
+    parser.add_argument("--seconds", type=float, default=REPAIR_SECONDS,
+                        help="time budget of a repair in seconds, 0 for no "\
+                        "bound")
+    args = parser.parse_args()
+    sources = [args.config] if args.config else args.batch
+    missing = config_check.unmatched_sources(sources)
+    if missing:
+        parser.error("no .config file matches {}".format(", ".join(missing)))
+    nb, nb_repaired = repair_check(sources, args.dimacs, args.alloptions,
+                                   args.output, args.seconds)
+    print("{} configurations checked, {} repaired in {}".format(
+        nb, nb_repaired, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,617 @@
+"""CHECK RESULTS
+
+The impossible values found by a sanity check are written to a SQLite
+database as soon as each symbol is decided, so that an interrupted run can be
+resumed and the results queried without rerunning the check:
+
+    runs(run, dimacs, dimacs_hash, alloptions, alloptions_hash, started,
+         finished)
+    symbols(run, id, symbol)            symbols decided by a run
+    impossible(run, symbol, value)      values they cannot take
+
+The results of the checkers are also written as typed columnar tables, to
+be loaded, filtered and joined by notebooks and diff tooling without parsing
+text: symbols by their DIMACS ID, impossible values as bits of
+:data:`VALUE_BITS`, unsatisfiability cores as lists of literals. Parquet and
+Arrow IPC files need pyarrow; .sqlite and .db files are SQLite databases
+with a "results" table (cores as int32 blobs) and a "metadata" table.
+"""
+
+from contextlib import closing
+import argparse
+import json
+import os
+import sqlite3
+import time
+from urllib.request import pathname2url
+import numpy as np
+import dimacsio
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY,
+    dimacs TEXT, dimacs_hash TEXT,
+    alloptions TEXT, alloptions_hash TEXT,
+    started REAL, finished REAL);
+CREATE TABLE IF NOT EXISTS symbols (
+    run INTEGER, id INTEGER, symbol TEXT,
+    PRIMARY KEY (run, symbol));
+CREATE TABLE IF NOT EXISTS impossible (
+    run INTEGER, symbol TEXT, value TEXT,
+    PRIMARY KEY (run, symbol, value));
+"""
+
+# seconds between two commits: at most this much work is lost on interruption
+COMMIT_INTERVAL = 1.0
+
+# order of the values in the exported CSV
+VALUE_ORDER = ('y', 'm', 'n')
+
+# bits of the impossible values in the columnar tables
+VALUE_BITS = {'y': 1, 'm': 2, 'n': 4}
+
+# columnar formats, by file extension
+ARROW_FORMATS = {".parquet": "parquet", ".arrow": "ipc", ".feather": "ipc"}
+
+# file extensions of the SQLite tables
+SQLITE_FORMATS = (".sqlite", ".db")
+
+# column types of the sanity check table
+SANITY_COLUMNS = {"id": "int32", "symbol": "str", "impossible": "uint8"}
+
+# column types of the batch .config check table: the last clause is the
+# symbol whose step made the configuration unsatisfiable, "in" tells
+# whether it is set in the .config, and the core holds DIMACS literals
+CHECK_COLUMNS = {"name": "str", "sat": "bool", "nb_yes": "int32",
+                 "nb_mod": "int32", "last_clause_id": "int32",
+                 "last_clause": "str", "in": "bool", "core": "int32[]"}
+
+# SQLite types of the column types
+SQLITE_TYPES = {"int32": "INTEGER", "uint8": "INTEGER", "bool": "INTEGER",
+                "str": "TEXT", "int32[]": "BLOB"}
+
+
+class SanityStore:
+    """SanityStore holds the results of sanity checks in a SQLite database.
+
+    Several processes may record into the same database.
+
+    :param path: database file, created if needed
+    :type path: str
+    """
+
+    def __init__(self, path):
+        """Constructor"""
+        self.__connection = sqlite3.connect(path, timeout=60)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.executescript(SCHEMA)
+        self.__last_commit = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Commits and closes the database"""
+        self.flush()
+        self.__connection.close()
+
+    def flush(self):
+        """Commits the recorded symbols"""
+        self.__connection.commit()
+        self.__last_commit = time.monotonic()
+
+    def start(self, dimacs, alloptions_file, resume=False):
+        """Starts a run, or resumes the last one on the same files
+
+        :param dimacs: DIMACS file
+        :type dimacs: str
+        :param alloptions_file: alloptions csv file
+        :type alloptions_file: str
+        :param resume: resume the last run whose files have the same content
+        :type resume: bool
+        :return: run
+        :rtype: int
+        """
+        hashes = (dimacsio.file_hash(dimacs),
+                  dimacsio.file_hash(alloptions_file))
+        if resume:
+            row = self.__connection.execute(
+                "SELECT MAX(run) FROM runs WHERE dimacs_hash = ? AND "
+                "alloptions_hash = ?", hashes).fetchone()
+            if row[0] is not None:
+                return row[0]
+        run = self.__connection.execute(
+            "INSERT INTO runs (dimacs, dimacs_hash, alloptions, "
+            "alloptions_hash, started) VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(dimacs), hashes[0],
+             os.path.abspath(alloptions_file), hashes[1], time.time()))\
+            .lastrowid
+        self.flush()
+        return run
+
+    def finish(self, run):
+        """Marks a run as complete
+
+        :param run: run
+        :type run: int
+        """
+        self.__connection.execute(
+            "UPDATE runs SET finished = ? WHERE run = ?", (time.time(), run))
+        self.flush()
+
+    def record(self, run, k, v, values):
+        """Records a decided symbol
+
+        :param run: run
+        :type run: int
+        :param k: DIMACS ID of the symbol
+        :type k: int
+        :param v: symbol
+        :type v: str
+        :param values: values the symbol cannot take
+        :type values: set
+        """
+        self.__connection.execute(
+            "INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)", (run, k, v))
+        self.__connection.executemany(
+            "INSERT OR REPLACE INTO impossible VALUES (?, ?, ?)",
+            [(run, v, value) for value in values])
+        if time.monotonic() - self.__last_commit > COMMIT_INTERVAL:
+            self.flush()
+
+    def get_done(self, run):
+        """Gives the symbols decided by a run
+
+        :param run: run
+        :type run: int
+        :return: symbols
+        :rtype: set
+        """
+        return {v for v, in self.__connection.execute(
+            "SELECT symbol FROM symbols WHERE run = ?", (run,))}
+
+    def get_impossible_values(self, run):
+        """Gives the impossible values found by a run
+
+        :param run: run
+        :type run: int
+        :return: dictionary {symbol: set of impossible values}, in DIMACS ID
+                 order
+        :rtype: dict
+        """
+        impossible_values = dict()
+        for v, value in self.__connection.execute(
+                "SELECT s.symbol, i.value FROM symbols s JOIN impossible i "
+                "ON s.run = i.run AND s.symbol = i.symbol WHERE s.run = ? "
+                "ORDER BY s.id", (run,)):
+            impossible_values.setdefault(v, set()).add(value)
+        return impossible_values
+
+    def get_symbols(self, run):
+        """Gives the symbols decided by a run with their DIMACS IDs
+
+        :param run: run
+        :type run: int
+        :return: (id, symbol) in DIMACS ID order
+        :rtype: list
+        """
+        return self.__connection.execute(
+            "SELECT id, symbol FROM symbols WHERE run = ? ORDER BY id",
+            (run,)).fetchall()
+
+    def get_last_run(self, dimacs):
+        """Gives the last finished run on a DIMACS file
+
+        :param dimacs: DIMACS file
+        :type dimacs: str
+        :return: run, None if there is none
+        :rtype: int
+        """
+        return self.__connection.execute(
+            "SELECT MAX(run) FROM runs WHERE dimacs_hash = ? AND finished "
+            "IS NOT NULL", (dimacsio.file_hash(dimacs),)).fetchone()[0]
+
+    def get_runs(self):
+        """Lists the runs
+
+        :return: (run, DIMACS file, alloptions file, start time, end time or
+                 None, number of decided symbols)
+        :rtype: list
+        """
+        return self.__connection.execute(
+            "SELECT r.run, r.dimacs, r.alloptions, r.started, r.finished, "
+            "COUNT(s.symbol) FROM runs r LEFT JOIN symbols s "
+            "ON r.run = s.run GROUP BY r.run ORDER BY r.run").fetchall()
+
+
+def write_csv(impossible_values, path):
+    """Writes impossible values in the examples/impossible.csv format
+
+    :param impossible_values: dictionary {symbol: set of impossible values}
+    :type impossible_values: dict
+    :param path: CSV file
+    :type path: str
+    """
+    with open(path, 'w') as stream:
+        stream.write('option,impossible_value\n')
+        for v, values in impossible_values.items():
+            stream.write("{},{{{}}}\n".format(v, "  ".join(
+                "'{}'".format(value) for value in VALUE_ORDER
+                if value in values)))
+
+
+def read_csv(path):
+    """Reads impossible values in the examples/impossible.csv format
+
+    :param path: CSV file
+    :type path: str
+    :return: dictionary {symbol: set of impossible values}
+    :rtype: dict
+    """
+    impossible_values = dict()
+    with open(path, 'r') as stream:
+        next(stream)
+        for line in stream:
+            if line.strip():
+                v, values = line.rstrip('\n').split(',', 1)
+                impossible_values[v] = {value.strip("'") for value in
+                                        values.strip("{}").split()}
+    return impossible_values
+
+
+def encode_values(values):
+    """Encodes values as bits of :data:`VALUE_BITS`
+
+    :param values: values, e.g. impossible values of a symbol
+    :type values: set
+    :return: bits
+    :rtype: int
+    """
+    return sum(VALUE_BITS[value] for value in set(values))
+
+
+def decode_values(bits):
+    """Decodes bits of :data:`VALUE_BITS` into values
+
+    :param bits: bits
+    :type bits: int
+    :return: values
+    :rtype: set
+    """
+    return {value for value in VALUE_ORDER if int(bits) & VALUE_BITS[value]}
+
+
+def sanity_columns(impossible_values, symbols):
+    """Columns of the sanity check table (see :data:`SANITY_COLUMNS`)
+
+    :param impossible_values: dictionary {symbol: set of impossible values}
+    :type impossible_values: dict
+    :param symbols: (id, symbol) of the checked symbols; the symbols
+                    without impossible values have no bits set
+    :type symbols: list
+    :return: {column: values}
+    :rtype: dict
+    """
+    ids, names = [], []
+    seen = set()
+    for k, v in symbols:
+        if v not in seen:
+            seen.add(v)
+            ids.append(k)
+            names.append(v)
+    return {"id": np.array(ids, dtype=np.int32), "symbol": names,
+            "impossible": np.array([encode_values(impossible_values.get(v, ()))
+                                    for v in names], dtype=np.uint8)}
+
+
+def _connect_ro(path):
+    """Opens a SQLite database for reading"""
+    return sqlite3.connect("file:{}?mode=ro".format(
+        pathname2url(os.path.abspath(path))), uri=True)
+
+
+def is_table(path):
+    """Tells whether a file is a table written by :func:`write_table`
+
+    :param path: file
+    :type path: str
+    :rtype: bool
+    """
+    extension = os.path.splitext(path)[1]
+    if extension in ARROW_FORMATS:
+        return True
+    if extension not in SQLITE_FORMATS or not os.path.isfile(path):
+        return False
+    try:
+        with closing(_connect_ro(path)) as db:
+            return db.execute("SELECT COUNT(*) FROM sqlite_master WHERE "
+                              "type = 'table' AND name = 'results'")\
+                .fetchone()[0] > 0
+    except sqlite3.DatabaseError:
+        return False
+
+
+def check_table(path):
+    """Checks that a table can be written in a file, before it is computed
+
+    :param path: table file
+    :type path: str
+    :raises ValueError: if the extension is not a table format, or if the
+                        file is a SQLite database other than a table
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in ARROW_FORMATS and extension not in SQLITE_FORMATS:
+        extensions = list(ARROW_FORMATS) + list(SQLITE_FORMATS)
+        raise ValueError("{}: a table is a {} or {} file".format(
+            path, ", ".join(extensions[:-1]), extensions[-1]))
+    if extension in SQLITE_FORMATS and os.path.exists(path) \
+       and not is_table(path):
+        raise ValueError("{} exists and is not a results table: not "
+                         "overwritten".format(path))
+
+
+def table_argument(path):
+    """Command line type of a table to write, checked by :func:`check_table`
+    before the checks run"""
+    try:
+        check_table(path)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+    return path
+
+
+def _arrow_type(pa, column_type):
+    """pyarrow type of a column type"""
+    if column_type == "int32[]":
+        return pa.list_(pa.int32())
+    return {"int32": pa.int32(), "uint8": pa.uint8(), "bool": pa.bool_(),
+            "str": pa.string()}[column_type]
+
+
+def _import_pyarrow(path):
+    """Imports pyarrow, which Parquet and Arrow IPC files need"""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("{} needs pyarrow: install it or write a .sqlite "
+                          "file instead".format(path)) from e
+    return pyarrow
+
+
+def table_metadata(kind, dimacs, alloptions_file):
+    """Metadata of a table: what it holds and the files it was checked on
+
+    :param kind: "sanity" or "check"
+    :type kind: str
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :return: {key: value}; the hashes of the files that no longer exist are
+             None
+    :rtype: dict
+    """
+    metadata = {"kind": kind, "created": time.time()}
+    for key, path in (("dimacs", dimacs), ("alloptions", alloptions_file)):
+        metadata[key] = os.path.abspath(path)
+        metadata[key + "_hash"] = dimacsio.file_hash(path) \
+            if os.path.exists(path) else None
+    return metadata
+
+
+def write_table(path, types, columns, metadata=None):
+    """Writes columns in a table, whose format is given by the extension
+
+    :param path: .parquet, .arrow, .feather, .sqlite or .db file, replaced
+                 if it exists (see :func:`check_table`)
+    :type path: str
+    :param types: {column: type}, as :data:`SANITY_COLUMNS`; None values
+                  are nulls
+    :type types: dict
+    :param columns: {column: values}
+    :type columns: dict
+    :param metadata: {key: value} written with the table
+    :type metadata: dict
+    """
+    check_table(path)
+    metadata = dict(metadata or {}, columns=types)
+    kind = ARROW_FORMATS.get(os.path.splitext(path)[1])
+    if kind is not None:
+        pa = _import_pyarrow(path)
+        table = pa.table({name: pa.array(columns[name],
+                                         type=_arrow_type(pa, column_type))
+                          for name, column_type in types.items()},
+                         metadata={key: json.dumps(value)
+                                   for key, value in metadata.items()})
+        if kind == "parquet":
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with pa.OSFile(path, 'wb') as sink, \
+                 pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return
+
+    rows = []
+    for name, column_type in types.items():
+        values = columns[name]
+        if column_type == "int32[]":
+            values = [None if value is None else
+                      np.asarray(value, dtype=np.int32).tobytes()
+                      for value in values]
+        elif isinstance(values, np.ndarray):
+            values = values.tolist()
+        rows.append(values)
+    if os.path.exists(path):
+        os.remove(path)
+    with closing(sqlite3.connect(path)) as db, db:
+        db.execute("CREATE TABLE results ({})".format(", ".join(
+            '"{}" {}'.format(name, SQLITE_TYPES[column_type])
+            for name, column_type in types.items())))
+        db.executemany("INSERT INTO results VALUES ({})".format(
+            ", ".join("?" * len(types))), zip(*rows))
+        db.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+        db.executemany("INSERT INTO metadata VALUES (?, ?)",
+                       [(key, json.dumps(value))
+                        for key, value in metadata.items()])
+
+
+def read_metadata(path):
+    """Reads the metadata of a table written by :func:`write_table`
+
+    :param path: table file
+    :type path: str
+    :return: {key: value}, with the column types under "columns"
+    :rtype: dict
+    """
+    kind = ARROW_FORMATS.get(os.path.splitext(path)[1])
+    if kind is None:
+        with closing(_connect_ro(path)) as db:
+            rows = db.execute("SELECT key, value FROM metadata").fetchall()
+            return {key: json.loads(value) for key, value in rows}
+    pa = _import_pyarrow(path)
+    if kind == "parquet":
+        import pyarrow.parquet
+        schema = pyarrow.parquet.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    return {key.decode(): json.loads(value)
+            for key, value in (schema.metadata or {}).items()}
+
+
+def read_table(path, columns=None):
+    """Reads a table written by :func:`write_table`
+
+    :param path: table file
+    :type path: str
+    :param columns: columns to read; all of them if None
+    :type columns: list
+    :return: table; cores are int32 arrays
+    :rtype: pandas.DataFrame
+    """
+    kind = ARROW_FORMATS.get(os.path.splitext(path)[1])
+    if kind is not None:
+        pa = _import_pyarrow(path)
+        if kind == "parquet":
+            import pyarrow.parquet
+            return pyarrow.parquet.read_table(path, columns=columns)\
+                .to_pandas()
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return (table if columns is None else table.select(columns))\
+            .to_pandas()
+
+    import pandas as pd
+    types = read_metadata(path)["columns"]
+    names = list(types) if columns is None else list(columns)
+    with closing(_connect_ro(path)) as db:
+        df = pd.read_sql_query("SELECT {} FROM results".format(", ".join(
+            '"{}"'.format(name) for name in names)), db)
+    for name in names:
+        column_type = types[name]
+        if column_type == "int32[]":
+            df[name] = [None if value is None else
+                        np.frombuffer(value, dtype=np.int32)
+                        for value in df[name]]
+        elif column_type != "str":
+            # the nullable pandas types keep the nulls
+            df[name] = df[name].astype(
+                {"int32": "Int32", "uint8": "UInt8", "bool": "boolean"}
+                [column_type] if df[name].isna().any() else column_type)
+    return df
+
+
+def table_impossible_values(path):
+    """Reads the impossible values of a sanity check table
+
+    :param path: table file
+    :type path: str
+    :return: dictionary {symbol: set of impossible values}, in table order
+    :rtype: dict
+    """
+    df = read_table(path, ["symbol", "impossible"])
+    return {v: decode_values(bits) for v, bits in
+            zip(df["symbol"], df["impossible"]) if bits}
+
+
+def diff_tables(old, new):
+    """Compares two sanity check tables by symbol name, e.g. of two
+    releases whose DIMACS IDs differ
+
+    :param old: table file
+    :type old: str
+    :param new: table file
+    :type new: str
+    :return: symbol, old and new impossible bits (-1 when the symbol is
+             missing from a table) of the symbols that differ
+    :rtype: pandas.DataFrame
+    """
+    columns = ["symbol", "impossible"]
+    df = read_table(old, columns).merge(read_table(new, columns),
+                                        on="symbol", how="outer",
+                                        suffixes=("_old", "_new"))
+    df = df.fillna(-1).astype({"impossible_old": np.int16,
+                               "impossible_new": np.int16})
+    return df[df["impossible_old"] != df["impossible_new"]]\
+        .reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", type=str, nargs='?',
+                        help="sanity check database")
+    parser.add_argument("--run", type=int,
+                        help="run to export (default: the last one)")
+    parser.add_argument("--export", type=str, metavar="FILE",
+                        help="writes the impossible values of the run in a "\
+                        ".csv file, or in a table (.parquet, .arrow, "\
+                        ".feather, .sqlite or .db)")
+    parser.add_argument("--diff", type=str, nargs=2, metavar=("OLD", "NEW"),
+                        help="compares the impossible values of two sanity "\
+                        "check tables by symbol name")
+    args = parser.parse_args()
+    if args.diff:
+        df = diff_tables(*args.diff)
+        for v, old, new in df.itertuples(index=False):
+            print("{}\t{}\t{}".format(v, *(
+                "-" if bits < 0 else "{{{}}}".format(" ".join(
+                    value for value in VALUE_ORDER
+                    if value in decode_values(bits)))
+                for bits in (old, new))))
+        print("{} symbols differ".format(len(df)))
+        return
+    if args.store is None:
+        parser.error("a store or --diff is needed")
+    if args.export and not args.export.endswith(".csv"):
+        try:
+            check_table(args.export)
+        except ValueError as e:
+            parser.error(str(e))
+    with SanityStore(args.store) as store:
+        runs = store.get_runs()
+        if args.export:
+            run = args.run if args.run is not None else runs[-1][0]
+            impossible_values = store.get_impossible_values(run)
+            if args.export.endswith(".csv"):
+                write_csv(impossible_values, args.export)
+            else:
+                _, dimacs, alloptions = next(row for row in runs
+                                             if row[0] == run)[:3]
+                write_table(args.export, SANITY_COLUMNS,
+                            sanity_columns(impossible_values,
+                                           store.get_symbols(run)),
+                            table_metadata("sanity", dimacs, alloptions))
+            print("Run {} written in {}".format(run, args.export))
+            return
+        for run, dimacs, alloptions, started, finished, nb in runs:
+            print("{}\t{}\t{}\t{}\t{} symbols{}".format(
+                run, time.strftime("%Y-%m-%d %H:%M", time.localtime(started)),
+                dimacs, alloptions, nb, "" if finished else " (unfinished)"))
+
+if __name__ == "__main__":
+    main()
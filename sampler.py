@@ -0,0 +1,295 @@
+"""UNIFORM SAMPLING OF CONFIGURATIONS"""
+
+from multiprocessing import Pool
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import counting
+import preprocess
+import utils
+
+# samples drawn per task: tasks are seeded independently, so the samples only
+# depend on the seed, not on the number of workers
+BLOCK_SIZE = 64
+
+# seconds the compilation may take before the sampler falls back on
+# SolverSampler
+COMPILE_SECONDS = 120.0
+
+# header of a .config drawn by the compiled formula, and by SolverSampler
+UNIFORM_HEADER = "#\n# Sample {} (seed {})\n#\n"
+SOLVER_HEADER = "#\n# Sample {} (seed {}), drawn by a solver: not uniform\n#\n"
+
+
+def config_lines(model, symbols):
+    """Writes a configuration in the .config format
+
+    :param model: literals (at least) over the symbol variables
+    :type model: iterable
+    :param symbols: symbols as given by :func:`utils.symbol_types`
+    :type symbols: list
+    :return: lines of the .config
+    :rtype: list
+    """
+    true = {lit for lit in model if lit > 0}
+    lines = []
+    for k, v, kconfig_type, kmodule in symbols:
+        if k in true:
+            lines.append("CONFIG_{}=y".format(v))
+        elif kmodule is not None and kmodule in true:
+            lines.append("CONFIG_{}=m".format(v))
+        else:
+            lines.append("# CONFIG_{} is not set".format(v))
+    return lines
+
+
+class SolverSampler:
+    """SolverSampler draws configurations with a SAT solver whose phases are
+    drawn at random before every solve, when the formula does not compile.
+
+    The configurations are valid but not uniform: propagation and conflicts
+    pull the solver towards some of them, so that the marginals drift (see
+    :func:`marginal_gaps`). It has the interface of
+    :meth:`counting.Compiled.sample`; a new random generator starts a new
+    block on a fresh solver, so that the samples of a block do not depend on
+    the blocks drawn before by the same worker.
+
+    :param clauses: clauses of the formula
+    :type clauses: list
+    :param projection: variables a configuration is made of
+    :type projection: list
+    """
+
+    def __init__(self, clauses, projection):
+        """Constructor"""
+        self.__projection = projection
+        self.__simplification = preprocess.Simplification(clauses, projection)
+        self.__solver = None
+        self.__rng = None
+
+    def __getstate__(self):
+        # the solver is not picklable: workers start their own
+        return self.__projection, self.__simplification
+
+    def __setstate__(self, state):
+        self.__projection, self.__simplification = state
+        self.__solver = None
+        self.__rng = None
+
+    def sample(self, rng):
+        """Draws a configuration
+
+        :param rng: random generator
+        :type rng: random.Random
+        :return: literals over the projection variables; None if the formula
+                 is unsatisfiable
+        :rtype: list
+        """
+        if rng is not self.__rng:
+            if self.__solver is not None:
+                self.__solver.delete()
+            self.__solver = preprocess.SimplifiedSolver(self.__simplification)
+            self.__rng = rng
+        phases = [v if rng.random() < 0.5 else -v for v in self.__projection]
+        self.__solver.set_phases(phases)
+        if not self.__solver.solve():
+            return None
+        model = self.__solver.get_model()
+        # the variables in no clause keep their random phase
+        return [model[abs(lit) - 1] if abs(lit) <= len(model) else lit
+                for lit in phases]
+
+
+# per-process state of the parallel sampling: (symbols, sampler, header)
+_worker = None
+
+
+def _init_worker(symbols, sampler, header):
+    global _worker
+    _worker = (symbols, sampler, header)
+
+
+def _sample_block(task):
+    """Draws and writes the samples of a block in a worker process"""
+    block, indices, seed, output = task
+    symbols, sampler, header = _worker
+    rng = random.Random("{}:{}".format(seed, block))
+    paths = []
+    for i in indices:
+        path = os.path.join(output, "sample_{}".format(i))
+        with open(path, 'w') as stream:
+            stream.write(header.format(i, seed))
+            stream.write("\n".join(config_lines(sampler.sample(rng),
+                                                symbols)) + "\n")
+        paths.append(path)
+    return paths
+
+
+def sample_configs(dimacs, alloptions_file, nb, output, seed=0, jobs=1,
+                   verbose=False, max_seconds=COMPILE_SECONDS, max_memory=None,
+                   solver=False):
+    """Draws uniform configurations and writes them as .config files
+
+    The formula is compiled first; once the compilation reaches its time or
+    memory limit, the configurations are drawn by :class:`SolverSampler`
+    instead, and are not uniform.
+
+    :param dimacs: DIMACS file
+    :type dimacs: str
+    :param alloptions_file: alloptions csv file
+    :type alloptions_file: str
+    :param nb: number of configurations
+    :type nb: int
+    :param output: directory of the .config files
+    :type output: str
+    :param seed: random seed; the samples only depend on it
+    :type seed: int
+    :param jobs: number of worker processes
+    :type jobs: int
+    :param verbose: verbosity
+    :type verbose: bool
+    :param max_seconds: compilation time limit; None for no limit
+    :type max_seconds: float
+    :param max_memory: resident memory limit of the compilation, in bytes;
+                       None for no limit
+    :type max_memory: int
+    :param solver: draw the configurations by :class:`SolverSampler` without
+                   compiling the formula
+    :type solver: bool
+    :return: (paths of the written .config files, whether they are uniform)
+    :rtype: tuple
+    """
+    formula = utils.DimacsFla(dimacs)
+    alloptions = utils.Alloptions(alloptions_file)
+    symbols = utils.symbol_types(formula, alloptions)
+    sampler = None
+    if not solver:
+        try:
+            sampler = counting.load_configurations(
+                formula, alloptions, dimacs, symbols=symbols,
+                max_seconds=max_seconds, max_memory=max_memory)
+        except counting.CompilationLimit as e:
+            print("Compilation given up ({}), configurations drawn by a "
+                  "solver: they are not uniform".format(e), file=sys.stderr)
+            if verbose:
+                print(counting.progress_line(e.progress))
+    if sampler is not None:
+        header = UNIFORM_HEADER
+        if verbose:
+            print("Compiled in {:.2f}s, peak memory {:.1f} MiB".format(
+                sampler.get_compile_time(),
+                sampler.get_compile_memory() / 2**20))
+            print("{} configurations".format(sampler.count()))
+        if not sampler.count():
+            return [], True
+    else:
+        header = SOLVER_HEADER
+        sampler = SolverSampler(
+            formula.get_formula().clauses,
+            counting.projection(symbols, formula.get_nb_declared()))
+        if sampler.sample(random.Random(seed)) is None:
+            return [], False
+    os.makedirs(output, exist_ok=True)
+    tasks = [(block, range(i, min(i + BLOCK_SIZE, nb)), seed, output)
+             for block, i in enumerate(range(0, nb, BLOCK_SIZE))]
+    if jobs > 1:
+        with Pool(jobs, initializer=_init_worker,
+                  initargs=(symbols, sampler, header)) as pool:
+            blocks = pool.map(_sample_block, tasks, chunksize=1)
+    else:
+        _init_worker(symbols, sampler, header)
+        blocks = [_sample_block(task) for task in tasks]
+    return [path for paths in blocks for path in paths], \
+        header is UNIFORM_HEADER
+
+
+def marginal_gaps(paths, compiled, symbols):
+    """Measures how far samples are from uniform: the gap of a symbol is the
+    total variation distance between the shares of y/m/n among the samples
+    and among all the configurations
+
+    :param paths: .config files of the samples
+    :type paths: list
+    :param compiled: compiled configurations
+    :type compiled: counting.Compiled
+    :param symbols: symbols as given by :func:`utils.symbol_types`
+    :type symbols: list
+    :return: (mean gap, max gap, mean gap expected of uniform samples)
+    :rtype: tuple
+    """
+    configs = [utils.read_config(path, True) for path in paths]
+    gaps = []
+    noises = []
+    for name, kconfig_type, y, m, n in counting.symbol_marginals(compiled,
+                                                                 symbols):
+        values = [config.get(name, 'n') for config in configs]
+        gaps.append(sum(abs(values.count(value) / len(values) - share)
+                        for value, share in zip("ymn", (y, m, n))) / 2)
+        # mean absolute deviation of a share over len(values) draws
+        noises.append(sum((2 * share * (1 - share)
+                           / (math.pi * len(values))) ** 0.5
+                          for share in (y, m, n)) / 2)
+    return statistics.mean(gaps), max(gaps), statistics.mean(noises)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
+                        required=True)
+    parser.add_argument("--dimacs", type=str, help="dimacs file name",
+                        required=True)
+    parser.add_argument("-n", type=int, default=100,
+                        help="number of configurations")
+    parser.add_argument("--output", type=str, default="samples",
+                        help="directory of the .config files")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--max-seconds", type=float, default=COMPILE_SECONDS,
+                        help="gives the compilation up after this time and "\
+                        "draws the configurations with a solver, which are "\
+                        "not uniform (default: {:g}, 0 for no bound)"
+                        .format(COMPILE_SECONDS))
+    parser.add_argument("--max-memory", type=float, metavar="MIB",
+                        help="gives the compilation up once the process "\
+                        "takes this much memory, as --max-seconds")
+    parser.add_argument("--solver", action="store_true",
+                        help="draws the configurations with a solver, "\
+                        "without compiling the formula")
+    parser.add_argument("--uniformity", action="store_true",
+                        help="compares the shares of y/m/n among the "\
+                        "samples with the exact ones, within the same limits")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="verbosity")
+    args = parser.parse_args()
+    max_seconds = args.max_seconds or None
+    max_memory = None if args.max_memory is None \
+        else int(args.max_memory * 2**20)
+    paths, uniform = sample_configs(args.dimacs, args.alloptions, args.n,
+                                    args.output, args.seed, args.jobs,
+                                    args.verbose, max_seconds, max_memory,
+                                    args.solver)
+    print("{} {}configurations written in {}".format(
+        len(paths), "" if uniform else "non-uniform ", args.output))
+    if args.uniformity and paths:
+        dimacs = utils.DimacsFla(args.dimacs)
+        alloptions = utils.Alloptions(args.alloptions)
+        symbols = utils.symbol_types(dimacs, alloptions)
+        try:
+            compiled = counting.load_configurations(
+                dimacs, alloptions, args.dimacs, symbols=symbols,
+                max_seconds=max_seconds, max_memory=max_memory)
+        except counting.CompilationLimit as e:
+            print("Uniformity not measured: compilation given up "
+                  "({})".format(e))
+            return
+        print("Gap to the exact shares of y/m/n: mean {:.4f}, max {:.4f} "
+              "(about {:.4f} expected of uniform samples)".format(
+                  *marginal_gaps(paths, compiled, symbols)))
+
+
+if __name__ == "__main__":
+    main()
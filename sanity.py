@@ -3,109 +3,434 @@
 from pysat.formula import CNF
 from pysat.solvers import *
 import os
+from collections import Counter, deque
+from multiprocessing import Pool
+import numpy as np
+import portfolio
+import preprocess
+import profiling
+import results
+import solving
 import utils
 import argparse
 
-def sanity_check_optionsvalues(dimacs, alloptions_file, verbose=False):
+def _candidates(dimacs, alloptions, variables=None):
+    """Lists the values to try for every BOOL and TRISTATE symbol
+
+    :param dimacs: formula
+    :type dimacs: utils.DimacsFla
+    :param alloptions: all options
+    :type alloptions: utils.Alloptions
+    :param variables: {id: symbol} to consider; every variable of the formula
+                      if None
+    :type variables: dict
+    :return: list of (id, symbol, kconfig type, value, assumptions)
+    :rtype: list
+    """
+    if variables is None:
+        variables = dimacs.get_variables()
+    candidates = []
+    for k, v in variables.items():
+        # TODO: if I will remember there is a true option called
+        # SOMETHINGXXX_MODULE
+        # not in Linux options (dummy variables to emulate tristate)
+        # not in Linux options (dummy variables to emulate choices)
+        if dimacs.is_dummy(v):
+            continue # ignore
+
+        kconfig_type = alloptions.get_kconfig_type(v)
+
+        if (kconfig_type == 'BOOL'):
+            # we try true/false values
+            candidates.append((k, v, 'B', 'y', [k]))
+            candidates.append((k, v, 'B', 'n', [-k]))
+        elif(kconfig_type == 'TRISTATE'):
+            # we have to find the other "module" variable that emulates the
+            # "m" value
+            kmodule = dimacs.get_kmodule(v)
+
+            # if an option "opt" is a module, a variable "opt_MODULE" should
+            # exist in the formula. If it is not the case, either the
+            # formula is not consistent or alloptions and the formula were
+            # not generated from the same Linux Kernel version.
+            assert kmodule is not None,\
+                "Module not represented as module in the fomula"
+
+            # we have to try y, n, and m
+            # this case is not possible: k and kmodule
+            candidates.append((k, v, 'T', 'y', [k, -kmodule]))
+            candidates.append((k, v, 'T', 'n', [-k, -kmodule]))
+            candidates.append((k, v, 'T', 'm', [-k, kmodule]))
+        # STRING, INT, HEX: TODO?
+    return candidates
+
+
+def _frozen(candidates):
+    """Variables assumed by the candidates, kept by the preprocessing"""
+    return {abs(lit) for candidate in candidates for lit in candidate[4]}
+
+
+def _satisfies(model, assumptions):
+    """Tells whether a model satisfies every literal of the assumptions"""
+    for lit in assumptions:
+        var = abs(lit)
+        if var > len(model) or model[var - 1] != lit:
+            return False
+    return True
+
+
+def check_values(solver, candidates, verbose=False, decided=None,
+                 budget=None, portfolio=None):
+    """Finds the candidate values that no configuration can take
+
+    Backbone-like search: a value is possible as soon as one model of the
+    formula witnesses it, so each model rules out every pending candidate it
+    satisfies at once. Candidates left are first tried with unit propagation
+    only (a conflict proves them impossible without search), then solved.
+
+    Each candidate left is watched on one of its literals that the last model
+    falsifies: a new model only needs to check the candidates watched on the
+    literals it flips to true. The phases of the solver steer the next models
+    towards the values left; they are set again after every model, as the
+    solver saves its own phases while searching.
+
+    With a budget, a solve call that runs out of it is put aside and retried
+    with a larger budget once every other candidate is done (the models
+    found meanwhile may witness it). Its last attempt is not bounded, and
+    raced between the backends of the portfolio if any.
+
+    :param solver: solver bootstrapped with the formula
+    :type solver: preprocess.SimplifiedSolver
+    :param candidates: values to check, as given by :func:`_candidates`
+    :type candidates: list
+    :param decided: called with (id, symbol, set of impossible values) as
+                    soon as every value of a symbol is checked
+    :type decided: function
+    :param budget: budget of the solve calls
+    :type budget: solving.Budget
+    :param portfolio: backends racing the last attempt of the calls out of
+                      budget
+    :type portfolio: portfolio.Portfolio
+    :return: dictionary {symbol: set of impossible values}
+    :rtype: dict
+    """
+    impossible_values = dict()
+    # indices of the candidates to solve, then (attempt, index) of the calls
+    # out of budget; the decided ones are skipped
+    pending = deque(range(len(candidates)))
+    retries = deque()
+    nb_retries = 0
+    remaining = Counter(c[1] for c in candidates)
+    is_open = bytearray(b'\x01') * len(candidates)
+    # literals of the candidates, and the index of their candidate
+    literals = np.array([lit for c in candidates for lit in c[4]],
+                        dtype=np.int64)
+    owners = np.repeat(np.arange(len(candidates)),
+                       [len(c[4]) for c in candidates])
+    # variables of the candidates, and their literals in the last model (0
+    # out of it)
+    variables = np.unique(np.abs(literals))
+    last = np.zeros(len(variables), dtype=np.int64)
+    # literal -> indices of the candidates watched on it, decided ones
+    # dropped lazily; the literals are false in the last model
+    watched = dict()
+    for i, c in enumerate(candidates):
+        watched.setdefault(c[4][0], []).append(i)
+
+    def done(k, v):
+        remaining[v] -= 1
+        if decided is not None and not remaining[v]:
+            decided(k, v, impossible_values.get(v, set()))
+
+    def witness(model):
+        nonlocal last
+        values = np.zeros(len(variables), dtype=np.int64)
+        inside = variables <= len(model)
+        values[inside] = np.asarray(model, dtype=np.int64)[
+            variables[inside] - 1]
+        flipped = values[values != last].tolist()
+        for lit in flipped:
+            for i in watched.pop(lit, ()):
+                if not is_open[i]:
+                    continue
+                c = candidates[i]
+                false = [l for l in c[4] if not _satisfies(model, (l,))]
+                if false:
+                    watched.setdefault(false[0], []).append(i)
+                else:
+                    is_open[i] = 0
+                    done(c[0], c[1])
+        last = values
+        # steer the next models towards the values still to be witnessed
+        solver.set_phases(literals=literals[
+            np.frombuffer(is_open, dtype=np.uint8)[owners] == 1])
+
+    def solve(assumptions, attempt):
+        # result (None if out of budget) and model of an attempt
+        limits = budget.get_limits(attempt) if budget is not None else None
+        if limits is not None:
+            res = solving.solve_limited(solver, assumptions, *limits)
+        elif portfolio is not None and attempt:
+            res, answer, _ = portfolio.solve(assumptions)
+            return res, answer if res else None
+        else:
+            res = solver.solve(assumptions=assumptions)
+        return res, solver.get_model()
+
+    if solver.solve():
+        witness(solver.get_model())
+    while pending or retries:
+        if pending:
+            attempt, i = 0, pending.popleft()
+            if not is_open[i]:
+                continue
+            st, _ = solver.propagate(assumptions=candidates[i][4])
+        else:
+            attempt, i = retries.popleft()
+            if not is_open[i]:
+                continue
+            st = True
+        # the candidate is decided by its own call, not by a witness
+        is_open[i] = 0
+        k, v, tag, value, assumptions = candidates[i]
+        res, model = solve(assumptions, attempt) if st else (False, None)
+        if res is None:
+            nb_retries += 1
+            is_open[i] = 1
+            retries.append((attempt + 1, i))
+            continue
+        if res:
+            witness(model)
+            done(k, v)
+            continue
+        if verbose:
+            print("[{}] {}:{} cannot take the '{}' value{}"\
+                  .format(tag, k, v, value,
+                          {('B', 'y'): " (dead feature)",
+                           ('B', 'n'): " (core feature)"}\
+                          .get((tag, value), "")))
+        impossible_values.setdefault(v, set()).add(value)
+        done(k, v)
+    if verbose and nb_retries:
+        print("* {} solve calls out of budget, retried".format(nb_retries))
+    return impossible_values
+
+
+# per-process state of the parallel sanity check: (formula, alloptions, solver,
+# results store or None, budget or None)
+_worker = None
+
+# each shard takes this fraction of the symbols left per job: the first
+# shards are large, so that their witness models rule out many values, and
+# the last ones small, so that idle workers share out the hard symbols
+SHARDS_PER_JOB = 2
+
+# symbols of the smallest shards
+MIN_SHARD = 8
+
+
+def _init_worker(dimacs, alloptions_file, simplification, store=None,
+                 budget=None):
+    """Loads the formula and a solver once per worker process"""
+    global _worker
+    _worker = (utils.DimacsFla(dimacs), utils.Alloptions(alloptions_file),
+               preprocess.SimplifiedSolver(simplification),
+               results.SanityStore(store) if store is not None else None,
+               budget)
+
+
+def _check_shard(shard):
+    """Sanity checks a range of symbols in a worker process
+
+    :param shard: (DIMACS IDs of the symbols, verbose, run of the store)
+    :type shard: tuple
+    :return: impossible values of the shard
+    :rtype: dict
+    """
+    ids, verbose, run = shard
+    dimacs, alloptions, solver, store, budget = _worker
+    variables = dimacs.get_variables()
+    candidates = _candidates(dimacs, alloptions,
+                             {k: variables[k] for k in ids})
+    if store is None:
+        return check_values(solver, candidates, verbose, budget=budget)
+    impossible_values = check_values(
+        solver, candidates, verbose,
+        lambda k, v, values: store.record(run, k, v, values), budget)
+    store.flush()
+    return impossible_values
+
+
+def _solver(simplification, profiler=None):
+    """Solver of the sanity check, recording its calls if profiling"""
+    solver = preprocess.SimplifiedSolver(simplification)
+    return solver if profiler is None else profiler.solver(solver)
+
+
+def _check(simplification, candidates, verbose=False, decided=None,
+           profiler=None, budget=None, race=None):
+    """Sanity checks candidates in this process (see :func:`check_values`)"""
+    racers = portfolio.Portfolio(simplification, race) if race else None
+    try:
+        with _solver(simplification, profiler) as l:
+            if verbose:
+                print("* At the beginning, fla is", l.solve(assumptions=[]))
+            return check_values(l, candidates, verbose, decided, budget,
+                                racers)
+    finally:
+        if racers is not None:
+            if verbose:
+                print("* Races won:", ", ".join(
+                    "{} {}".format(name, wins)
+                    for name, wins in racers.get_wins().items()))
+            racers.close()
+
+
+def sanity_check_optionsvalues(dimacs, alloptions_file, verbose=False,
+                               jobs=1, store=None, resume=False,
+                               profiler=None, budget=None, race=None,
+                               table=None):
     """Sanity checks the formula
 
     :param dimacs: DIMACS file contaning the formula to check
     :type dimacs: str
     :param alloptions_file: CSV file of all options
     :type alloptions_file: str
+    :param jobs: number of worker processes
+    :type jobs: int
+    :param store: database where every symbol is recorded as soon as it is
+                  decided (see :mod:`results`); None to keep the results in
+                  memory only
+    :type store: str
+    :param resume: skip the symbols decided by the last run of the store on
+                   the same files
+    :type resume: bool
+    :param profiler: records the solver calls and lookups; the check then
+                     runs in this process whatever the number of jobs
+    :type profiler: profiling.Profiler
+    :param budget: budget of the solve calls, retried with larger budgets
+                   when they run out of it
+    :type budget: solving.Budget
+    :param race: pysat backends racing, each in its own process, the calls
+                 out of budget (see :mod:`portfolio`); the check then runs
+                 in this process whatever the number of jobs
+    :type race: list
+    :param table: table where the impossible values of every symbol are
+                  written at the end (see :func:`results.write_table`)
+    :type table: str
+    :return: dictionary {symbol: set of impossible values}
+    :rtype: dict
     """
-
-    impossible_values = dict()
-    def add_impossible_value(option, value):
-        if option not in impossible_values:
-            impossible_values[option] = {value}
-        else:
-            impossible_values[option].add(value)
-
+    path = dimacs
     dimacs = utils.DimacsFla(dimacs)
     fla = dimacs.get_formula()
-    variables = dimacs.get_variables()
 
     alloptions = utils.Alloptions(alloptions_file)
+    simplify = preprocess.Simplification
+    if race:
+        jobs = 1
+    if profiler is not None:
+        jobs = 1
+        profiler.set_variables(dimacs.get_variables())
+        profiler.instrument(dimacs, profiling.DIMACS_LOOKUPS)
+        profiler.instrument(alloptions, profiling.ALLOPTIONS_LOOKUPS)
+        simplify = profiler.helper("preprocess.Simplification", simplify)
+
+    # preprocessing, keeping every variable a candidate assumes
+    candidates = _candidates(dimacs, alloptions)
+    symbols = [(k, v) for k, v, _, _, _ in candidates]
+    simplification = simplify(fla.clauses, _frozen(candidates))
+    if verbose:
+        print("* Preprocessing:", preprocess.report(simplification))
+    if store is None:
+        if jobs > 1:
+            impossible_values = _parallel_sanity_check(
+                path, alloptions_file, simplification, verbose, jobs,
+                list(dimacs.get_variables()), budget=budget)
+        else:
+            # sanity check
+            impossible_values = _check(simplification, candidates, verbose,
+                                       None, profiler, budget, race)
+    else:
+        with results.SanityStore(store) as db:
+            run = db.start(path, alloptions_file, resume)
+            done = db.get_done(run)
+            if verbose and done:
+                print("* Resuming run {}: {} symbols already checked"
+                      .format(run, len(done)))
+            candidates = [c for c in candidates if c[1] not in done]
+            if jobs > 1:
+                ids = [k for k, v in dimacs.get_variables().items()
+                       if v not in done]
+                _parallel_sanity_check(path, alloptions_file,
+                                       simplification, verbose, jobs, ids,
+                                       store, run, budget)
+            elif candidates:
+                _check(simplification, candidates, verbose,
+                       lambda k, v, values: db.record(run, k, v, values),
+                       profiler, budget, race)
+            db.finish(run)
+            impossible_values = db.get_impossible_values(run)
 
-    # sanity check
-    with Solver(bootstrap_with=fla.clauses) as l:
+    if table is not None:
+        results.write_table(table, results.SANITY_COLUMNS,
+                            results.sanity_columns(impossible_values, symbols),
+                            results.table_metadata("sanity", path,
+                                                   alloptions_file))
         if verbose:
-            print("* At the beginning, fla is", l.solve(assumptions=[]))
-        for k, v in variables.items():
-            # TODO: if I will remember there is a true option called
-            # SOMETHINGXXX_MODULE
-            # not in Linux options (dummy variables to emulate tristate)
-            # not in Linux options (dummy variables to emulate choices)
-            if (v.endswith("_MODULE") or "CHOICE_" in v):  
-                continue # ignore
-
-            kconfig_type = alloptions.get_kconfig_type(v)
-
-            if (kconfig_type == 'BOOL'):
-                # we try true/false values                
-                if not l.solve(assumptions=[k]):
-                    if verbose:
-                        print("[B] {}:{} cannot take the 'y' value "\
-                              "(dead feature)".format(k, v))
-                    add_impossible_value(v, 'y')
-                if not l.solve(assumptions=[-k]):
-                    if verbose:
-                        print("[B] {}:{} cannot take the 'n' value"\
-                              "(core feature)".format(k, v))
-                    add_impossible_value(v, 'n')
-            elif(kconfig_type == 'TRISTATE'):
-                # we have to find the other "module" variable that emulates the
-                # "m" value
-                kmodule = dimacs.get_kmodule(v)
-                
-                # if an option "opt" is a module, a variable "opt_MODULE" should
-                # exist in the formula. If it is not the case, either the
-                # formula is not consistent or alloptions and the formula were
-                # not generated from the same Linux Kernel version.               
-                assert kmodule is not None,\
-                    "Module not represented as module in the fomula"
-                
-                # we have to try y, n, and m
-                # yes: k and !kmodule
-                if not l.solve(assumptions=[k, -kmodule]):
-                    if verbose:
-                        print("[T] {}:{} cannot take the 'y' value"\
-                              .format(k, v))
-                    add_impossible_value(v, 'y')
-                # no: !k and !kmodule
-                if not l.solve(assumptions=[-k, -kmodule]):
-                    if verbose:
-                        print("[T] {}:{} cannot take the 'n' value"\
-                              .format(k, v))
-                    add_impossible_value(v, 'n')
-                # module: !k and kmodule 
-                if not l.solve(assumptions=[-k, kmodule]):
-                    if verbose:
-                        print("[T] {}:{} cannot take the 'm' value"\
-                              .format(k, v))
-                    add_impossible_value(v, 'm')
-                # this case is not possible: k and kmodule
-                # print("trying", v, k, "with three values")
-            elif(kconfig_type == 'STRING'):
-                continue # TODO?
-            elif(kconfig_type == 'INT'):
-                continue # TODO?
-            else:
-                continue # TODO?
-            # print(k, v)
+            print("* Results written in", table)
+    return impossible_values
+
 
+def _parallel_sanity_check(dimacs, alloptions_file, simplification, verbose,
+                           jobs, ids, store=None, run=None, budget=None):
+    """Sanity checks the formula with a pool of worker processes
+
+    The symbols of the variables ``ids`` are split into contiguous ranges of
+    decreasing sizes, handed out one at a time to whichever worker is free.
+    Each worker keeps its own formula and warm solver for all the ranges it
+    gets, and records its symbols in the store, if any.
+    """
+    shards = []
+    i = 0
+    while i < len(ids):
+        size = max(MIN_SHARD, (len(ids) - i) // (jobs * SHARDS_PER_JOB))
+        shards.append((ids[i:i + size], verbose, run))
+        i += size
+
+    impossible_values = dict()
+    with Pool(jobs, initializer=_init_worker,
+              initargs=(dimacs, alloptions_file, simplification,
+                        store, budget)) as pool:
+        for result in pool.imap_unordered(_check_shard, shards,
+                                          chunksize=1):
+            impossible_values.update(result)
     return impossible_values
 
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--alloptions", type=str, help="alloptions-csv file",
                         required=True)
     parser.add_argument("--dimacs", type=str, help="dimacs file name",
                         required=True)
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--store", type=str,
+                        help="database recording the decided symbols")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume the last run of the store")
+    parser.add_argument("--results", type=results.table_argument,
+                        metavar="TABLE",
+                        help="table of the impossible values (.parquet, "\
+                        ".arrow, .feather, .sqlite or .db)")
+    solving.add_budget_arguments(parser)
     # parser.add_argument("--verbose", "-v", action="store_true")
     args = parser.parse_args()
-    sanity_check_optionsvalues(args.dimacs, args.alloptions, True)
+    budget, race = solving.budget_arguments(args)
+    sanity_check_optionsvalues(args.dimacs, args.alloptions, True, args.jobs,
+                               args.store, args.resume, budget=budget,
+                               race=race, table=args.results)
 
 
 if __name__ == "__main__":
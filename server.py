@@ -0,0 +1,342 @@
+"""CHECK SERVER
+
+Loads formulas once and answers check queries over localhost HTTP or a Unix
+socket, with warm solvers:
+
+    GET  /formulas                 names of the loaded formulas
+    GET  /stats                    latency and throughput counters
+    POST /check/NAME               .config in the body
+    POST /values/NAME              JSON {symbol: 'y', 'm' or 'n'} in the body
+"""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import config_check
+import preprocess
+import utils
+
+# latencies kept per endpoint for the percentiles
+LATENCY_WINDOW = 1024
+
+
+class NotFound(Exception):
+    """NotFound is raised for a query about an unknown formula or path"""
+
+
+# per-process state of the pool: {formula name: ConfigChecker}
+_worker = None
+
+
+def _init_worker(formulas, simplifications):
+    global _worker
+    _worker = {name: config_check.ConfigChecker(dimacs, alloptions_file,
+                                                simplifications[name])
+               for name, (dimacs, alloptions_file) in formulas.items()}
+
+
+def _check_config(task):
+    """Checks a .config in a worker process"""
+    name, text = task
+    checker = _worker[name]
+    sat, step, core = checker.check_all([utils.parse_config(text)])[0]
+    return {"sat": bool(sat),
+            "last_clause": step[1] if step else None,
+            "in": step[4] if step else None,
+            "core": config_check.core_names(
+                core, checker.get_dimacs().get_variables())
+            if core is not None else None}
+
+
+def _check_values(task):
+    """Checks values of symbols in a worker process"""
+    name, dvalues = task
+    checker = _worker[name]
+    sat, core = checker.check_values(dvalues)
+    return {"sat": bool(sat),
+            "core": config_check.core_names(
+                core, checker.get_dimacs().get_variables())
+            if core is not None else None}
+
+
+class Counters:
+    """Counters gathers the latency and throughput of the queries, per
+    endpoint. They are shared by the request threads.
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self.__lock = threading.Lock()
+        self.__start = time.monotonic()
+        self.__endpoints = dict()
+
+    def record(self, endpoint, seconds, ok=True):
+        """Records a query
+
+        :param endpoint: endpoint of the query
+        :type endpoint: str
+        :param seconds: latency of the query
+        :type seconds: float
+        :param ok: whether the query was answered
+        :type ok: bool
+        """
+        with self.__lock:
+            counts = self.__endpoints.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                "window": deque(maxlen=LATENCY_WINDOW)})
+            counts["requests"] += 1
+            counts["errors"] += not ok
+            counts["total"] += seconds
+            counts["max"] = max(counts["max"], seconds)
+            counts["window"].append(seconds)
+
+    def get(self):
+        """Gives the counters
+
+        :return: uptime and, per endpoint, number of requests and errors,
+                 requests per second, mean, median, 99th percentile and max
+                 latencies in milliseconds
+        :rtype: dict
+        """
+        with self.__lock:
+            uptime = time.monotonic() - self.__start
+            endpoints = dict()
+            for endpoint, counts in self.__endpoints.items():
+                window = sorted(counts["window"])
+                endpoints[endpoint] = {
+                    "requests": counts["requests"],
+                    "errors": counts["errors"],
+                    "per_second": counts["requests"] / uptime,
+                    "mean_ms": 1000 * counts["total"] / counts["requests"],
+                    "p50_ms": 1000 * window[len(window) // 2],
+                    "p99_ms": 1000 * window[(99 * len(window)) // 100],
+                    "max_ms": 1000 * counts["max"]}
+        return {"uptime": uptime, "endpoints": endpoints}
+
+
+class CheckServer:
+    """CheckServer keeps checkers warm for several formulas.
+
+    Each formula is preprocessed once and a pool of worker processes, each
+    holding one checker (and solver) per formula, answers the queries.
+
+    :param formulas: {name: (DIMACS file, alloptions csv file)}
+    :type formulas: dict
+    :param jobs: number of worker processes, i.e. of solvers per formula
+    :type jobs: int
+    :param verbose: verbosity
+    :type verbose: bool
+    """
+
+    def __init__(self, formulas, jobs=1, verbose=False):
+        """Constructor"""
+        self.__formulas = dict(formulas)
+        self.__counters = Counters()
+        simplifications = dict()
+        for name, (dimacs, alloptions_file) in self.__formulas.items():
+            fla = utils.DimacsFla(dimacs)
+            symbols = utils.symbol_types(fla,
+                                         utils.Alloptions(alloptions_file))
+            simplifications[name] = preprocess.Simplification(
+                fla.get_formula().clauses, utils.symbol_variables(symbols))
+            if verbose:
+                print("* {}: {}".format(name, preprocess.report(
+                    simplifications[name])))
+        self.__pool = Pool(jobs, initializer=_init_worker,
+                           initargs=(self.__formulas, simplifications))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stops the worker processes"""
+        self.__pool.terminate()
+        self.__pool.join()
+
+    def get_formulas(self):
+        """Gives the names of the formulas
+
+        :return: names
+        :rtype: list
+        """
+        return list(self.__formulas)
+
+    def get_counters(self):
+        """Gives the counters of the queries
+
+        :return: counters
+        :rtype: Counters
+        """
+        return self.__counters
+
+    def __query(self, endpoint, function, name, arg):
+        if name not in self.__formulas:
+            raise NotFound("unknown formula {}".format(name))
+        start = time.perf_counter()
+        ok = False
+        try:
+            res = self.__pool.apply(function, ((name, arg),))
+            ok = True
+            return res
+        finally:
+            self.__counters.record(endpoint, time.perf_counter() - start, ok)
+
+    def check(self, name, text):
+        """Checks a configuration
+
+        :param name: name of the formula
+        :type name: str
+        :param text: content of the .config
+        :type text: str
+        :return: sat, last_clause, in and core (as in
+                 :func:`config_check.batch_check`)
+        :rtype: dict
+        :raises NotFound: if the formula is unknown
+        """
+        return self.__query("check", _check_config, name, text)
+
+    def check_values(self, name, dvalues):
+        """Checks whether symbols can take values together
+
+        :param name: name of the formula
+        :type name: str
+        :param dvalues: {symbol: 'y', 'm' or 'n'}
+        :type dvalues: dict
+        :return: sat and core
+        :rtype: dict
+        :raises NotFound: if the formula is unknown
+        :raises ValueError: if a symbol or a value is unknown
+        """
+        return self.__query("values", _check_values, name, dvalues)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes the requests to the check server"""
+
+    def do_GET(self):
+        checks = self.server.checks
+        if self.path == "/formulas":
+            self.__reply(200, {"formulas": checks.get_formulas()})
+        elif self.path == "/stats":
+            self.__reply(200, checks.get_counters().get())
+        else:
+            self.__reply(404, {"error": "unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        checks = self.server.checks
+        _, endpoint, name = (self.path.split('/', 2) + [''])[:3]
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if endpoint == "check":
+                res = checks.check(name, body.decode())
+            elif endpoint == "values":
+                dvalues = json.loads(body)
+                if not isinstance(dvalues, dict):
+                    raise ValueError("expected {symbol: value}")
+                res = checks.check_values(name, dvalues)
+            else:
+                raise NotFound("unknown path {}".format(self.path))
+        except NotFound as e:
+            self.__reply(404, {"error": str(e)})
+        except ValueError as e:
+            # unknown symbols and values, malformed bodies
+            self.__reply(400, {"error": str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            self.__reply(500, {"error": "{}: {}".format(type(e).__name__, e)})
+        else:
+            self.__reply(200, res)
+
+    def __reply(self, code, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHTTPServer(ThreadingHTTPServer):
+    """HTTP server over a Unix socket"""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address, 0
+
+
+def serve(checks, port=None, path=None, verbose=False):
+    """Answers the queries until interrupted
+
+    :param checks: check server
+    :type checks: CheckServer
+    :param port: localhost port
+    :type port: int
+    :param path: Unix socket, used instead of the port if given
+    :type path: str
+    :param verbose: log every request
+    :type verbose: bool
+    """
+    if path is not None:
+        if os.path.exists(path):
+            os.remove(path)
+        httpd = _UnixHTTPServer(path, _Handler)
+    else:
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    httpd.checks = checks
+    httpd.verbose = verbose
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if path is not None:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--formula", nargs=3, action="append", required=True,
+                        metavar=("NAME", "DIMACS", "ALLOPTIONS"),
+                        help="formula to load (repeatable)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--port", type=int, default=8421,
+                       help="localhost port")
+    group.add_argument("--socket", type=str, help="Unix socket path")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of solvers per formula")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="verbosity")
+    args = parser.parse_args()
+    formulas = {name: (dimacs, alloptions)
+                for name, dimacs, alloptions in args.formula}
+    with CheckServer(formulas, args.jobs, args.verbose) as checks:
+        print("Serving {} on {}".format(
+            ", ".join(formulas), args.socket or
+            "http://127.0.0.1:{}".format(args.port)), flush=True)
+        serve(checks, args.port, args.socket, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
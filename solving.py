@@ -0,0 +1,174 @@
+"""SOLVING HELPERS"""
+
+import threading
+
+# factor applied to the budgets at each retry
+BUDGET_GROWTH = 10
+
+# bounded retries of a call before it runs without budget
+BUDGET_RETRIES = 2
+
+# pysat backends raced by default (see portfolio.py): Glucose 4, CaDiCaL
+# 1.9.5 and MapleChrono
+RACE_BACKENDS = ("g4", "cd195", "mcb")
+
+# conflicts of the first attempt of a call when racing without a budget
+RACE_CONFLICTS = 10000
+
+
+def first_unsat_step(solver, steps, base=(), core=None):
+    """Finds the first step that makes the assumptions unsatisfiable
+
+    The assumptions ``base + steps[0] + ... + steps[i]`` are checked with a
+    single solve when they are satisfiable. Otherwise, the step ``i`` is
+    located with the unsatisfiable cores, which bound the failing prefix,
+    and a binary search over the prefixes, i.e. in a logarithmic number of
+    solves instead of one solve per step.
+
+    :param solver: solver bootstrapped with the formula
+    :type solver: pysat.solvers.Solver
+    :param steps: literals added at each step
+    :type steps: list
+    :param base: literals assumed before the first step
+    :type base: list
+    :param core: unsatisfiable core of the assumptions of every step, if
+                 already known: the first solve is then skipped
+    :type core: list
+    :return: (index of the first failing step, unsatisfiable core of the
+             assumptions up to this step); (None, None) if every step can be
+             added
+    :rtype: tuple
+    """
+    ends = []
+    assumptions = list(base)
+    step_of = dict()
+    for i, literals in enumerate(steps):
+        for lit in literals:
+            step_of.setdefault(lit, i)
+        assumptions.extend(literals)
+        ends.append(len(assumptions))
+
+    def last_step(core):
+        # step from which every literal of the core is assumed
+        return max([step_of.get(lit, 0) for lit in core or ()],
+                   default=0)
+
+    if core is None:
+        if not steps or solver.solve(assumptions=assumptions):
+            return None, None
+        core = solver.get_core()
+    # a core only made of literals assumed up to step hi is also a core of
+    # the assumptions up to step hi
+    lo, hi = 0, last_step(core)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if solver.solve(assumptions=assumptions[:ends[mid]]):
+            lo = mid + 1
+        else:
+            core = solver.get_core()
+            hi = last_step(core)
+    return hi, core
+
+
+class Budget:
+    """Budget class bounds the solve calls and their retries.
+
+    A call that runs out of budget is retried later with a budget
+    :data:`BUDGET_GROWTH` times as large, up to ``retries`` times, then
+    without any bound.
+
+    :param conflicts: conflicts of the first attempt; None for no bound
+    :type conflicts: int
+    :param seconds: wall time of the first attempt; None for no bound
+    :type seconds: float
+    :param growth: factor applied to the budget at each retry
+    :type growth: float
+    :param retries: bounded retries
+    :type retries: int
+    """
+
+    def __init__(self, conflicts=None, seconds=None, growth=BUDGET_GROWTH,
+                 retries=BUDGET_RETRIES):
+        """Constructor"""
+        self.__conflicts = conflicts
+        self.__seconds = seconds
+        self.__growth = growth
+        self.__retries = retries
+
+    def get_limits(self, attempt):
+        """Gives the limits of an attempt
+
+        :param attempt: 0 for the first attempt, then the retry
+        :type attempt: int
+        :return: (conflicts, seconds), None when they are not bounded; None
+                 if the attempt is not bounded at all
+        :rtype: tuple
+        """
+        if attempt > self.__retries or \
+                (self.__conflicts is None and self.__seconds is None):
+            return None
+        scale = self.__growth ** attempt
+        return (None if self.__conflicts is None
+                else int(self.__conflicts * scale),
+                None if self.__seconds is None else self.__seconds * scale)
+
+
+def solve_limited(solver, assumptions, conflicts=None, seconds=None):
+    """Solves within a conflict and a time budget
+
+    :param solver: solver supporting limited calls (and interruptions for a
+                   time budget)
+    :type solver: pysat.solvers.Solver
+    :param assumptions: assumptions
+    :type assumptions: list
+    :param conflicts: conflicts of the call; None for no bound
+    :type conflicts: int
+    :param seconds: wall time of the call; None for no bound
+    :type seconds: float
+    :return: result of the call, None if the budget ran out
+    :rtype: bool
+    """
+    solver.conf_budget(conflicts if conflicts else -1)
+    if seconds is None:
+        return solver.solve_limited(assumptions=assumptions)
+    timer = threading.Timer(seconds, solver.interrupt)
+    timer.start()
+    try:
+        return solver.solve_limited(assumptions=assumptions,
+                                    expect_interrupt=True)
+    finally:
+        timer.cancel()
+        solver.clear_interrupt()
+
+
+def add_budget_arguments(parser):
+    """Adds the options of the budgets and races to a command line parser"""
+    parser.add_argument("--conflicts", type=int,
+                        help="conflict budget of a solve call, retried with "\
+                        "larger budgets when it runs out")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="time budget of a solve call")
+    parser.add_argument("--retries", type=int, default=BUDGET_RETRIES,
+                        help="bounded retries of a call out of budget")
+    parser.add_argument("--race", type=str, nargs='*', metavar="BACKEND",
+                        help="races the calls out of budget between pysat "\
+                        "backends (default: {})"\
+                        .format(" ".join(RACE_BACKENDS)))
+
+
+def budget_arguments(args):
+    """Gives the budget and the racing backends of the parsed options
+
+    :return: (budget or None, backends or None)
+    :rtype: tuple
+    """
+    race = None
+    if args.race is not None:
+        race = args.race or RACE_BACKENDS
+    conflicts = args.conflicts
+    if race and conflicts is None and args.timeout is None:
+        conflicts = RACE_CONFLICTS
+    if conflicts is None and args.timeout is None:
+        return None, race
+    return Budget(conflicts, args.timeout,
+                  retries=args.retries), race
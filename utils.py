@@ -1,41 +1,75 @@
 """Utils"""
 
+import csv
+import os
 import re
-import pandas as pd
+import numpy as np
 from pysat.formula import CNF
+import dimacsio
+
+# ``CONFIG_X=value`` and ``# CONFIG_X is not set`` lines of a .config
+CONFIG_LINE = re.compile(r'^CONFIG_(\w+)=(.*?)[ \t\r]*$', re.M)
+NOT_SET_LINE = re.compile(r'^# CONFIG_(\w+) is not set[ \t\r]*$', re.M)
+
+# values of the symbols in a configuration matrix (see config_matrix)
+CONFIG_ABSENT, CONFIG_Y, CONFIG_M, CONFIG_NOT_SET, CONFIG_OTHER = \
+    0, 1, 2, -1, 3
+CONFIG_CODES = {'y': CONFIG_Y, 'm': CONFIG_M, 'n': CONFIG_NOT_SET}
+
+# alloptions files left to pandas (see read_alloptions)
+COMPRESSED = (".gz", ".bz2", ".zip", ".xz", ".zst", ".tar")
 
 class DimacsFla:
     """DimacsFla class represents the DIMACS formula of the current Linux Kernel.
 
     :param dimacs: path to the file of the formula in dimacs format
     :type dimacs: str
+    :param cache_dir: cache of parsed formulas (see :mod:`dimacsio`); None to
+                      parse the file
+    :type cache_dir: str
     """
     
-    def __init__(self, dimacs):
+    def __init__(self, dimacs, cache_dir=dimacsio.CACHE_DIR):
         """Constructor
         """
-        self.__dimacs = self._dimacs_read(dimacs)
-        self.__formula = CNF(dimacs)
+        self.__parsed = dimacsio.load(dimacs, cache_dir)
+        self.__dimacs = self._dimacs_read(self.__parsed)
+        self.__formula = None
+        self.__nb_vars = None
+        self._build_index()
 
-    def _dimacs_read(self, dimacs):
-        """Read a dimacs file
+    def _dimacs_read(self, parsed):
+        """Read the symbol table of a dimacs file
 
-        :param dimacs: Dimacs format file
-        :type dimacs: str
+        :param parsed: parsed Dimacs format file
+        :type parsed: dimacsio.Formula
         :return: dictionary {variable: feature}
         :rtype: dict
         """
         variables = dict()
-        with open(dimacs, 'r') as f:
-            dimacs_lines = f.readlines()
-            for line in dimacs_lines:
-                if line.startswith("c"):
-                    m = re.search('(c) (\d+) (\w+)', line)
-                    var_id = int(m.group(2))
-                    var_name = m.group(3)  
-                    variables[var_id] = var_name
+        for var_id, var_name in parsed.get_symbols().items():
+            m = re.match(r'\w+', var_name)
+            variables[var_id] = m.group(0)
         return variables
 
+    def _build_index(self):
+        """Build the symbol index once so that every lookup is O(1)
+
+        The index holds name -> ID (first occurrence, as the formula may
+        contain several variables for the same symbol), symbol -> ID of its
+        ``{symbol}_MODULE`` variable and the set of dummy variables
+        (``_MODULE`` and ``CHOICE_`` helpers that are not Linux options).
+        """
+        self.__ids = dict()
+        self.__kmodules = dict()
+        self.__dummies = set()
+        for var_id, var_name in self.__dimacs.items():
+            self.__ids.setdefault(var_name, var_id)
+            if var_name.endswith("_MODULE"):
+                self.__kmodules.setdefault(var_name[:-len("_MODULE")], var_id)
+            if var_name.endswith("_MODULE") or "CHOICE_" in var_name:
+                self.__dummies.add(var_name)
+
     def get_variables(self):
         """Gives the dictionary of {id: variable}
         
@@ -45,12 +79,50 @@ class DimacsFla:
         return self.__dimacs
 
     def get_formula(self):
-        """Gives the formula
+        """Gives the formula, built on first call
         :return: formula
         :rtype: pysat.formula.CNF
         """
+        if self.__formula is None:
+            self.__formula = CNF()
+            self.__formula.clauses = self.__parsed.get_clauses()
+            self.__formula.nv = self.get_nb_vars()
         return self.__formula
+
+    def get_nb_vars(self):
+        """Gives the largest variable of the clauses, without building the
+        formula
+
+        :return: largest DIMACS ID used by a clause, 0 if none
+        :rtype: int
+        """
+        if self.__nb_vars is None:
+            literals = self.__parsed.literals
+            self.__nb_vars = int(np.abs(literals).max()) \
+                if len(literals) else 0
+        return self.__nb_vars
     
+    def get_nb_declared(self):
+        """Gives the number of variables of the formula, including those
+        declared by the p line or a comment but used by no clause
+
+        :return: largest DIMACS ID of the p line, the comments and the
+                 clauses
+        :rtype: int
+        """
+        return self.__parsed.get_nb_declared()
+
+    def get_clause_array(self):
+        """Gives the clauses as flat NumPy arrays
+
+        The literals of clause ``i`` are
+        ``literals[offsets[i]:offsets[i + 1]]``.
+
+        :return: (literals, offsets)
+        :rtype: tuple
+        """
+        return self.__parsed.literals, self.__parsed.offsets
+
     def get_kmodule(self, symbol):
         """Retrieve the DIMACS ID of module variable associated with the given 
         symbol.
@@ -60,9 +132,7 @@ class DimacsFla:
         :return: {symbol}_MODULE ID iff symbol is a modyle; None otherwise
         :rtype: int iff symbol is a module; NoneType otherwise
         """
-        for k, v in self.__dimacs.items():
-            if v == "{}_MODULE".format(symbol):
-                return k
+        return self.__kmodules.get(symbol)
 
     def get_symbol(self, id):
         """Retrieve symbol name with its ID
@@ -82,9 +152,19 @@ class DimacsFla:
         :return: DIMACS ID iff symbol in formula; None otherwise
         :rtype: int iff symbol in formula; NoneType otherswise
         """
-        for k, v in variables.items():
-            if v == symbol:
-                return v
+        return self.__ids.get(symbol)
+
+    def is_dummy(self, symbol):
+        """Tell whether a symbol is a dummy variable of the formula, i.e. a
+        ``_MODULE`` variable emulating tristates or a ``CHOICE_`` variable
+        emulating choices. Those are not Linux options.
+
+        :param symbol: symbol name
+        :type symbol: str
+        :return: True iff the symbol is a dummy variable
+        :rtype: bool
+        """
+        return symbol in self.__dummies
 
 
 class Alloptions:
@@ -99,7 +179,15 @@ class Alloptions:
 
     def __init__(self, alloptions):
         """Constructor method"""
-        self.__alloptions = pd.read_csv(alloptions)
+        # option -> type and type -> options, built once: lookups are then
+        # hash probes instead of a DataFrame query per symbol
+        self.__types = dict()
+        self.__options_by_type = dict()
+        for option, ktype in read_alloptions(alloptions):
+            if option not in self.__types:
+                self.__types[option] = ktype
+                self.__options_by_type.setdefault(ktype, set()).add(option)
+        self.__options = set(self.__types)
 
     def get_options(self):
         """Gives the set of options
@@ -107,7 +195,17 @@ class Alloptions:
         :return: options and their types
         :rtype: set
         """
-        return set(self.__alloptions.option)
+        return self.__options
+
+    def get_options_of_type(self, ktype):
+        """Gives the set of options of a given kconfig type
+
+        :param ktype: kconfig type (BOOL, TRISTATE, STRING, INT, HEX)
+        :type ktype: str
+        :return: options of this type
+        :rtype: set
+        """
+        return self.__options_by_type.get(ktype, set())
     
     def get_kconfig_type(self, symbol):
         """Retrieve the type of a kconfig symbol
@@ -117,26 +215,167 @@ class Alloptions:
         :return: type of the option
         :rtype: str
         """
-        ktype = self.__alloptions\
-                    .query("option == " + '"' + symbol + '"')['type']
-        return ktype.values[0]
+        return self.__types[symbol]
+
+
+def read_alloptions(alloptions):
+    """Reads the (option, type) rows of an alloptions csv
+
+    Plain local files are read with the csv module; pandas, imported then,
+    reads the others (URLs, compressed files).
+
+    :param alloptions: csv file with ``option`` and ``type`` columns
+    :type alloptions: str
+    :return: (option, type) pairs in file order
+    :rtype: list
+    """
+    if os.path.isfile(alloptions) and not alloptions.endswith(COMPRESSED):
+        with open(alloptions, 'r', newline='', encoding='utf-8-sig') \
+                as stream:
+            reader = csv.reader(stream)
+            header = next(reader, [])
+            if "option" in header and "type" in header:
+                i, j = header.index("option"), header.index("type")
+                return [(row[i], row[j]) for row in reader if row]
+            raise ValueError("{}: no option and type columns"
+                             .format(alloptions))
+    import pandas as pd
+    df = pd.read_csv(alloptions)
+    return list(zip(df.option, df.type))
 
 
-def read_config(config):
+def symbol_types(dimacs, alloptions):
+    """Lists the BOOL and TRISTATE symbols of the formula
+
+    :param dimacs: formula
+    :type dimacs: DimacsFla
+    :param alloptions: all options
+    :type alloptions: Alloptions
+    :return: list of (id, symbol, kconfig type, module ID) in formula order
+    :rtype: list
+    """
+    options = alloptions.get_options()
+    symbols = []
+    for k, v in dimacs.get_variables().items():
+        if dimacs.is_dummy(v) or v not in options:
+            continue    # ignore
+        kconfig_type = alloptions.get_kconfig_type(v)
+        if kconfig_type == "TRISTATE":
+            symbols.append((k, v, kconfig_type, dimacs.get_kmodule(v)))
+        elif kconfig_type == "BOOL":
+            symbols.append((k, v, kconfig_type, None))
+    return symbols
+
+
+def symbol_variables(symbols):
+    """Lists the variables of symbols: their own and their _MODULE variables
+
+    :param symbols: symbols as given by :func:`symbol_types`
+    :type symbols: list
+    :return: DIMACS IDs
+    :rtype: list
+    """
+    variables = []
+    for k, v, kconfig_type, kmodule in symbols:
+        variables.append(k)
+        if kmodule is not None:
+            variables.append(kmodule)
+    return variables
+
+
+def parse_config(lines, not_set=False):
+    """Parse the lines of a config
+
+    ``CONFIG_X=value`` lines give the value as written, quotes of string
+    values included; other lines are ignored.
+
+    :param lines: lines of a `.config` file, or its whole text
+    :type lines: iterable
+    :param not_set: give the 'n' value to the ``# CONFIG_X is not set``
+                    symbols; they are left out otherwise
+    :type not_set: bool
+    :return: a dictionary representation of the `.config` file.
+    :rtype: dict
+    """
+    text = lines if isinstance(lines, str) else "\n".join(lines)
+    d = dict.fromkeys(NOT_SET_LINE.findall(text), 'n') if not_set \
+        else dict()
+    d.update(CONFIG_LINE.findall(text))
+    return d
+
+
+def read_config(config, not_set=False):
     """Read a config
 
     :param config_file: path to a `.config` file
     :type config_file: string
+    :param not_set: give the 'n' value to the ``# CONFIG_X is not set``
+                    symbols; they are left out otherwise
+    :type not_set: bool
     :return: a dictionary representation of the `.config` file.
     :rtype: dict
 
     """
-    d = dict()
     with open(config, 'r') as f:
-        line = f.readline()
-        while line:
-            if not line.startswith('#') and line != '\n':
-                m = re.search(r'CONFIG_(\w+)=([\w"-/]+)', line)
-                d[m.group(1)] = m.group(2)
-            line = f.readline()
-    return d
+        return parse_config(f.read(), not_set)
+
+
+def write_config(dconfig, config):
+    """Write a config
+
+    :param dconfig: a dictionary representation of a `.config` file, the
+                    'n' value being written as ``# CONFIG_X is not set``
+    :type dconfig: dict
+    :param config: path to the `.config` file
+    :type config: str
+    """
+    with open(config, 'w') as f:
+        for symbol, value in dconfig.items():
+            if value == 'n':
+                f.write("# CONFIG_{} is not set\n".format(symbol))
+            else:
+                f.write("CONFIG_{}={}\n".format(symbol, value))
+
+
+def _config_matrix(dimacs, nb_configs):
+    """Empty configuration matrix and the DIMACS IDs of each name"""
+    ids = dict()
+    for k, v in dimacs.get_variables().items():
+        ids.setdefault(v, []).append(k)
+    nb_vars = max(dimacs.get_nb_vars(), max(dimacs.get_variables(),
+                                             default=0))
+    return np.zeros((nb_vars + 1, nb_configs), dtype=np.int8,
+                    order='F'), ids
+
+
+def _set_column(matrix, j, dconfig, ids):
+    """Sets the column of a configuration in a configuration matrix"""
+    rows = []
+    codes = []
+    for v, value in dconfig.items():
+        for k in ids.get(v, ()):
+            rows.append(k)
+            codes.append(CONFIG_CODES.get(value, CONFIG_OTHER))
+    matrix[rows, j] = codes
+
+
+def config_matrix(dconfigs, dimacs):
+    """Loads configurations in a matrix of symbols x configurations
+
+    Cell ``[k, j]`` holds the value of the symbol of DIMACS ID ``k`` in the
+    ``j``-th configuration, as a ``CONFIG_`` code. Every variable of a
+    symbol's name gets its value; helper variables stay
+    :data:`CONFIG_ABSENT`.
+
+    :param dconfigs: configurations as given by :func:`read_config`
+    :type dconfigs: list
+    :param dimacs: formula
+    :type dimacs: DimacsFla
+    :return: matrix of shape (variables + 1, configurations)
+    :rtype: numpy.ndarray
+    """
+    matrix, ids = _config_matrix(dimacs, len(dconfigs))
+    for j, dconfig in enumerate(dconfigs):
+        _set_column(matrix, j, dconfig, ids)
+    return matrix
+